@@ -0,0 +1,280 @@
+"""
+Benchmarks of the KPI engine on synthetic data (benchmarks/synthetic.py).
+
+Run from the repository root:
+    python benchmarks/kpi_engine.py [--machines 100 --kpis 50 --days 730]
+        [--database-url mongodb://localhost:27017 | --mock] [--reseed]
+        [--ops sum avg p90] [--granularities day month] [--filter TEXT]
+        [--repeat 5] [--output FILE] [--compare BASELINE.json]
+
+The dataset is generated in BENCHMARK_DATABASE_NAME (kpi_benchmark by
+default) and reused by the next runs with the same scale and storage
+backend. --mock uses an in-process mongomock_motor database instead of a
+server: only a smoke test of the suite, many pipelines are not supported by
+it and the timings mean nothing.
+
+Every case calls the kpi service like a request would, with the result
+cache emptied before each run: the timings are the ones of a computation,
+not of a cache hit. Each run also counts the database commands, documents
+and bytes (src.core.db_timing). The applyAggregationOpToMachinesKpi cases
+only time the site aggregation of --align-machines in-memory series of
+--align-buckets buckets. The results are written as JSON to
+benchmarks/results/ and --compare prints the ratio of the medians to a
+previous result file, exiting with 1 when a case is slower than
+--threshold times its baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath("."))
+sys.path.append(os.path.abspath("benchmarks"))
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.core.db_timing import RequestDbStats, current_db_stats, db_command_listener
+from src.plugins.kpi import repository as kpiRepository
+from src.plugins.kpi import service as kpiService
+from src.plugins.kpi.schema import ComputedValue
+from synthetic import Scale, generate, loadDataset
+
+BENCHMARK_DATABASE_URL = os.getenv("BENCHMARK_DATABASE_URL", "mongodb://localhost:27017")
+BENCHMARK_DATABASE_NAME = os.getenv("BENCHMARK_DATABASE_NAME", "kpi_benchmark")
+RESULTS_DIR = "benchmarks/results"
+
+# (days, unit) of each granularity
+GRANULARITIES = {
+    "index-7": (7, None),
+    "day": (1, "day"),
+    "week": (1, "week"),
+    "month": (1, "month"),
+    "window-30": (30, "window"),
+}
+# number of days before the end of the dataset, None for all of it
+RANGES = {"90d": 90, "full": None}
+
+
+def connect(args):
+    if args.mock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError as e:
+            raise ImportError("the mongomock_motor package is required to use --mock") from e
+        return AsyncMongoMockClient()
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(args.database_url, event_listeners=[db_command_listener])
+
+
+def buildCases(dataset, args):
+    """(name, parameters, coroutine function of a request) of each benchmark."""
+    site_id = min(dataset.sites)
+    machine_id = dataset.machines[0]
+    atomic_id = next(iter(dataset.kpis.values()))
+    composite_id = next(iter(dataset.composites.values()), None)
+    cases = []
+    for range_name in args.ranges:
+        days = RANGES[range_name]
+        start = dataset.start_date if days is None else dataset.end_date - timedelta(days=days)
+        end = dataset.end_date
+        for kind, kpi_id in [("atomic", atomic_id), ("composite", composite_id)]:
+            if kpi_id is None:
+                continue
+            for op in args.ops:
+                for granularity in args.granularities:
+                    granularity_days, unit = GRANULARITIES[granularity]
+                    parameters = {"kpi": kind, "op": op, "granularity": granularity, "range": range_name}
+                    cases.append((
+                        f"computeKPIByMachine/{kind}/{op}/{granularity}/{range_name}",
+                        {"function": "computeKPIByMachine", **parameters},
+                        lambda request, kpi_id=kpi_id, start=start, op=op, granularity_days=granularity_days, unit=unit: kpiService.computeKPIByMachine(
+                            request, machine_id, kpi_id, start, end, granularity_days, op, unit, args.backend
+                        )
+                    ))
+                    cases.append((
+                        f"computeKPIBySite/{kind}/{op}/{granularity}/{range_name}",
+                        {"function": "computeKPIBySite", **parameters},
+                        lambda request, kpi_id=kpi_id, start=start, op=op, granularity_days=granularity_days, unit=unit: kpiService.computeKPIBySite(
+                            request, site_id, kpi_id, None, start, end, granularity_days, op, unit, args.backend
+                        )
+                    ))
+        kpi_names = [*list(dataset.kpis)[:args.report_kpis], *dataset.composites]
+        for op in args.ops:
+            if op not in ["sum", "avg", "min", "max"]:
+                continue
+            cases.append((
+                f"computeKPIForReport/{len(kpi_names)}kpis/{op}/{range_name}",
+                {"function": "computeKPIForReport", "kpis": len(kpi_names), "op": op, "range": range_name},
+                lambda request, start=start, op=op: kpiService.computeKPIForReport(
+                    request, site_id, start, end, None, op, kpi_names=kpi_names
+                )
+            ))
+    # site aggregation of already computed series, without the database
+    series = alignmentSeries(args.align_machines, args.align_buckets, dataset.start_date)
+    for op in args.ops:
+        async def aggregate(request, op=op):
+            return kpiService.applyAggregationOpToMachinesKpi(op, series)
+        cases.append((
+            f"applyAggregationOpToMachinesKpi/{args.align_machines}x{args.align_buckets}/{op}",
+            {"function": "applyAggregationOpToMachinesKpi", "machines": args.align_machines, "buckets": args.align_buckets, "op": op},
+            aggregate
+        ))
+    return [case for case in cases if args.filter is None or args.filter in case[0]]
+
+
+def alignmentSeries(machines, buckets, start_date):
+    """Hourly series of each machine, each missing about 1% of the buckets."""
+    rng = np.random.default_rng(0)
+    series = []
+    for machine in range(machines):
+        kept = np.flatnonzero(rng.random(buckets) > 0.01)
+        values = rng.uniform(0, 100, len(kept))
+        series.append([
+            ComputedValue(value=value, start_date=start_date + timedelta(hours=int(hour)), end_date=start_date + timedelta(hours=int(hour) + 1))
+            for hour, value in zip(kept, values)
+        ])
+    return series
+
+
+async def runCase(request, call, warmup, repeat):
+    durations, stats = [], []
+    for run in range(warmup + repeat):
+        await kpiService.result_cache.clear()
+        run_stats = RequestDbStats()
+        token = current_db_stats.set(run_stats)
+        started = time.perf_counter()
+        try:
+            await call(request)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            current_db_stats.reset(token)
+        if run >= warmup:
+            durations.append(elapsed)
+            stats.append(run_stats.fields())
+    return {
+        "runs_ms": [round(duration, 3) for duration in durations],
+        "min_ms": round(min(durations), 3),
+        "median_ms": round(statistics.median(durations), 3),
+        "mean_ms": round(statistics.mean(durations), 3),
+        "p95_ms": round(float(np.percentile(durations, 95)), 3),
+        "max_ms": round(max(durations), 3),
+        "db_commands": stats[-1]["db_commands"],
+        "db_documents": stats[-1]["db_documents"],
+        "db_bytes": stats[-1]["db_bytes"],
+    }
+
+
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {case["name"]: case for case in json.load(f)["results"]}
+    regressions = 0
+    print(f"\n{'case':<70} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for case in results:
+        before = baseline.get(case["name"])
+        if before is None or "median_ms" not in before or "median_ms" not in case:
+            continue
+        ratio = case["median_ms"] / before["median_ms"] if before["median_ms"] else float("inf")
+        flag = " <" if ratio > threshold else ""
+        regressions += ratio > threshold
+        print(f"{case['name']:<70} {before['median_ms']:>10.1f} {case['median_ms']:>10.1f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+async def benchmark(args):
+    scale = Scale(sites=args.sites, machines=args.machines, kpis=args.kpis, composites=args.composites, days=args.days, seed=args.seed)
+    client = connect(args)
+    db = client[args.database]
+    request = SimpleNamespace(app=SimpleNamespace(mongodb=db), state=SimpleNamespace())
+
+    dataset = None if args.reseed else await loadDataset(db, scale)
+    if dataset is None:
+        print(f"Generating {scale.points} data points in {args.database}...")
+        started = time.perf_counter()
+
+        def progress(done, total):
+            print(f"\r  {done}/{total} series", end="", flush=True)
+
+        dataset = await generate(db, scale, progress=progress)
+        print(f"\n  done in {time.perf_counter() - started:.1f}s")
+    else:
+        print(f"Reusing the dataset of {args.database}")
+
+    results = []
+    for name, parameters, call in buildCases(dataset, args):
+        try:
+            result = await runCase(request, call, args.warmup, args.repeat)
+            print(f"{name:<70} {result['median_ms']:>10.1f} ms  {result['db_commands']:>4} cmds")
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+            print(f"{name:<70} ERROR {result['error']}")
+        results.append({"name": name, **parameters, **result})
+    client.close()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": gitRevision(),
+            "python": platform.python_version(),
+            "database": "mongomock" if args.mock else "mongodb",
+            "storage_backend": kpiRepository.KPI_STORAGE_BACKEND,
+            "compute_backend": args.backend or kpiRepository.KPI_COMPUTE_BACKEND,
+            "scale": vars(scale),
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the KPI engine on synthetic data")
+    parser.add_argument("--database-url", default=BENCHMARK_DATABASE_URL)
+    parser.add_argument("--database", default=BENCHMARK_DATABASE_NAME)
+    parser.add_argument("--mock", action="store_true", help="use an in-process mongomock_motor database")
+    parser.add_argument("--reseed", action="store_true", help="generate the dataset even if it exists")
+    parser.add_argument("--sites", type=int, default=1)
+    parser.add_argument("--machines", type=int, default=100)
+    parser.add_argument("--kpis", type=int, default=50)
+    parser.add_argument("--composites", type=int, default=5)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ops", nargs="+", default=["sum", "avg", "p90"])
+    parser.add_argument("--granularities", nargs="+", choices=list(GRANULARITIES), default=["index-7", "day", "month", "window-30"])
+    parser.add_argument("--ranges", nargs="+", choices=list(RANGES), default=list(RANGES))
+    parser.add_argument("--report-kpis", type=int, default=10, help="atomic kpis of the report cases, with all the composites")
+    parser.add_argument("--backend", choices=kpiRepository.COMPUTE_BACKENDS, default=None, help="compute backend, KPI_COMPUTE_BACKEND by default")
+    parser.add_argument("--align-machines", type=int, default=100, help="machines of the site aggregation cases")
+    parser.add_argument("--align-buckets", type=int, default=10000, help="buckets per machine of the site aggregation cases")
+    parser.add_argument("--filter", default=None, help="only the cases whose name contains this text")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help=f"result file, in {RESULTS_DIR} by default")
+    parser.add_argument("--compare", default=None, help="result file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio of the medians flagged as a regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(args))
+    output = args.output or os.path.join(RESULTS_DIR, f"kpi_engine-{datetime.now():%Y%m%d-%H%M%S}-{report['meta']['revision'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        sys.exit(1 if compare(report["results"], args.compare, args.threshold) else 0)
@@ -0,0 +1,483 @@
+"""
+End-to-end HTTP load test of the API, with a weighted mix of requests.
+
+Run from the repository root:
+    python benchmarks/load_test.py [--base-url http://127.0.0.1:8000/ | --start-app]
+        [--rps 50 | --concurrency 20] [--duration 60] [--warmup 5]
+        [--mix benchmarks/load_mix.json] [--filter TEXT] [--dataset] [--var site_id=1]
+        [--users 10 --seed-users] [--llm-latency 0.5] [--output FILE]
+    python benchmarks/load_test.py --from-collection "Smart app.postman_collection.json" > mix.json
+
+The mix (benchmarks/load_mix.json) lists the requests with their weight; the
+{placeholders} of their paths, parameters and bodies are filled with the
+ids of the benchmark dataset (--dataset, generated by benchmarks/kpi_engine.py
+in BENCHMARK_DATABASE_NAME), the --var values, and a fresh {uuid}.
+--from-collection prints a raw mix from the requests of a Postman collection,
+to be weighted and updated to the current routes by hand.
+
+The app runs without any external service:
+- AUTH_MODE=fake with ALLOW_FAKE_AUTH=1, on a loopback address: the
+  requests send "Bearer fake:loadtest-<n>[:<role>]" tokens, one per
+  simulated user (--users), and --seed-users upserts their documents in
+  the users collection of DATABASE_URL/DATABASE_NAME;
+- OPENAI_BASE_URL points to a stub of the chat completions API, served by
+  this script on --llm-port, answering after --llm-latency seconds;
+- REPORT_STORAGE=local writes the report PDFs to data/report_storage.
+--start-app starts uvicorn with these variables (and the ones of the
+environment, DATABASE_NAME=BENCHMARK_DATABASE_NAME with --dataset) and
+stops it at the end; otherwise start the app with them yourself, the stub
+keeps running while the test runs.
+
+--rps sends the requests at a fixed rate whatever the latency (open loop),
+--concurrency keeps that many requests in flight (closed loop). A request
+fails on a connection error or timeout, an HTTP status >= 400, or a
+{"success": false} body (the controllers answer 200 on most errors). The
+latency percentiles, throughput and error rate of each request of the mix
+are printed and written as JSON to benchmarks/results/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+sys.path.append(os.path.abspath("."))
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BENCHMARK_DATABASE_URL = os.getenv("BENCHMARK_DATABASE_URL", "mongodb://localhost:27017")
+BENCHMARK_DATABASE_NAME = os.getenv("BENCHMARK_DATABASE_NAME", "kpi_benchmark")
+API_VERSION = os.getenv("VERSION", "v1.0")
+RESULTS_DIR = "benchmarks/results"
+MIX_FILE = "benchmarks/load_mix.json"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+STUB_COMPLETION = (
+    "# Report\n\n## Executive Summary\n\nGenerated by the load test stub.\n\n"
+    "| KPI Name | Value |\n| -------- | ----- |\n| *stub* | 1.0 |\n"
+)
+
+
+# --- stub of the OpenAI chat completions API ---
+
+async def serveLLMStub(reader, writer, latency):
+    """Minimal HTTP/1.1 keep-alive server answering every POST with a completion."""
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            headers = dict(
+                line.split(":", 1) for line in head.decode("latin-1").split("\r\n")[1:] if ":" in line
+            )
+            length = int(next((value for key, value in headers.items() if key.strip().lower() == "content-length"), 0))
+            body = json.loads(await reader.readexactly(length) or b"{}")
+            await asyncio.sleep(latency)
+            prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+            payload = json.dumps({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_COMPLETION}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 40, "total_tokens": prompt_tokens + 40},
+            }).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def startLLMStub(port, latency):
+    return await asyncio.start_server(lambda reader, writer: serveLLMStub(reader, writer, latency), "127.0.0.1", port)
+
+
+# --- app ---
+
+def appEnvironment(args):
+    env = {
+        **os.environ,
+        "AUTH_MODE": "fake",
+        "ALLOW_FAKE_AUTH": "1",
+        "REPORT_STORAGE": "local",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "OPENAI_API_KEY": "load-test",
+    }
+    if args.dataset:
+        env["DATABASE_URL"] = args.database_url
+        env["DATABASE_NAME"] = args.database
+    return env
+
+
+async def startApp(args):
+    port = urlsplit(args.base_url).port or 8000
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=appEnvironment(args)
+    )
+    async with httpx.AsyncClient() as client:
+        for _ in range(120):
+            if process.poll() is not None:
+                raise RuntimeError(f"the app exited with code {process.returncode}")
+            try:
+                await client.get(args.base_url)
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"the app did not answer on {args.base_url}")
+
+
+def seedUsers(args, env):
+    from pymongo import MongoClient
+    client = MongoClient(env["DATABASE_URL"])
+    users = client[env["DATABASE_NAME"]]["users"]
+    for index in range(args.users):
+        uid = f"loadtest-{index}"
+        users.update_one({"uid": uid}, {"$set": {
+            "uid": uid,
+            "email": f"{uid}@example.com",
+            "site": int(args.vars.get("site_id", 1)),
+            "first_name": "Load",
+            "last_name": f"Test {index}",
+            "phone_number": "0000000000",
+        }}, upsert=True)
+    client.close()
+
+
+# --- mix ---
+
+def loadMix(path, filter):
+    with open(path) as f:
+        requests = json.load(f)["requests"]
+    requests = [request for request in requests if request.get("weight", 1) > 0 and (filter is None or filter in request["name"])]
+    if not requests:
+        raise ValueError(f"no request of {path} matches the filter")
+    return requests
+
+
+def mixFromCollection(path):
+    """Raw mix of the requests of a Postman collection, with weight 1 and the path after /api/<version>."""
+    with open(path) as f:
+        collection = json.load(f)
+    requests = []
+
+    def walk(items, folder):
+        for item in items:
+            if "item" in item:
+                walk(item["item"], item["name"])
+                continue
+            request = item.get("request", {})
+            url = request.get("url")
+            raw = url.get("raw") if isinstance(url, dict) else url
+            if not raw:
+                continue
+            parts = urlsplit(re.sub(r"\{\{(\w+)\}\}", r"{\1}", raw))
+            entry = {
+                "name": f"{folder} {item['name']}".lower(),
+                "weight": 1,
+                "method": request.get("method", "GET"),
+                "path": re.sub(r"^.*?/api/[^/]+", "", parts.path) or "/",
+            }
+            params = dict(pair.split("=", 1) for pair in parts.query.split("&") if "=" in pair)
+            if params:
+                entry["params"] = params
+            body = request.get("body", {})
+            if body.get("mode") == "raw" and body.get("raw"):
+                try:
+                    entry["json"] = json.loads(body["raw"])
+                except ValueError:
+                    pass
+            requests.append(entry)
+
+    walk(collection["item"], "")
+    return {"description": f"Derived from {os.path.basename(path)}", "requests": requests}
+
+
+async def datasetVars(args):
+    """Placeholder values taken from the benchmark dataset of benchmarks/kpi_engine.py."""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(args.database_url)
+    document = await client[args.database]["benchmark_dataset"].find_one({"_id": "dataset"})
+    client.close()
+    if document is None:
+        raise ValueError(f"no benchmark dataset in {args.database}, run benchmarks/kpi_engine.py first")
+    kpi_name, kpi_id = next(iter(document["kpis"].items()))
+    return {
+        "site_id": int(min(document["sites"], key=int)),
+        "machine_id": document["machines"][0],
+        "kpi_id": kpi_id,
+        "kpi_name": kpi_name,
+        "start_date": (document["end_date"] - timedelta(days=90)).strftime(DATE_FORMAT),
+        "end_date": document["end_date"].strftime(DATE_FORMAT),
+    }
+
+
+def fill(value, vars):
+    """Replace the {placeholders} of value; a string made of one placeholder takes the type of its value."""
+    if isinstance(value, dict):
+        return {key: fill(item, vars) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, vars) for item in value]
+    if not isinstance(value, str):
+        return value
+    whole = PLACEHOLDER.fullmatch(value)
+    if whole and whole.group(1) in vars:
+        return vars[whole.group(1)]
+    return PLACEHOLDER.sub(lambda match: str(vars.get(match.group(1), match.group(0))), value)
+
+
+def failed(response):
+    if response.status_code >= 400:
+        return f"HTTP {response.status_code}"
+    if "json" not in response.headers.get("content-type", ""):
+        return None
+    # NDJSON streams (kpi batch) carry one result per line
+    for line in response.text.splitlines():
+        try:
+            body = json.loads(line)
+        except ValueError:
+            return "invalid JSON"
+        if isinstance(body, dict) and body.get("success") is False:
+            return f"success=false: {str(body.get('message'))[:80]}"
+    return None
+
+
+# --- load generation ---
+
+class Recorder:
+    def __init__(self, warmup_until):
+        self.warmup_until = warmup_until
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, started, elapsed, error):
+        if started < self.warmup_until:
+            return
+        self.latencies[name].append(elapsed)
+        if error is not None:
+            self.errors[name][error] += 1
+
+
+async def send(client, recorder, request, vars, user):
+    filled = fill(request, {**vars, "uuid": uuid.uuid4().hex[:12]})
+    started = time.perf_counter()
+    try:
+        response = await client.request(
+            request["method"], filled["path"].lstrip("/") if filled["path"] != "/" else "",
+            params=filled.get("params"), json=filled.get("json"),
+            headers={"Authorization": f"Bearer {user}"}
+        )
+        error = failed(response)
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    recorder.record(request["name"], started, (time.perf_counter() - started) * 1000, error)
+
+
+async def run(args, mix, vars):
+    users = [f"fake:loadtest-{index}" + (f":{args.role}" if args.role else "") for index in range(args.users)]
+    rng = random.Random(args.seed)
+    weights = [request.get("weight", 1) for request in mix]
+    started = time.perf_counter()
+    recorder = Recorder(started + args.warmup)
+    deadline = started + args.warmup + args.duration
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    base_url = f"{args.base_url.rstrip('/')}/api/{args.version}/"
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        def nextRequest():
+            return send(client, recorder, rng.choices(mix, weights)[0], vars, rng.choice(users))
+
+        if args.rps:
+            # open loop: the n-th request is sent at n / rps, late or not
+            pending = set()
+            sent = 0
+            while time.perf_counter() < deadline:
+                delay = started + sent / args.rps - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                task = asyncio.create_task(nextRequest())
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                sent += 1
+            await asyncio.gather(*pending)
+        else:
+            async def worker():
+                while time.perf_counter() < deadline:
+                    await nextRequest()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return recorder, time.perf_counter() - recorder.warmup_until
+
+
+def summarize(name, latencies, errors, elapsed):
+    count = len(latencies)
+    failures = sum(errors.values())
+    result = {
+        "name": name,
+        "requests": count,
+        "errors": failures,
+        "error_rate": round(failures / count, 4) if count else 0,
+        "throughput_rps": round(count / elapsed, 3) if elapsed > 0 else 0,
+    }
+    if count:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        result.update({
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(max(latencies), 3),
+        })
+    if errors:
+        result["error_kinds"] = dict(sorted(errors.items(), key=lambda item: -item[1]))
+    return result
+
+
+def printResults(results, total):
+    print(f"\n{'request':<28} {'count':>7} {'rps':>8} {'err%':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for result in [*results, total]:
+        if not result["requests"]:
+            continue
+        print(
+            f"{result['name']:<28} {result['requests']:>7} {result['throughput_rps']:>8.1f} {result['error_rate'] * 100:>6.1f}"
+            f" {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['max_ms']:>9.1f}"
+        )
+    for result in results:
+        for kind, count in result.get("error_kinds", {}).items():
+            print(f"  {result['name']}: {count} x {kind}")
+
+
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def loadTest(args):
+    mix = loadMix(args.mix, args.filter)
+    now = datetime.now().replace(microsecond=0)
+    vars = {
+        "site_id": 1,
+        "start_date": (now - timedelta(days=30)).strftime(DATE_FORMAT),
+        "end_date": now.strftime(DATE_FORMAT),
+    }
+    if args.dataset:
+        vars.update(await datasetVars(args))
+    vars.update(args.vars)
+    missing = {name for request in mix for name in PLACEHOLDER.findall(json.dumps(request))} - {*vars, "uuid"}
+    if missing:
+        raise ValueError(f"no value for {', '.join(sorted(missing))}: use --dataset or --var")
+
+    stub = await startLLMStub(args.llm_port, args.llm_latency)
+    app = None
+    try:
+        if args.start_app:
+            app = await startApp(args)
+        else:
+            async with httpx.AsyncClient() as client:
+                try:
+                    await client.get(args.base_url)
+                except httpx.TransportError as e:
+                    raise RuntimeError(f"the app does not answer on {args.base_url} ({type(e).__name__}), start it or use --start-app") from e
+        if args.seed_users:
+            seedUsers(args, appEnvironment(args))
+        mode = f"{args.rps} requests/s" if args.rps else f"{args.concurrency} concurrent requests"
+        print(f"Load test of {args.base_url}: {mode} for {args.duration}s after {args.warmup}s of warmup, {len(mix)} requests in the mix")
+        recorder, elapsed = await run(args, mix, vars)
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait(timeout=30)
+        stub.close()
+        await stub.wait_closed()
+
+    results = [summarize(request["name"], recorder.latencies[request["name"]], recorder.errors[request["name"]], elapsed) for request in mix]
+    all_errors = defaultdict(int)
+    for errors in recorder.errors.values():
+        for kind, count in errors.items():
+            all_errors[kind] += count
+    total = summarize("total", [latency for latencies in recorder.latencies.values() for latency in latencies], all_errors, elapsed)
+    total.pop("error_kinds", None)
+    printResults(results, total)
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": gitRevision(),
+            "python": platform.python_version(),
+            "base_url": args.base_url,
+            "mode": "open" if args.rps else "closed",
+            "rps": args.rps,
+            "concurrency": None if args.rps else args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "users": args.users,
+            "llm_latency_s": args.llm_latency,
+            "mix": args.mix,
+            "vars": vars,
+        },
+        "total": total,
+        "results": results,
+    }
+
+
+def parseVar(text):
+    key, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"expected key=value, got {text}")
+    return key, int(value) if value.isdigit() else value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API with a weighted mix of requests")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/")
+    parser.add_argument("--version", default=API_VERSION, help="API version of the routes")
+    parser.add_argument("--start-app", action="store_true", help="start the app with uvicorn on the port of --base-url")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rps", type=float, default=None, help="requests per second (open loop)")
+    load.add_argument("--concurrency", type=int, default=10, help="requests in flight (closed loop)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of measurement")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before the measurement")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request fails")
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--mix", default=MIX_FILE)
+    parser.add_argument("--filter", default=None, help="only the requests of the mix whose name contains this text")
+    parser.add_argument("--from-collection", default=None, help="print a raw mix from a Postman collection and exit")
+    parser.add_argument("--dataset", action="store_true", help="fill the placeholders from the benchmark dataset")
+    parser.add_argument("--database-url", default=BENCHMARK_DATABASE_URL)
+    parser.add_argument("--database", default=BENCHMARK_DATABASE_NAME)
+    parser.add_argument("--var", dest="vars", type=parseVar, action="append", default=[], help="placeholder value, key=value")
+    parser.add_argument("--users", type=int, default=10, help="simulated users, one fake token each")
+    parser.add_argument("--role", default=None, help="role of the fake tokens")
+    parser.add_argument("--seed-users", action="store_true", help="upsert the simulated users in the app database")
+    parser.add_argument("--llm-port", type=int, default=8765, help="port of the OpenAI stub")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before the OpenAI stub answers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help=f"result file, in {RESULTS_DIR} by default")
+    args = parser.parse_args()
+    args.vars = dict(args.vars)
+
+    if args.from_collection:
+        print(json.dumps(mixFromCollection(args.from_collection), indent=2))
+        sys.exit(0)
+
+    report = asyncio.run(loadTest(args))
+    output = args.output or os.path.join(RESULTS_DIR, f"load_test-{datetime.now():%Y%m%d-%H%M%S}-{report['meta']['revision'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {output}")
@@ -0,0 +1,177 @@
+"""
+Synthetic sites, machines and kpis for the benchmarks.
+
+The atomic kpis get one data point per machine and day, stored with the
+repository (so in the backend selected by KPI_STORAGE_BACKEND, rollups
+included): a level per (kpi, machine), a weekly cycle, a slow trend, noise,
+and a share of missing days. The composite kpis are ratios and sums of the
+atomic ones, created with their database expression as the kpi service does.
+"""
+import asyncio
+import random
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+
+from src.plugins.kpi import repository as kpiRepository
+from src.plugins.kpi.formula import formulaToExpression
+from src.plugins.kpi.schema import Value
+
+CATEGORIES = ["Assembly Machines", "Laser Cutter", "Metal Cutting Machines", "Riveting Machine", "Testing Machines"]
+START_DATE = datetime(2023, 1, 1)
+# data points inserted per call, to keep the requests under the size limits
+CHUNK_DAYS = 366
+# scale and ids of the generated dataset, to reuse it in later runs
+DATASET_COLLECTION = "benchmark_dataset"
+
+
+@dataclass
+class Scale:
+    sites: int = 1
+    machines: int = 100
+    kpis: int = 50
+    composites: int = 5
+    days: int = 730
+    missing: float = 0.02
+    seed: int = 0
+
+    @property
+    def points(self) -> int:
+        return self.machines * self.kpis * self.days
+
+
+@dataclass
+class Dataset:
+    """Ids of the generated documents, needed to build the benchmark cases."""
+    start_date: datetime
+    end_date: datetime
+    sites: Dict[int, List[str]] = field(default_factory=dict)
+    machines: List[str] = field(default_factory=list)
+    kpis: Dict[str, str] = field(default_factory=dict)
+    composites: Dict[str, str] = field(default_factory=dict)
+
+
+def series(rng: np.random.Generator, days: int, missing: float):
+    """avg, min, max and sum of each day, NaN on the missing days."""
+    level = rng.uniform(10, 1000)
+    t = np.arange(days)
+    weekly = 1 + 0.2 * np.sin(2 * np.pi * t / 7 + rng.uniform(0, 2 * np.pi))
+    trend = 1 + rng.uniform(-0.2, 0.2) * t / max(days, 1)
+    avg = level * weekly * trend * rng.lognormal(0, 0.1, days)
+    spread = avg * rng.uniform(0.05, 0.3, days)
+    values = np.stack([avg, avg - spread, avg + spread, avg * 24])
+    values[:, rng.random(days) < missing] = np.nan
+    return values
+
+
+async def insertSeries(kpi_id: str, machine_id: str, values, start_date: datetime, kpis_collection) -> int:
+    inserted = 0
+    for offset in range(0, values.shape[1], CHUNK_DAYS):
+        chunk = [
+            Value(
+                datetime=start_date + timedelta(days=offset + day),
+                machine_id=machine_id,
+                avg=avg,
+                min=low,
+                max=high,
+                sum=total
+            )
+            for day, (avg, low, high, total) in enumerate(values[:, offset:offset + CHUNK_DAYS].T)
+            if not np.isnan(avg)
+        ]
+        inserted += await kpiRepository.insertKPIData(kpi_id, chunk, kpis_collection=kpis_collection)
+    return inserted
+
+
+async def generate(db, scale: Scale, concurrency: int = 8, progress=None) -> Dataset:
+    """
+    Drop the benchmark collections of db and fill them at the given scale.
+    With the embedded storage backend all the points of a kpi live in one
+    document: keep machines x days under ~100k (16MB documents).
+    """
+    for collection in ["kpis", "machines", "sites", DATASET_COLLECTION, kpiRepository.ROLLUPS_COLLECTION, kpiRepository.MEASUREMENTS_COLLECTION]:
+        await db[collection].drop()
+    if kpiRepository.KPI_STORAGE_BACKEND == 'timeseries':
+        await kpiRepository.ensureMeasurementsCollection(db)
+    await kpiRepository.ensureRollupsCollection(db)
+
+    names = random.Random(scale.seed)
+    dataset = Dataset(START_DATE, START_DATE + timedelta(days=scale.days))
+    kpis_collection = db["kpis"]
+
+    for index in range(scale.kpis):
+        kpi = await kpiRepository.createKPI(f"bench_kpi_{index}", "atomic", "synthetic atomic kpi", "unit", [], None, kpis_collection=kpis_collection)
+        dataset.kpis[kpi.name] = str(kpi.id)
+    atomic = list(dataset.kpis)
+    for index in range(scale.composites):
+        first, second = names.sample(atomic, 2)
+        formula = f"{first}/{second}" if index % 2 == 0 else f"{first}+{second}"
+        children = {name: dataset.kpis[name] for name in [first, second]}
+        expression = formulaToExpression(formula, {name: f"$$values.{id}" for name, id in children.items()})
+        kpi = await kpiRepository.createKPI(f"bench_composite_{index}", "composite", formula, "unit", list(children.values()), formula, kpis_collection=kpis_collection, expression=expression)
+        dataset.composites[kpi.name] = str(kpi.id)
+    kpis_ids = [ObjectId(id) for id in [*dataset.kpis.values(), *dataset.composites.values()]]
+
+    machines = [
+        {
+            "_id": ObjectId(),
+            "category": CATEGORIES[index % len(CATEGORIES)],
+            "name": f"Bench Machine {index}",
+            "asset_id": f"bench_{index}",
+            "kpis_ids": kpis_ids,
+        }
+        for index in range(scale.machines)
+    ]
+    await db["machines"].insert_many(machines)
+    dataset.machines = [str(machine["_id"]) for machine in machines]
+    for site_id in range(1, scale.sites + 1):
+        site_machines = [machine["_id"] for machine in machines[site_id - 1::scale.sites]]
+        await db["sites"].insert_one({"site_id": site_id, "machines_ids": site_machines, "kpis_ids": kpis_ids})
+        dataset.sites[site_id] = [str(id) for id in site_machines]
+
+    # the series are generated in order, at most concurrency of them in memory
+    rng = np.random.default_rng(scale.seed)
+    total = scale.kpis * scale.machines
+    pending = set()
+    done = 0
+    for kpi_id in dataset.kpis.values():
+        for machine_id in dataset.machines:
+            values = series(rng, scale.days, scale.missing)
+            pending.add(asyncio.create_task(insertSeries(kpi_id, machine_id, values, dataset.start_date, kpis_collection)))
+            if len(pending) >= concurrency:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                done += len(finished)
+                for task in finished:
+                    task.result()
+                if progress is not None:
+                    progress(done, total)
+    await asyncio.gather(*pending)
+    if progress is not None:
+        progress(total, total)
+
+    await db[DATASET_COLLECTION].insert_one({
+        "_id": "dataset",
+        "scale": asdict(scale),
+        "storage_backend": kpiRepository.KPI_STORAGE_BACKEND,
+        **asdict(dataset),
+        "sites": {str(site_id): machines for site_id, machines in dataset.sites.items()}
+    })
+    return dataset
+
+
+async def loadDataset(db, scale: Scale) -> Optional[Dataset]:
+    """The dataset generated earlier in db, None if it has another scale or storage backend."""
+    document = await db[DATASET_COLLECTION].find_one({"_id": "dataset"})
+    if document is None or document["scale"] != asdict(scale) or document["storage_backend"] != kpiRepository.KPI_STORAGE_BACKEND:
+        return None
+    return Dataset(
+        start_date=document["start_date"],
+        end_date=document["end_date"],
+        sites={int(site_id): machines for site_id, machines in document["sites"].items()},
+        machines=document["machines"],
+        kpis=document["kpis"],
+        composites=document["composites"]
+    )
@@ -1,8 +1,9 @@
 import sys, os
+import asyncio
 from fastapi import Depends, FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
-from contextlib import asynccontextmanager
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from contextlib import asynccontextmanager, suppress
 from fastapi.requests import Request
 
 sys.path.append(os.path.abspath("."))
@@ -15,8 +16,16 @@ from src.plugins.report import controller as report_controller
 from src.plugins.anomalies import controller as anomalies_controller
 from utils import description
 from src.config.firebase_config import initialize_firebase
+from src.plugins.auth.firebase import AUTH_MODE, check_auth_mode
 from src.config.db_config import AsyncDatabase, SyncDatabase
 from src.utils import create_report_collection
+from src.core.cache import caches
+from src.core.invalidation import invalidation_bus
+from src.core.indexes import ensure_indexes_in_background
+from src.core.db_timing import DbTimingMiddleware
+from src.core.metrics import MetricsMiddleware, latest_metrics, start_event_loop_monitor
+from src.core.tracing import TracingMiddleware
+from src.plugins.kpi.repository import KPI_STORAGE_BACKEND, ensureMeasurementsCollection
 from reports.tests_report_mongodb import mock_reports
 
 import logging
@@ -25,7 +34,11 @@ load_dotenv()
 
 logger = logger = logging.getLogger('uvicorn.error')
 
-initialize_firebase()
+check_auth_mode()
+if AUTH_MODE == "fake":
+    logger.warning("AUTH_MODE=fake: Firebase is not initialized and any fake:<uid> token from a loopback client is accepted")
+else:
+    initialize_firebase()
 
 from src.plugins.chat import controller as chat_controller
 
@@ -35,6 +48,16 @@ async def startup_shutdown_db(app: FastAPI):
     async_db_obj = AsyncDatabase("DATABASE_URL", "DATABASE_NAME")
     app.mongodb = async_db_obj.get_db()
     app.mongodb_obj = async_db_obj
+    # before any insert, which would create kpi_measurements as a plain collection
+    if KPI_STORAGE_BACKEND == 'timeseries':
+        try:
+            await ensureMeasurementsCollection(app.mongodb)
+        except Exception as e:
+            logger.error(f"Error creating the kpi measurements collection: {e}")
+    # the index builds must not delay the startup
+    app.index_task = ensure_indexes_in_background(app.mongodb)
+    await invalidation_bus.start(app.mongodb)
+    loop_monitor = start_event_loop_monitor()
 
     # await app.mongodb['reports'].drop()
     # await create_report_collection(mongodb=app.mongodb)
@@ -42,6 +65,13 @@ async def startup_shutdown_db(app: FastAPI):
     # app.mongodb['reports'].insert_many(report.model_dump() for report in mock_reports)
 
     yield
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+    # the index builds use the client closed below
+    app.index_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await app.index_task
+    await invalidation_bus.stop()
     async_db_obj.client.close()
 
 API_VERSION = os.getenv("VERSION")
@@ -72,6 +102,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Server-Timing header and log line with the database time of each request
+app.add_middleware(DbTimingMiddleware)
+# latency and in-flight requests, see /metrics
+app.add_middleware(MetricsMiddleware)
+# root span of each request, see src.core.tracing
+app.add_middleware(TracingMiddleware)
+
 @app.get("/", summary="Redirect to Swagger docs")
 async def redirect_to_docs():
     return RedirectResponse(url=f"/api/{API_VERSION}/docs")
@@ -93,6 +130,16 @@ async def check_mongodb_connection(request: Request):
         return request.app.mongodb_obj.check_mongodb_connection()
 
 
+@app.get("/health/cache", summary="Check in-process caches")
+async def check_caches():
+
+    return {**{name: cache.stats() for name, cache in caches.items()}, "invalidation": invalidation_bus.stats()}
+
+@app.get("/metrics", summary="Prometheus metrics", include_in_schema=False)
+async def metrics():
+
+    body, content_type = latest_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.get(
         "/mongodb/list_all_data",
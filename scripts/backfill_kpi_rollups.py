@@ -0,0 +1,48 @@
+"""
+Rebuild the kpi_rollups collection from the raw data points of the atomic
+kpis, in the storage backend selected by KPI_STORAGE_BACKEND.
+
+Run from the repository root:
+    python scripts/backfill_kpi_rollups.py [--kpi KPI_ID ...]
+
+Once the backfill is done set KPI_ROLLUPS=true so the compute queries read
+the whole periods from the rollups. New data points written through the API
+keep them up to date.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath("."))
+from bson import ObjectId
+from dotenv import load_dotenv
+from src.config.db_config import AsyncDatabase
+from src.plugins.kpi.repository import ensureRollupsCollection, rebuildRollups
+
+load_dotenv()
+
+
+async def backfill(kpi_ids):
+    async_db_obj = AsyncDatabase("DATABASE_URL", "DATABASE_NAME")
+    db = async_db_obj.get_db()
+    await ensureRollupsCollection(db)
+
+    query = {"config.formula": None}
+    if kpi_ids:
+        query["_id"] = {"$in": [ObjectId(kpi_id) for kpi_id in kpi_ids]}
+    kpis = db["kpis"].find(query, {"_id": 1, "name": 1})
+    async for kpi in kpis:
+        await rebuildRollups(str(kpi["_id"]), kpis_collection=db["kpis"])
+        rollups = await db["kpi_rollups"].count_documents({"kpi_id": kpi["_id"]})
+        print(f"{kpi['name']}: {rollups} rollups")
+
+    async_db_obj.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the daily, weekly and monthly kpi rollups from raw data")
+    parser.add_argument("--kpi", action="append", default=[], help="id of a kpi to rebuild, all atomic kpis by default")
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.kpi))
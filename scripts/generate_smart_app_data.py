@@ -0,0 +1,327 @@
+"""
+Generate a synthetic smart_app_data dataset, statistically similar to the
+real one, with more assets and a longer history.
+
+Run from the repository root:
+    python scripts/generate_smart_app_data.py --input dataset/smart_app_data.csv
+        [--assets-scale 10] [--history-scale 10] [--format csv parquet]
+        [--anomaly-rate 0.005] [--output dataset/synthetic/smart_app_data_a10_h10]
+        [--save-profile profile.json | --profile profile.json] [--seed 0]
+
+The real dataset is in long format, one row per (time, asset_id, kpi) with
+the sum, avg, min, max (and var) of the day. For every (asset, kpi) series
+the generator learns:
+- a linear trend and a day of week profile of the main value (sum, avg when
+  the kpi has no sum);
+- an AR(1) model of the residuals, whose innovations are resampled from the
+  observed ones, so the marginal distribution and the autocorrelation are
+  kept;
+- the share of exact zeros (idle days) and the missing days, as a two-state
+  Markov chain reproducing their rate and the length of the gaps;
+- the shape of the rows: the other value columns relative to the main one,
+  resampled together so that min <= avg <= max still holds.
+The learned profile can be saved as JSON and reused without the CSV.
+
+Each real asset is the template of assets-scale synthetic assets (the first
+one keeps its id), with a level factor shared by all its kpis. The history is
+extended backwards to history-scale times its length, ending on the last
+real day, with the trend held within the fitted range.
+
+--anomaly-rate injects spikes, drops and level shifts in that share of the
+days, and writes their ground truth (time, asset_id, kpi, anomaly_type,
+factor) to <output>_labels.<format>. The generated rows are written asset
+by asset, so the memory used does not grow with assets-scale.
+
+Point the anomaly and forecasting code at the result with
+DATASET_PATH=<output>.csv (or .parquet).
+"""
+import argparse
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+VALUE_COLUMNS = ["sum", "avg", "min", "max", "var"]
+KEY_COLUMNS = ["time", "asset_id", "kpi"]
+# observed innovations and row shapes kept per series in the profile
+PROFILE_SAMPLES = 1000
+ANOMALY_TYPES = ["spike", "drop", "shift"]
+
+
+def fit_missing(mask: np.ndarray) -> Dict[str, float]:
+    """Probabilities of a two-state chain with the rate and mean run length of the missing days."""
+    rate = float(mask.mean()) if len(mask) else 0.0
+    if rate == 0.0 or rate == 1.0:
+        return {"rate": rate, "enter": rate, "exit": 1.0 - rate}
+    starts = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(int)])) == 1)
+    mean_run = mask.sum() / max(len(starts), 1)
+    leave = 1.0 / max(mean_run, 1.0)
+    return {"rate": rate, "enter": min(1.0, rate * leave / (1.0 - rate)), "exit": leave}
+
+
+def fit_series(frame: pd.DataFrame, grid: pd.DatetimeIndex, value_columns: List[str], rng: np.random.Generator) -> Dict:
+    main = "sum" if "sum" in value_columns and frame["sum"].notna().any() else value_columns[0]
+    frame = frame.drop_duplicates("time").set_index("time").reindex(grid)
+    values = frame[main].to_numpy(dtype=float)
+    observed = ~np.isnan(values)
+    t = np.arange(len(grid), dtype=float)
+
+    # the zeros are drawn apart, the rest of the model is fitted on the active days
+    active = observed & (values != 0)
+    zeros = float((values[observed] == 0).mean()) if observed.any() else 0.0
+    profile = {"main": main, "missing": fit_missing(~observed), "zeros": zeros}
+    if active.sum() < 3:
+        mean = float(np.mean(values[active])) if active.any() else 0.0
+        return {**profile, "trend": [0.0, mean], "trend_range": [mean, mean], "weekday": [0.0] * 7,
+                "phi": 0.0, "innovations": [0.0], "nonnegative": mean >= 0, "shapes": []}
+
+    slope, intercept = np.polyfit(t[active], values[active], 1)
+    fitted = intercept + slope * t
+    detrended = np.where(active, values - fitted, np.nan)
+    weekdays = grid.dayofweek.to_numpy()
+    weekday = [float(np.nanmean(detrended[weekdays == day])) if (active & (weekdays == day)).any() else 0.0 for day in range(7)]
+    residuals = detrended - np.array(weekday)[weekdays]
+
+    pairs = active[1:] & active[:-1]
+    phi = 0.0
+    if pairs.sum() > 2 and np.std(residuals[1:][pairs]) > 0 and np.std(residuals[:-1][pairs]) > 0:
+        phi = float(np.clip(np.corrcoef(residuals[1:][pairs], residuals[:-1][pairs])[0, 1], -0.95, 0.95))
+    innovations = (residuals[1:] - phi * residuals[:-1])[pairs] if pairs.sum() > 2 else residuals[active]
+
+    # the other value columns relative to the main one
+    rows = frame.loc[active, value_columns]
+    shapes = []
+    if len(rows):
+        ratios = rows.div(rows[main], axis=0)
+        if "var" in ratios:
+            ratios["var"] = rows["var"] / rows[main] ** 2
+        sample = ratios.sample(min(len(ratios), PROFILE_SAMPLES), random_state=int(rng.integers(2**31)))
+        shapes = sample.replace([np.inf, -np.inf], np.nan).round(6).to_dict("records")
+
+    return {
+        **profile,
+        "trend": [float(slope), float(intercept)],
+        "trend_range": [float(fitted[active].min()), float(fitted[active].max())],
+        "weekday": weekday,
+        "phi": phi,
+        "innovations": rng.choice(innovations, min(len(innovations), PROFILE_SAMPLES), replace=False).round(6).tolist(),
+        "nonnegative": bool(np.nanmin(values) >= 0),
+        "shapes": shapes,
+    }
+
+
+def fit(data: pd.DataFrame, seed: int = 0) -> Dict:
+    """Profile of every (asset, kpi) series of a dataset in long format."""
+    missing_columns = [column for column in KEY_COLUMNS if column not in data.columns]
+    if missing_columns:
+        raise ValueError(f"The dataset must contain the following columns: {KEY_COLUMNS}")
+    value_columns = [column for column in VALUE_COLUMNS if column in data.columns]
+    data = data.copy()
+    data["time"] = pd.to_datetime(data["time"])
+    times = np.sort(data["time"].unique())
+    step = pd.Timedelta(np.median(np.diff(times))) if len(times) > 1 else pd.Timedelta(days=1)
+    grid = pd.date_range(times[0], times[-1], freq=step)
+
+    rng = np.random.default_rng(seed)
+    series = {}
+    for (asset_id, kpi), frame in data.groupby(["asset_id", "kpi"]):
+        series.setdefault(str(asset_id), {})[str(kpi)] = fit_series(frame, grid, value_columns, rng)
+
+    # columns other than the keys and the values, constant per asset (e.g. name)
+    extra_columns = [column for column in data.columns if column not in KEY_COLUMNS + value_columns]
+    assets = data.drop_duplicates("asset_id").set_index("asset_id")[extra_columns]
+    return {
+        "columns": list(data.columns),
+        "value_columns": value_columns,
+        "start": str(grid[0]),
+        "end": str(grid[-1]),
+        "step_seconds": step.total_seconds(),
+        "assets": {str(asset_id): {column: (None if pd.isna(value) else value) for column, value in row.items()} for asset_id, row in assets.iterrows()},
+        "series": series,
+    }
+
+
+def simulate_missing(chain: Dict[str, float], length: int, rng: np.random.Generator) -> np.ndarray:
+    mask = np.zeros(length, dtype=bool)
+    if chain["rate"] == 0.0:
+        return mask
+    draws = rng.random(length)
+    missing = draws[0] < chain["rate"]
+    for index in range(length):
+        if index:
+            missing = draws[index] >= chain["exit"] if missing else draws[index] < chain["enter"]
+        mask[index] = missing
+    return mask
+
+
+def simulate_series(profile: Dict, grid: pd.DatetimeIndex, offset: int, level: float, rng: np.random.Generator) -> np.ndarray:
+    """Main value of each day of the grid, NaN when missing. offset is the index of the first real day."""
+    t = np.arange(len(grid), dtype=float) - offset
+    slope, intercept = profile["trend"]
+    trend = np.clip(intercept + slope * t, *profile["trend_range"])
+    innovations = rng.choice(np.asarray(profile["innovations"], dtype=float), len(grid))
+    residuals = np.empty(len(grid))
+    previous = 0.0
+    for index, innovation in enumerate(innovations):
+        previous = profile["phi"] * previous + innovation
+        residuals[index] = previous
+    values = (trend + np.asarray(profile["weekday"])[grid.dayofweek.to_numpy()] + residuals) * level
+    if profile["nonnegative"]:
+        values = np.maximum(values, 0.0)
+    values[rng.random(len(grid)) < profile["zeros"]] = 0.0
+    values[simulate_missing(profile["missing"], len(grid), rng)] = np.nan
+    return values
+
+
+def inject_anomalies(values: np.ndarray, rate: float, rng: np.random.Generator):
+    """Alter the values in place, returning (index, type, factor) of each anomalous day."""
+    labels = []
+    if rate <= 0:
+        return labels
+    for start in np.flatnonzero(rng.random(len(values)) < rate):
+        kind = ANOMALY_TYPES[rng.integers(len(ANOMALY_TYPES))]
+        if kind == "spike":
+            days, factor = 1, rng.uniform(3, 6)
+        elif kind == "drop":
+            days, factor = 1, rng.uniform(0, 0.2)
+        else:
+            days, factor = int(rng.integers(3, 11)), rng.uniform(1.5, 2.5)
+        for index in range(start, min(start + days, len(values))):
+            if np.isnan(values[index]):
+                continue
+            # a zero would stay a zero: anomalies of idle days are spikes of the typical level
+            base = values[index] if values[index] != 0 else np.nanmedian(values) or 1.0
+            values[index] = base * factor
+            labels.append((index, kind, round(float(factor), 3)))
+    return labels
+
+
+def rows_of_series(profile: Dict, values: np.ndarray, value_columns: List[str], rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """All the value columns from the main one and the resampled row shapes."""
+    columns = {column: np.full(len(values), np.nan) for column in value_columns}
+    main = profile["main"]
+    columns[main] = values
+    shapes = pd.DataFrame(profile["shapes"], columns=value_columns)
+    if len(shapes) == 0:
+        return columns
+    picked = shapes.iloc[rng.integers(len(shapes), size=len(values))].reset_index(drop=True)
+    for column in value_columns:
+        if column == main:
+            continue
+        scale = values ** 2 if column == "var" else values
+        columns[column] = picked[column].to_numpy(dtype=float) * scale
+    return columns
+
+
+def generate_asset(profile: Dict, template: str, asset_id: str, copy: int, grid, offset: int, anomaly_rate: float, rng: np.random.Generator):
+    """Rows and anomaly labels of one synthetic asset."""
+    value_columns = profile["value_columns"]
+    level = 1.0 if copy == 0 else float(rng.lognormal(0, 0.15))
+    frames, labels = [], []
+    for kpi, series in profile["series"][template].items():
+        values = simulate_series(series, grid, offset, level, rng)
+        for index, kind, factor in inject_anomalies(values, anomaly_rate, rng):
+            labels.append({"time": grid[index], "asset_id": asset_id, "kpi": kpi, "anomaly_type": kind, "factor": factor})
+        present = ~np.isnan(values)
+        columns = rows_of_series(series, values, value_columns, rng)
+        frames.append(pd.DataFrame({
+            "time": grid[present],
+            "asset_id": asset_id,
+            "kpi": kpi,
+            **{column: columns[column][present] for column in value_columns}
+        }))
+    frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["time", "asset_id", "kpi", *value_columns])
+    for column, value in profile["assets"].get(template, {}).items():
+        frame[column] = value if copy == 0 or not isinstance(value, str) else f"{value} #{copy}"
+    return frame[profile["columns"]].sort_values(["time", "kpi"]), labels
+
+
+class Writer:
+    """Append data frames to a CSV file and/or a Parquet file."""
+    def __init__(self, path: str, formats: List[str]):
+        self.path = path
+        self.formats = formats
+        self.rows = 0
+        self._parquet = None
+        self._schema = None
+        self._csv_header = True
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        for extension in formats:
+            if os.path.exists(f"{path}.{extension}"):
+                os.remove(f"{path}.{extension}")
+
+    def write(self, frame: pd.DataFrame) -> None:
+        if len(frame) == 0:
+            return
+        self.rows += len(frame)
+        if "csv" in self.formats:
+            frame.to_csv(f"{self.path}.csv", mode="a", header=self._csv_header, index=False)
+            self._csv_header = False
+        if "parquet" in self.formats:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._parquet is None:
+                self._schema = pa.Schema.from_pandas(frame, preserve_index=False)
+                self._parquet = pq.ParquetWriter(f"{self.path}.parquet", self._schema)
+            self._parquet.write_table(pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False))
+
+    def close(self) -> None:
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def generate(profile: Dict, output: str, formats: List[str], assets_scale: int, history_scale: float, anomaly_rate: float, seed: int):
+    rng = np.random.default_rng(seed)
+    step = pd.Timedelta(seconds=profile["step_seconds"])
+    real = pd.date_range(profile["start"], profile["end"], freq=step)
+    days = int(round(len(real) * history_scale))
+    grid = pd.date_range(end=real[-1], periods=days, freq=step)
+    offset = days - len(real)
+
+    writer = Writer(output, formats)
+    labels_writer = Writer(f"{output}_labels", formats) if anomaly_rate > 0 else None
+    injected = 0
+    for template in profile["series"]:
+        for copy in range(assets_scale):
+            asset_id = template if copy == 0 else f"{template}_{copy}"
+            frame, labels = generate_asset(profile, template, asset_id, copy, grid, offset, anomaly_rate, rng)
+            writer.write(frame)
+            if labels_writer is not None and labels:
+                labels_writer.write(pd.DataFrame(labels))
+                injected += len(labels)
+        print(f"{template}: {assets_scale} assets, {writer.rows} rows so far")
+    writer.close()
+    if labels_writer is not None:
+        labels_writer.close()
+    return writer.rows, injected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic smart_app_data dataset at a chosen scale")
+    parser.add_argument("--input", default="dataset/smart_app_data.csv", help="real dataset to learn from (CSV or Parquet)")
+    parser.add_argument("--profile", default=None, help="learned profile to use instead of the input dataset")
+    parser.add_argument("--save-profile", default=None, help="write the learned profile to this JSON file")
+    parser.add_argument("--assets-scale", type=int, default=10, help="synthetic assets per real asset")
+    parser.add_argument("--history-scale", type=float, default=1.0, help="length of the history relative to the real one")
+    parser.add_argument("--anomaly-rate", type=float, default=0.0, help="share of the days starting an injected anomaly")
+    parser.add_argument("--format", nargs="+", choices=["csv", "parquet"], default=["csv"])
+    parser.add_argument("--output", default=None, help="output path without extension")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+    else:
+        data = pd.read_parquet(args.input) if args.input.endswith(".parquet") else pd.read_csv(args.input)
+        profile = fit(data, args.seed)
+        print(f"Learned {sum(len(kpis) for kpis in profile['series'].values())} series of {len(profile['series'])} assets from {args.input}")
+    if args.save_profile:
+        with open(args.save_profile, "w") as f:
+            json.dump(profile, f, default=str)
+
+    output = args.output or f"dataset/synthetic/smart_app_data_a{args.assets_scale}_h{args.history_scale:g}"
+    rows, injected = generate(profile, output, args.format, args.assets_scale, args.history_scale, args.anomaly_rate, args.seed)
+    print(f"Wrote {rows} rows to {output}.{{{','.join(args.format)}}}" + (f", {injected} anomalous days in {output}_labels" if args.anomaly_rate > 0 else ""))
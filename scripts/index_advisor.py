@@ -0,0 +1,67 @@
+"""
+Explain every query shape registered by the plugins (src.core.indexes) and
+flag the ones answered with a collection scan.
+
+Run from the repository root:
+    python scripts/index_advisor.py [--ensure] [--shape NAME ...]
+
+--ensure creates the registered indexes first, as the application does at
+startup. The exit status is 1 when a shape scans its collection, so the
+command can guard a CI job against index regressions.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath("."))
+from dotenv import load_dotenv
+from src.config.db_config import AsyncDatabase
+from src.core.indexes import ensure_indexes, explain_query_shape, plan_stages, query_shapes
+
+# the repositories register their indexes and query shapes when imported
+from src.plugins.kpi import repository as kpi_repository  # noqa: F401
+from src.plugins.machine import repository as machine_repository  # noqa: F401
+from src.plugins.report import repository as report_repository  # noqa: F401
+from src.plugins.site import repository as site_repository  # noqa: F401
+from src.plugins.user import repository as user_repository  # noqa: F401
+
+load_dotenv()
+
+
+async def advise(names, ensure):
+    async_db_obj = AsyncDatabase("DATABASE_URL", "DATABASE_NAME")
+    db = async_db_obj.get_db()
+    if ensure:
+        for collection, created in (await ensure_indexes(db)).items():
+            print(f"{collection}: {', '.join(created)}")
+
+    scans = 0
+    for name, shape in sorted(query_shapes.items()):
+        if names and name not in names:
+            continue
+        try:
+            stages = plan_stages(await explain_query_shape(db, shape))
+        except Exception as e:
+            print(f"ERROR     {name} ({shape['collection']}): {e}")
+            scans += 1
+            continue
+        if "COLLSCAN" in stages:
+            scans += 1
+            status = "COLLSCAN"
+        else:
+            status = "OK"
+        print(f"{status:<9} {name} ({shape['collection']}): {' > '.join(reversed(stages))}")
+
+    async_db_obj.close_db()
+    return scans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flag the registered query shapes that scan their collection")
+    parser.add_argument("--ensure", action="store_true", help="create the registered indexes first")
+    parser.add_argument("--shape", action="append", default=[], help="name of a query shape to explain, all by default")
+    args = parser.parse_args()
+
+    scans = asyncio.run(advise(args.shape, args.ensure))
+    sys.exit(1 if scans else 0)
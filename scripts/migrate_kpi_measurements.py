@@ -0,0 +1,86 @@
+"""
+Move the data points embedded in kpis.data into the kpi_measurements
+time-series collection.
+
+Run from the repository root:
+    python scripts/migrate_kpi_measurements.py [--keep-source] [--batch-size N]
+
+Once the migration is done set KPI_STORAGE_BACKEND=timeseries so the compute
+queries read from the new collection.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath("."))
+from dotenv import load_dotenv
+from src.config.db_config import AsyncDatabase
+from src.plugins.kpi.repository import ensureMeasurementsCollection
+
+load_dotenv()
+
+
+async def migrate(keep_source: bool, batch_size: int):
+    async_db_obj = AsyncDatabase("DATABASE_URL", "DATABASE_NAME")
+    db = async_db_obj.get_db()
+    measurements = await ensureMeasurementsCollection(db)
+
+    kpis = db["kpis"].find({"data.0": {"$exists": True}}, {"_id": 1, "name": 1})
+    async for kpi in kpis:
+        # start from scratch for this kpi so the script can be re-run safely
+        await measurements.delete_many({"meta.kpi_id": kpi["_id"]})
+
+        cursor = db["kpis"].aggregate([
+            { "$match": { "_id": kpi["_id"] } },
+            { "$unwind": { "path": "$data" } },
+            { "$replaceRoot": { "newRoot": "$data" } }
+        ])
+        batch = []
+        migrated = 0
+        skipped = 0
+        async for value in cursor:
+            # a measurement needs its time field
+            if value.get("datetime") is None:
+                skipped += 1
+                continue
+            batch.append({
+                "datetime": value["datetime"],
+                "meta": {
+                    "kpi_id": kpi["_id"],
+                    "machine_id": value["machine_id"]
+                },
+                "sum": value.get("sum"),
+                "avg": value.get("avg"),
+                "min": value.get("min"),
+                "max": value.get("max")
+            })
+            if len(batch) == batch_size:
+                await measurements.insert_many(batch, ordered=False)
+                migrated += len(batch)
+                batch = []
+        if batch:
+            await measurements.insert_many(batch, ordered=False)
+            migrated += len(batch)
+
+        stored = await measurements.count_documents({"meta.kpi_id": kpi["_id"]})
+        if stored != migrated:
+            print(f"{kpi['name']}: expected {migrated} data points, found {stored}, source left untouched")
+            continue
+        if skipped:
+            print(f"{kpi['name']}: migrated {migrated} data points, skipped {skipped} without datetime, source left untouched")
+            continue
+        if not keep_source:
+            await db["kpis"].update_one({"_id": kpi["_id"]}, {"$set": {"data": []}})
+        print(f"{kpi['name']}: migrated {migrated} data points")
+
+    async_db_obj.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move kpis.data arrays into the kpi_measurements time-series collection")
+    parser.add_argument("--keep-source", action="store_true", help="do not empty kpis.data after a successful migration")
+    parser.add_argument("--batch-size", type=int, default=5000, help="number of data points per insert")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.keep_source, args.batch_size))
@@ -0,0 +1,48 @@
+"""
+Refresh the local Parquet snapshot of the atomic kpis from the storage
+backend selected by KPI_STORAGE_BACKEND.
+
+Run from the repository root:
+    python scripts/refresh_kpi_snapshot.py [--kpi KPI_ID ...] [--dir DIRECTORY]
+
+The snapshot is written to KPI_SNAPSHOT_DIR (data/kpi_snapshot by default),
+partitioned by kpi and month. Queries sent with backend=snapshot, or every
+query when KPI_COMPUTE_BACKEND=snapshot, are answered from it and only see
+the data points present at the last refresh.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath("."))
+from bson import ObjectId
+from dotenv import load_dotenv
+from src.config.db_config import AsyncDatabase
+from src.plugins.kpi.repository import refreshSnapshot
+
+load_dotenv()
+
+
+async def refresh(kpi_ids, directory):
+    async_db_obj = AsyncDatabase("DATABASE_URL", "DATABASE_NAME")
+    db = async_db_obj.get_db()
+
+    query = {"config.formula": None}
+    if kpi_ids:
+        query["_id"] = {"$in": [ObjectId(kpi_id) for kpi_id in kpi_ids]}
+    kpis = db["kpis"].find(query, {"_id": 1, "name": 1})
+    async for kpi in kpis:
+        rows = await refreshSnapshot(str(kpi["_id"]), kpis_collection=db["kpis"], directory=directory)
+        print(f"{kpi['name']}: {rows} data points")
+
+    async_db_obj.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the Parquet snapshot of the kpi data points used by the snapshot compute backend")
+    parser.add_argument("--kpi", action="append", default=[], help="id of a kpi to refresh, all atomic kpis by default")
+    parser.add_argument("--dir", default=None, help="snapshot directory, KPI_SNAPSHOT_DIR by default")
+    args = parser.parse_args()
+
+    asyncio.run(refresh(args.kpi, args.dir))
@@ -6,6 +6,9 @@ import json
 from pprint import pprint
 from pymongo import MongoClient
 from pymongo.server_api import ServerApi
+
+from src.core.db_timing import db_command_listener
+from src.core.metrics import mongo_command_metrics
 from dotenv import load_dotenv
 from dataclasses import dataclass
 
@@ -114,7 +117,9 @@ class Database:
 class AsyncDatabase(DatabaseMixin, Database):
     def __init__(self, DATABASE_URL_ENV, DATABASE_NAME_ENV):
         super().__init__(DATABASE_URL_ENV, DATABASE_NAME_ENV)
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(self.DATABASE_URL)
+        # the listeners attribute the commands to the current request (see src.core.db_timing)
+        # and time them for /metrics (see src.core.metrics)
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(self.DATABASE_URL, event_listeners=[db_command_listener, mongo_command_metrics])
         self.db = self.client[self.DATABASE_NAME]
 
     async def check_mongodb_connection(self):
@@ -0,0 +1,193 @@
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+
+class LRUCache:
+    """
+    Bounded in-process cache evicting the least recently used entry, with an
+    optional time to live (seconds) per entry. Hits and misses are counted.
+    """
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def invalidate(self, key: Hashable) -> Any:
+        """Remove an entry, returning its value if it was cached."""
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+
+# every cache of the application, by name
+caches: Dict[str, Any] = {}
+
+
+def register_cache(cache):
+    caches[cache.name] = cache
+    return cache
+
+
+class MemoryCacheBackend:
+    """
+    Async key-value cache kept in process. Entries can carry tags so that all
+    the entries sharing a tag can be invalidated at once.
+    """
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.name = name
+        self._cache = LRUCache(name, maxsize=maxsize, ttl=ttl)
+        self._tags: Dict[str, set] = {}
+        self._tagged = 0
+
+    async def get(self, key: str) -> Any:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, tags: Iterable[str] = ()) -> None:
+        self._cache.set(key, value, ttl=ttl)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+            self._tagged += 1
+        if self._tagged > 4 * self._cache.maxsize:
+            self._prune_tags()
+
+    def _prune_tags(self) -> None:
+        # forget the evicted keys so that the tag index stays bounded
+        tags = {}
+        for tag, keys in self._tags.items():
+            keys = {key for key in keys if key in self._cache}
+            if keys:
+                tags[tag] = keys
+        self._tags = tags
+        self._tagged = sum(len(keys) for keys in tags.values())
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                self._cache.invalidate(key)
+
+    async def clear(self) -> None:
+        self._cache.clear()
+        self._tags.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class RedisCacheBackend:
+    """
+    Async key-value cache shared between workers, stored in any server speaking
+    the Redis protocol. Values are stored as JSON, tags as sets of keys.
+    """
+    def __init__(self, name: str, url: str, ttl: Optional[float] = None):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("the redis package is required to use a redis:// cache url") from e
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._tag_expire = 0
+        self._client = redis.from_url(url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _tag(self, tag: str) -> str:
+        return f"{self.name}:tag:{tag}"
+
+    async def get(self, key: str) -> Any:
+        value = await self._client.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, tags: Iterable[str] = ()) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expire = int(math.ceil(ttl)) if ttl else None
+        # a tag set has to live as long as the longest lived entry it refers to
+        self._tag_expire = max(self._tag_expire, expire or 0)
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.set(self._key(key), json.dumps(value), ex=expire)
+            for tag in tags:
+                pipe.sadd(self._tag(tag), self._key(key))
+                if expire:
+                    pipe.expire(self._tag(tag), self._tag_expire)
+            await pipe.execute()
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            keys = await self._client.smembers(self._tag(tag))
+            await self._client.delete(self._tag(tag), *keys)
+
+    async def clear(self) -> None:
+        async for key in self._client.scan_iter(match=f"{self.name}:*"):
+            await self._client.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+        }
+
+
+def create_cache_backend(name: str, url: Optional[str] = None, maxsize: int = 1024, ttl: Optional[float] = None):
+    """
+    Build the cache backend for the given url: in process when the url is
+    empty or memory://, shared when it is a redis:// (or rediss://) url.
+    """
+    if not url or url.startswith("memory://"):
+        return MemoryCacheBackend(name, maxsize=maxsize, ttl=ttl)
+    if url.startswith("redis://") or url.startswith("rediss://") or url.startswith("unix://"):
+        return RedisCacheBackend(name, url, ttl=ttl)
+    raise ValueError(f"Unsupported cache url: {url}")
@@ -0,0 +1,144 @@
+"""
+Per-request accounting of the MongoDB commands.
+
+CommandTimingListener is attached to the Motor client (see
+src.config.db_config.AsyncDatabase). For every command that completes it adds
+the duration, the number of documents returned and the size of the reply to
+the RequestDbStats of the current request, found through a contextvar (Motor
+runs the commands in threads with a copy of the caller's context).
+
+DbTimingMiddleware opens the RequestDbStats of each request, sends the totals
+so far in a Server-Timing header with the response headers, and logs the
+final totals as structured fields once the body has been sent. For a
+streaming response the header only covers the commands run before the first
+byte; the log line covers all of them.
+
+DB_TIMING=false disables both.
+"""
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+import bson
+from pymongo import monitoring
+
+DB_TIMING_ENABLED = os.getenv("DB_TIMING", "true").lower() == "true"
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class RequestDbStats:
+    def __init__(self):
+        self.commands = 0
+        self.failures = 0
+        self.duration_ms = 0.0
+        self.documents = 0
+        self.bytes = 0
+        # per command name: [count, duration_ms]
+        self.by_command: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, command_name: str, duration_micros: int, documents: int = 0, size: int = 0, failed: bool = False):
+        duration_ms = duration_micros / 1000
+        with self._lock:
+            self.commands += 1
+            self.failures += failed
+            self.duration_ms += duration_ms
+            self.documents += documents
+            self.bytes += size
+            entry = self.by_command.setdefault(command_name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration_ms
+
+    def server_timing(self) -> str:
+        with self._lock:
+            metrics = [f'db;dur={self.duration_ms:.1f};desc="{self.commands} commands, {self.documents} docs, {self.bytes} B"']
+            metrics += [
+                f'db-{name};dur={duration_ms:.1f};desc="{count}x"'
+                for name, (count, duration_ms) in sorted(self.by_command.items())
+            ]
+        return ", ".join(metrics)
+
+    def fields(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "db_commands": self.commands,
+                "db_failures": self.failures,
+                "db_duration_ms": round(self.duration_ms, 3),
+                "db_documents": self.documents,
+                "db_bytes": self.bytes,
+            }
+
+
+current_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("current_db_stats", default=None)
+
+
+def reply_documents(reply: Dict[str, Any]) -> int:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "values" in reply:
+        return len(reply["values"])
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class CommandTimingListener(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        stats = current_db_stats.get()
+        if stats is None:
+            return
+        reply = event.reply
+        stats.record(event.command_name, event.duration_micros, reply_documents(reply), len(bson.encode(reply)))
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        stats = current_db_stats.get()
+        if stats is None:
+            return
+        stats.record(event.command_name, event.duration_micros, failed=True)
+
+
+db_command_listener = CommandTimingListener()
+
+
+class DbTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DB_TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestDbStats()
+        token = current_db_stats.set(stats)
+        started = time.perf_counter()
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", stats.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                fields = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                    **stats.fields()
+                }
+                logger.info(" ".join(f"{key}={value}" for key, value in fields.items()), extra=fields)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_db_stats.reset(token)
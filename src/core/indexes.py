@@ -0,0 +1,79 @@
+"""
+Declarative index registry.
+
+Each plugin declares, next to its queries, the indexes its collections need
+(register_indexes) and the shapes of the queries that must use them
+(register_query_shape). The indexes are ensured in the background when the
+application starts: createIndexes is idempotent and a failing index is
+logged without stopping the others.
+
+scripts/index_advisor.py explains every registered query shape and flags the
+ones answered with a collection scan.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from pymongo import IndexModel
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger('uvicorn.error')
+
+# indexes by collection name
+indexes: Dict[str, List[IndexModel]] = {}
+# query shapes by name: collection plus a find filter or an aggregation pipeline
+query_shapes: Dict[str, Dict[str, Any]] = {}
+
+
+def register_indexes(collection: str, models: List[IndexModel]) -> None:
+    indexes.setdefault(collection, []).extend(models)
+
+
+def register_query_shape(name: str, collection: str, filter: Optional[dict] = None, pipeline: Optional[list] = None) -> None:
+    """
+    Declare a query of the application, with placeholder values: a find
+    filter, or an aggregation pipeline whose index use is decided by its
+    leading $match.
+    """
+    query_shapes[name] = {"collection": collection, "filter": filter, "pipeline": pipeline}
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create the registered indexes, returning the names created per collection."""
+    created = {}
+    for collection, models in indexes.items():
+        try:
+            created[collection] = await db[collection].create_indexes(models)
+        except PyMongoError as e:
+            # e.g. an existing index with the same name and other options
+            logger.error(f"Error creating the indexes of {collection}: {e}")
+    return created
+
+
+def ensure_indexes_in_background(db) -> asyncio.Task:
+    return asyncio.create_task(ensure_indexes(db))
+
+
+def plan_stages(explain: Any) -> List[str]:
+    """Stages of the winning plans found anywhere in an explain output."""
+    stages = []
+
+    def walk(node, in_plan):
+        if isinstance(node, dict):
+            if in_plan and isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            for key, value in node.items():
+                walk(value, in_plan or key in ["winningPlan", "queryPlan"])
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, in_plan)
+
+    walk(explain, False)
+    return stages
+
+
+async def explain_query_shape(db, shape: Dict[str, Any]) -> Dict[str, Any]:
+    collection = shape["collection"]
+    if shape["pipeline"] is not None:
+        return await db.command("aggregate", collection, pipeline=shape["pipeline"], explain=True)
+    return await db.command("explain", {"find": collection, "filter": shape["filter"] or {}}, verbosity="queryPlanner")
@@ -0,0 +1,211 @@
+"""
+Cache invalidation across workers.
+
+Every worker runs an InvalidationBus that turns the writes made by any worker
+or replica into InvalidationEvents and hands them to the handlers registered
+by the in-process caches.
+
+The writes are observed with a MongoDB change stream on the kpis, sites,
+machines, users and reports collections, plus data_versions for the kpi data
+points (they may live outside of kpis, see KPI_STORAGE_BACKEND). Change
+streams need a replica set: on a standalone server the bus polls the
+data_versions collection instead (see src.core.versions), every
+INVALIDATION_POLL_INTERVAL seconds.
+
+INVALIDATION_MODE selects the source: 'auto' (change streams, polling when
+they are unavailable), 'stream', 'poll' or 'off'.
+"""
+import asyncio
+import inspect
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from src.core.versions import DATA_VERSIONS_COLLECTION
+
+INVALIDATION_MODE = os.getenv("INVALIDATION_MODE", "auto")
+INVALIDATION_POLL_INTERVAL = float(os.getenv("INVALIDATION_POLL_INTERVAL", 2))
+WATCHED_COLLECTIONS = ["kpis", "sites", "machines", "users", "reports"]
+# pseudo collection of the events about the data points of a kpi
+KPI_DATA = "kpi_data"
+
+logger = logging.getLogger('uvicorn.error')
+
+
+@dataclass(frozen=True)
+class InvalidationEvent:
+    """
+    collection: watched collection, or KPI_DATA for new kpi data points
+    operation: insert, update, replace or delete; 'invalidate' when the
+        events of the collection may have been missed and everything cached
+        from it must be dropped
+    document_id: _id of the document for the change stream events; the kpi
+        id for KPI_DATA and the site_id for the "site:<id>" scopes when
+        polling; None when unknown
+    fields: top level fields changed by an update, None when unknown
+    """
+    collection: str
+    operation: str
+    document_id: Any = None
+    fields: Optional[Tuple[str, ...]] = None
+
+    def only_changes(self, *fields: str) -> bool:
+        """True for an update known to touch nothing but the given fields."""
+        return self.operation == "update" and self.fields is not None and set(self.fields) <= set(fields)
+
+
+class ChangeStreamsUnavailable(Exception):
+    pass
+
+
+def scope_event(scope: str) -> Optional[InvalidationEvent]:
+    """Event of a data version scope bump (see src.core.versions)."""
+    name, _, key = scope.partition(":")
+    if name == "kpi" and key:
+        return InvalidationEvent(KPI_DATA, "update", key)
+    if name == "site" and key:
+        return InvalidationEvent("sites", "update", int(key) if key.isdigit() else key)
+    if name in WATCHED_COLLECTIONS:
+        return InvalidationEvent(name, "update")
+    return None
+
+
+def change_event(change: Dict[str, Any]) -> Optional[InvalidationEvent]:
+    """Event of a change stream document, None for the ones to ignore."""
+    collection = change.get("ns", {}).get("coll")
+    operation = change.get("operationType")
+    if collection == DATA_VERSIONS_COLLECTION:
+        # only the kpi data scopes: the other writes are seen on their collection
+        scope = change.get("documentKey", {}).get("_id", "")
+        return scope_event(scope) if scope.startswith("kpi:") else None
+    if operation in ["drop", "rename", "dropDatabase", "invalidate"]:
+        return InvalidationEvent(collection, "invalidate")
+    fields = None
+    if operation == "update":
+        description = change.get("updateDescription", {})
+        changed = [*description.get("updatedFields", {}), *description.get("removedFields", [])]
+        fields = tuple(sorted({field.split(".")[0] for field in changed}))
+    return InvalidationEvent(collection, operation, change.get("documentKey", {}).get("_id"), fields)
+
+
+class InvalidationBus:
+    def __init__(self, mode: str = INVALIDATION_MODE, poll_interval: float = INVALIDATION_POLL_INTERVAL):
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.source: Optional[str] = None
+        self.published = 0
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, collections: List[str], handler: Callable) -> Callable:
+        """Call handler(event), sync or async, for the events of the collections."""
+        for collection in collections:
+            self._handlers.setdefault(collection, []).append(handler)
+        return handler
+
+    async def publish(self, event: InvalidationEvent) -> None:
+        self.published += 1
+        for handler in self._handlers.get(event.collection, []):
+            try:
+                result = handler(event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error handling invalidation {event}: {e}")
+
+    async def invalidate_all(self) -> None:
+        for collection in list(self._handlers):
+            await self.publish(InvalidationEvent(collection, "invalidate"))
+
+    async def start(self, db) -> None:
+        if self.mode == "off" or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.source = None
+
+    async def _run(self, db) -> None:
+        if self.mode in ["auto", "stream"]:
+            try:
+                await self._watch(db)
+                return
+            except ChangeStreamsUnavailable as e:
+                if self.mode == "stream":
+                    logger.error(f"Change streams unavailable, caches are not invalidated across workers: {e}")
+                    return
+                logger.warning(f"Change streams unavailable, polling {DATA_VERSIONS_COLLECTION}: {e}")
+        await self._poll(db)
+
+    async def _watch(self, db) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": [*WATCHED_COLLECTIONS, DATA_VERSIONS_COLLECTION]}}}]
+        resume_token = None
+        opened = False
+        while True:
+            try:
+                async with db.watch(pipeline, resume_after=resume_token) as stream:
+                    # the first fetch opens the stream, None when nothing changed yet
+                    change = await stream.try_next()
+                    if not opened:
+                        opened = True
+                        self.source = "stream"
+                        logger.info("Cache invalidation listening to change streams")
+                    while stream.alive:
+                        resume_token = stream.resume_token
+                        if change is not None:
+                            event = change_event(change)
+                            if event is not None:
+                                await self.publish(event)
+                        change = await stream.try_next()
+            except OperationFailure as e:
+                if not opened:
+                    raise ChangeStreamsUnavailable(str(e)) from e
+                # resume token lost (e.g. out of the oplog): events may be missing
+                logger.error(f"Change stream failed, dropping the invalidated caches: {e}")
+                resume_token = None
+                await self.invalidate_all()
+            except PyMongoError as e:
+                if not opened:
+                    raise ChangeStreamsUnavailable(str(e)) from e
+                logger.error(f"Change stream interrupted, resuming: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self, db) -> None:
+        collection = db[DATA_VERSIONS_COLLECTION]
+        versions = None
+        self.source = "poll"
+        while True:
+            try:
+                current = {document["_id"]: document["version"] async for document in collection.find({})}
+                if versions is not None:
+                    for scope, version in current.items():
+                        if versions.get(scope) != version:
+                            event = scope_event(scope)
+                            if event is not None:
+                                await self.publish(event)
+                versions = current
+            except PyMongoError as e:
+                logger.error(f"Error polling {DATA_VERSIONS_COLLECTION}: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "source": self.source,
+            "published": self.published,
+            "subscriptions": {collection: len(handlers) for collection, handlers in self._handlers.items()}
+        }
+
+
+invalidation_bus = InvalidationBus()
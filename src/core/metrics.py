@@ -0,0 +1,175 @@
+"""
+Prometheus metrics of the API, served in the text format by /metrics.
+
+The hot paths only update in-process counters and histograms (a lock and a
+few additions per observation):
+- MetricsMiddleware: latency per route template and requests in flight;
+- MongoCommandMetrics, a pymongo CommandListener attached to the Motor client
+  (see src.config.db_config.AsyncDatabase): latency per command;
+- time_llm_call: latency and tokens of the OpenAI calls of chat and report;
+- anomaly_analysis_duration: duration of each anomaly analysis;
+- monitor_event_loop_lag: a background task measuring how late the event
+  loop wakes it up, every METRICS_LOOP_LAG_INTERVAL seconds.
+The cache hits and misses are read from the caches (src.core.cache) only when
+the metrics are scraped.
+
+METRICS=false disables the middleware and the event loop monitor.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+from src.core.cache import caches
+
+METRICS_ENABLED = os.getenv("METRICS", "true").lower() == "true"
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", 1))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LLM_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Latency of the HTTP requests",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests being served", ["method"]
+)
+mongodb_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "Latency of the MongoDB commands",
+    ["command", "status"], buckets=DB_BUCKETS
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds", "Latency of the LLM calls",
+    ["plugin", "model", "status"], buckets=LLM_BUCKETS
+)
+llm_tokens = Counter(
+    "llm_tokens", "Tokens used by the LLM calls", ["plugin", "model", "kind"]
+)
+anomaly_analysis_duration = Histogram(
+    "anomaly_analysis_duration_seconds", "Duration of the anomaly analyses",
+    ["analysis"], buckets=LATENCY_BUCKETS
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "Delay of the event loop in running a scheduled callback",
+    buckets=LAG_BUCKETS
+)
+
+
+class CacheCollector:
+    """Hits, misses and size of the registered caches, read at scrape time."""
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache lookups answered from the cache", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache lookups not answered from the cache", labels=["cache"])
+        size = GaugeMetricFamily("cache_entries", "Entries held by the in-process caches", labels=["cache"])
+        for name, cache in caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats.get("hits", 0))
+            misses.add_metric([name], stats.get("misses", 0))
+            if stats.get("size") is not None:
+                size.add_metric([name], stats["size"])
+        yield hits
+        yield misses
+        yield size
+
+
+REGISTRY.register(CacheCollector())
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        mongodb_command_duration.labels(event.command_name, "succeeded").observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        mongodb_command_duration.labels(event.command_name, "failed").observe(event.duration_micros / 1e6)
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+class LLMCall:
+    def __init__(self):
+        self.completion = None
+
+    def record(self, completion) -> None:
+        self.completion = completion
+
+
+@contextmanager
+def time_llm_call(plugin: str, model: str):
+    """
+    Time an LLM call; pass the completion to record() to count its tokens:
+        with time_llm_call("chat", model) as call:
+            call.record(client.chat.completions.create(model=model, ...))
+    """
+    call = LLMCall()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield call
+        status = "ok"
+    finally:
+        llm_request_duration.labels(plugin, model, status).observe(time.perf_counter() - started)
+        usage = getattr(call.completion, "usage", None)
+        if usage is not None:
+            llm_tokens.labels(plugin, model, "prompt").inc(usage.prompt_tokens or 0)
+            llm_tokens.labels(plugin, model, "completion").inc(usage.completion_tokens or 0)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = http_requests_in_flight.labels(method)
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            # the route template, not the path, to keep the number of series bounded
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            http_request_duration.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+
+async def monitor_event_loop_lag(interval: float = METRICS_LOOP_LAG_INTERVAL) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - expected))
+
+
+def start_event_loop_monitor() -> Optional[asyncio.Task]:
+    if not METRICS_ENABLED:
+        return None
+    return asyncio.create_task(monitor_event_loop_lag())
+
+
+def latest_metrics():
+    """Body and content type of the /metrics response."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
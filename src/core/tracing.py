@@ -0,0 +1,304 @@
+"""
+Lightweight request tracing.
+
+A request opens a root span (TracingMiddleware, named after the route
+template, joining the trace of an incoming W3C traceparent header), and the
+work it does opens nested spans:
+- span(name, **attributes), a context manager for the external calls
+  (OpenAI, Firebase storage and auth, WeasyPrint);
+- traced(name), a decorator for sync and async functions;
+- instrument_module(__name__), called at the end of the plugin services and
+  repositories, tracing every public coroutine function of the module, plus
+  the sync functions listed in sync.
+The current span is held in a contextvar, so the spans opened in executor
+threads (Motor, run_in_threadpool) nest under the span that started them.
+
+Finished spans are queued and written by a background thread, selected by
+TRACING_EXPORTER:
+- 'off' (default): nothing is wrapped, no overhead;
+- 'jsonl': one JSON object per span appended to TRACING_FILE;
+- 'otlp': OTLP/HTTP JSON batches posted to TRACING_OTLP_ENDPOINT (an
+  OpenTelemetry collector, Jaeger, or any stand-in accepting
+  /v1/traces).
+"""
+import atexit
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "off")
+TRACING_FILE = os.getenv("TRACING_FILE", "data/traces/spans.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "industry5-api")
+TRACING_EXPORTERS = ['off', 'jsonl', 'otlp']
+TRACING_ENABLED = TRACING_EXPORTER != 'off'
+# spans written per batch, and seconds between two writes
+TRACING_BATCH_SIZE = 512
+TRACING_FLUSH_INTERVAL = 1.0
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str = "internal", attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+def otlp_payload(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """OTLP/HTTP JSON body of a batch of span records."""
+    spans = []
+    for record in records:
+        span = {
+            "traceId": record["traceId"],
+            "spanId": record["spanId"],
+            "name": record["name"],
+            "kind": OTLP_KINDS.get(record["kind"], 1),
+            "startTimeUnixNano": str(record["startTimeUnixNano"]),
+            "endTimeUnixNano": str(record["endTimeUnixNano"]),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in record["attributes"].items()],
+            "status": {"code": 2, "message": record["error"]} if record["error"] else {"code": 1},
+        }
+        if record["parentSpanId"]:
+            span["parentSpanId"] = record["parentSpanId"]
+        spans.append(span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACING_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "src.core.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class SpanExporter:
+    """Background thread writing the finished spans in batches."""
+    def __init__(self, exporter: str = TRACING_EXPORTER, path: str = TRACING_FILE, endpoint: str = TRACING_OTLP_ENDPOINT):
+        if exporter not in TRACING_EXPORTERS:
+            raise ValueError(f"Invalid tracing exporter: {exporter}, valid exporters are {', '.join(TRACING_EXPORTERS)}")
+        self.exporter = exporter
+        self.path = path
+        self.endpoint = endpoint
+        self.exported = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=100_000)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, span: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span.record())
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(TRACING_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        while not self._queue.empty():
+            records = []
+            while len(records) < TRACING_BATCH_SIZE:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(records)
+                self.exported += len(records)
+            except Exception as e:
+                self.dropped += len(records)
+                logger.error(f"Error exporting {len(records)} spans: {e}")
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        if self.exporter == "jsonl":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+        elif self.exporter == "otlp":
+            import httpx
+            httpx.post(self.endpoint, json=otlp_payload(records), timeout=5).raise_for_status()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"exporter": self.exporter, "queued": self._queue.qsize(), "exported": self.exported, "dropped": self.dropped}
+
+
+span_exporter = SpanExporter()
+
+
+def start_span(name: str, kind: str = "internal", trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attributes) -> Span:
+    parent = current_span.get()
+    if parent is not None and trace_id is None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    return Span(name, trace_id or os.urandom(16).hex(), parent_id, kind, attributes)
+
+
+def end_span(span: Span, error: Optional[BaseException] = None) -> None:
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    span_exporter.submit(span)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    """Nested span around a block, yielding the Span (None when tracing is off)."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    opened = start_span(name, kind, **attributes)
+    token = current_span.set(opened)
+    error = None
+    try:
+        yield opened
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        end_span(opened, error)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator opening a span around each call of a sync or async function."""
+    def decorator(fn):
+        if not TRACING_ENABLED:
+            return fn
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_module(module_name: str, sync: Iterable[str] = ()) -> None:
+    """
+    Trace the public coroutine functions defined in the module, and the sync
+    functions named in sync. Generators are left alone. Call it at the end of
+    the module, before other modules import its functions.
+    """
+    if not TRACING_ENABLED:
+        return
+    module = sys.modules[module_name]
+    # src.plugins.kpi.repository -> kpi.repository
+    prefix = module_name.removeprefix("src.plugins.")
+    for attribute, value in list(vars(module).items()):
+        if attribute.startswith("_") or not inspect.isfunction(value) or value.__module__ != module_name:
+            continue
+        if inspect.iscoroutinefunction(value) or attribute in sync:
+            setattr(module, attribute, traced(f"{prefix}.{attribute}")(value))
+
+
+def parse_traceparent(header: Optional[str]):
+    """(trace_id, parent span_id) of a W3C traceparent header, (None, None) if invalid."""
+    parts = (header or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", []))
+        trace_id, parent_id = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        root = Span(scope["method"], trace_id or os.urandom(16).hex(), parent_id, "server", {"http.method": scope["method"], "http.target": scope["path"]})
+        token = current_span.set(root)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"traceparent", f"00-{root.trace_id}-{root.span_id}-01".encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            # the route template and the controller are known once routed
+            route = scope.get("route")
+            endpoint = scope.get("endpoint")
+            root.name = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+            if endpoint is not None:
+                root.set_attribute("controller", f"{endpoint.__module__.removeprefix('src.plugins.')}.{endpoint.__name__}")
+            end_span(root, error)
@@ -0,0 +1,128 @@
+"""
+Data versions and conditional GETs.
+
+The data_versions collection holds one counter per scope ("kpis",
+"machines", "sites", "site:<id>", "kpi:<id>", "reports"), incremented by
+every write that changes what the read endpoints of that scope return.
+
+A read endpoint derives a strong ETag from the versions of the scopes its
+response depends on, before querying anything else, and answers 304 Not
+Modified when the If-None-Match header of the request already holds it. The
+versions are read first so that a write racing with the request can only
+make the ETag older than the body, never newer: the next poll refetches.
+"""
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Request, Response
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from src.utils import get_collection
+
+DATA_VERSIONS_COLLECTION = "data_versions"
+API_VERSION = os.getenv("VERSION")
+
+logger = logging.getLogger('uvicorn.error')
+
+
+async def get_data_versions(
+    scopes: Iterable[str],
+    request: Optional[Request] = None,
+    versions_collection: Optional[Collection] = None
+) -> Dict[str, int]:
+    """Current version of each scope, 0 for a scope never written."""
+    scopes = list(dict.fromkeys(scopes))
+    versions_collection = get_collection(request, versions_collection, DATA_VERSIONS_COLLECTION)
+    versions = {scope: 0 for scope in scopes}
+    async for document in versions_collection.find({"_id": {"$in": scopes}}):
+        versions[document["_id"]] = document["version"]
+    return versions
+
+
+async def bump_data_versions(
+    scopes: Iterable[str],
+    request: Optional[Request] = None,
+    versions_collection: Optional[Collection] = None
+) -> None:
+    """
+    Increment the version of each scope. Failures are logged and not raised:
+    the write they follow has already succeeded.
+    """
+    scopes = list(dict.fromkeys(scopes))
+    if not scopes:
+        return
+    try:
+        versions_collection = get_collection(request, versions_collection, DATA_VERSIONS_COLLECTION)
+        await versions_collection.bulk_write(
+            [UpdateOne({"_id": scope}, {"$inc": {"version": 1}}, upsert=True) for scope in scopes],
+            ordered=False
+        )
+    except Exception as e:
+        logger.error(f"Error bumping data versions {scopes}: {e}")
+
+
+def make_etag(request: Request, versions: Dict[str, int], vary: Iterable[str] = ()) -> str:
+    """
+    Strong ETag of a response: the data versions it depends on, the API
+    version, the URL (path and query) and the negotiated representation.
+    """
+    parts: List[str] = [
+        str(API_VERSION),
+        request.url.path,
+        str(request.url.query),
+        request.headers.get("accept", ""),
+        *(f"{scope}={version}" for scope, version in sorted(versions.items())),
+        *vary
+    ]
+    return '"' + hashlib.sha256("\n".join(parts).encode()).hexdigest()[:32] + '"'
+
+
+async def data_version_etag(
+    request: Request,
+    scopes: Iterable[str],
+    vary: Iterable[str] = ()
+) -> Optional[str]:
+    """ETag of a read endpoint, None when the versions cannot be read."""
+    try:
+        versions = await get_data_versions(scopes, request=request)
+    except Exception as e:
+        logger.error(f"Error reading data versions: {e}")
+        return None
+    return make_etag(request, versions, vary)
+
+
+def is_not_modified(request: Request, etag: Optional[str]) -> bool:
+    if etag is None:
+        return False
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def vary_on_accept(response: Response) -> Response:
+    """
+    The ETags and the representations (see src.plugins.kpi.columnar) depend
+    on the Accept header: a shared cache must not serve them to other clients.
+    """
+    vary = response.headers.get("vary")
+    if vary is None:
+        response.headers["Vary"] = "Accept"
+    elif "accept" not in [header.strip().lower() for header in vary.split(",")]:
+        response.headers["Vary"] = f"{vary}, Accept"
+    return response
+
+
+def not_modified_response(etag: str) -> Response:
+    return vary_on_accept(Response(status_code=304, headers={"ETag": etag}))
+
+
+def set_etag(response: Response, etag: Optional[str]) -> Response:
+    if etag is not None:
+        response.headers["ETag"] = etag
+    return vary_on_accept(response)
@@ -20,4 +20,14 @@ class KPINotFoundException(Exception):
 class MachineNotFoundException(Exception):
     def __init__(self, message):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class KPICycleException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class KPIOperationNotSupportedException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
@@ -9,6 +9,7 @@ from typing import Annotated, List, Optional, Union
 
 from fastapi import APIRouter, Depends, Query, Request
 from src.plugins.auth.firebase import verify_firebase_token
+from src.core.metrics import anomaly_analysis_duration
 
 import pandas as pd
 from firebase_admin import storage
@@ -40,7 +41,9 @@ async def getAnomalies(
             for anomaly in anomaly_type:
                 try:
                     function_name = f"analyze_{anomaly}_anomalies"
-                    n, data = service.__getattribute__(function_name)()
+                    analyze = service.__getattribute__(function_name)
+                    with anomaly_analysis_duration.labels(anomaly).time():
+                        n, data = analyze()
                     for k,v in data.items():
                         data[k] = str(v)
                     results.append(Anomaly(total_anomalies=str(n), anomalies_by_group=data))
@@ -49,7 +52,9 @@ async def getAnomalies(
                     results.append(Anomaly(total_anomalies="Not Avaiable", anomalies_by_group = {}))
         else:
             function_name = f"analyze_{anomaly_type}_anomalies"
-            n, data = service.__getattribute__(function_name)()
+            analyze = service.__getattribute__(function_name)
+            with anomaly_analysis_duration.labels(anomaly_type).time():
+                n, data = analyze()
             for k,v in data.items():
                 data[k] = str(v)
             results.append(Anomaly(total_anomalies=str(n), anomalies_by_group=data))
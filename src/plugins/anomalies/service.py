@@ -11,7 +11,11 @@ import warnings
 from statsmodels.tsa.arima.model import ARIMA
 import os
 
+from src.core.tracing import instrument_module
+
 CSV_FILE_PATH = os.getenv("CSV_FILE_PATH")
+# dataset read by data_fetch, CSV or Parquet (see scripts/generate_smart_app_data.py)
+DATASET_PATH = os.getenv("DATASET_PATH", "dataset/smart_app_data.csv")
 
 import pandas as pd
 def data_fetch(features,):
@@ -23,7 +27,7 @@ def data_fetch(features,):
     pd.DataFrame: A DataFrame containing 'time', 'asset_id', and the specified features.
     """
     # Load the data
-    df = pd.read_csv("dataset/smart_app_data.csv")
+    df = pd.read_parquet(DATASET_PATH) if DATASET_PATH.endswith(".parquet") else pd.read_csv(DATASET_PATH)
     # Check if the required columns are present in the dataset
     if 'average_cycle_time' in features:
         required_columns= ['time', 'asset_id', 'kpi', 'avg']
@@ -944,4 +948,18 @@ def analyze_cycle_time_anomalies():
             drift_threshold=0.05
 
         )
-        return total_anomalies,anomalies_per_group
\ No newline at end of file
+        return total_anomalies,anomalies_per_group
+
+
+# spans for the analyses and their slow steps (see src.core.tracing)
+instrument_module(__name__, sync=[
+    "data_fetch",
+    "analyze_energy_anomalies",
+    "analyze_downtime_anomalies",
+    "analyze_cycle_quality_anomalies",
+    "analyze_cycle_time_anomalies",
+    "Energy_Consumption_Anomaly",
+    "detect_downtime_anomalies",
+    "detect_cycle_quality_anomalies",
+    "Efficiency_Anomaly_Analysis",
+])
@@ -1,19 +1,59 @@
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from fastapi import security
 from firebase_admin import auth
 from fastapi import HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import ipaddress
+import os
 from .schema import Auth
+from src.core.tracing import span
 security = HTTPBearer()
 
+# 'fake' skips Firebase and accepts the bearer tokens "fake:<uid>[:<role>]",
+# for load tests against a local instance only (see benchmarks/load_test.py):
+# it also needs ALLOW_FAKE_AUTH=1, and the tokens are only accepted from
+# loopback clients
+AUTH_MODE = os.getenv("AUTH_MODE", "firebase")
+ALLOW_FAKE_AUTH = os.getenv("ALLOW_FAKE_AUTH", "0") == "1"
+
+def check_auth_mode():
+    """
+    Refuse to start with AUTH_MODE=fake without the ALLOW_FAKE_AUTH=1 opt-in
+    """
+    if AUTH_MODE == "fake" and not ALLOW_FAKE_AUTH:
+        raise RuntimeError("AUTH_MODE=fake accepts any user and role, set ALLOW_FAKE_AUTH=1 to run with it")
+
+def is_loopback(host: str | None) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def verify_id_token(token: str, client_host: str | None = None) -> dict:
+    """
+    Decode a Firebase ID token, or a fake token when AUTH_MODE is 'fake'
+    """
+    if AUTH_MODE == "fake":
+        if not ALLOW_FAKE_AUTH or not is_loopback(client_host):
+            raise ValueError("Fake tokens are only accepted from loopback clients")
+        prefix, _, rest = token.partition(":")
+        uid, _, role = rest.partition(":")
+        if prefix != "fake" or not uid:
+            raise ValueError("Invalid fake token")
+        return {"uid": uid, "email": f"{uid}@example.com", "role": role or "FFM"}
+    with span("firebase.auth.verify_id_token", "client"):
+        return auth.verify_id_token(token)
+
 #authentication
-def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Auth:
+def verify_firebase_token(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> Auth:
     """
     Verify the Firebase token and return the decoded token
     """
     try:
         #print(f"Received token: {credentials.credentials}")
-        decoded_token = auth.verify_id_token(credentials.credentials)
+        decoded_token = verify_id_token(credentials.credentials, request.client.host if request.client else None)
         #print(f"Decoded token: {decoded_token}")
         # Verify the token with Firebase Admin
         #auth.verify_id_token(credentials.credentials)
@@ -28,10 +68,10 @@ def verify_firebase_token_and_role(required_role: str):
     """
     Verify the Firebase token and check if the user has the required role
     """
-    def role_verifier(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    def role_verifier(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
         try:
             #print(f"Received token: {credentials.credentials}")
-            decoded_token = auth.verify_id_token(credentials.credentials)
+            decoded_token = verify_id_token(credentials.credentials, request.client.host if request.client else None)
             #print(f"Decoded token: {decoded_token}")
             # Check if user has the required role
             user_role = decoded_token.get("role")
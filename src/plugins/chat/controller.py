@@ -13,6 +13,8 @@ from src.plugins.chat.schema import Analysis, ChatResponse
 from src.plugins.kpi import service as kpi_service
 from src.plugins.machine import repository as machine_repository
 from src.plugins.kpi.schema import KPIOverview
+from src.core.metrics import time_llm_call
+from src.core.tracing import span
 
 #from .service import cost_prediction, utilization_analysis, energy_efficency_analysis
 COST_PREDICTION_DATA = {
@@ -201,10 +203,12 @@ async def getChatResponse(
 
     try:
         client = OpenAI()
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages
-        )
+        with time_llm_call("chat", "gpt-3.5-turbo") as call, span("openai.chat.completions", "client", model="gpt-3.5-turbo"):
+            completion = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=messages
+            )
+            call.record(completion)
         response = completion.choices[0].message.content
 
         # Update chat memory
@@ -15,6 +15,8 @@ import warnings
 warnings.filterwarnings("ignore")
 
 CSV_FILE_PATH = os.getenv("CSV_FILE_PATH")
+# dataset read by data_fetch, CSV or Parquet (see scripts/generate_smart_app_data.py)
+DATASET_PATH = os.getenv("DATASET_PATH", "dataset/smart_app_data.csv")
 
 import pandas as pd
 def data_fetch(features,):
@@ -26,7 +28,7 @@ def data_fetch(features,):
     pd.DataFrame: A DataFrame containing 'time', 'asset_id', and the specified features.
     """
     # Load the data
-    df = pd.read_csv("dataset/smart_app_data.csv")
+    df = pd.read_parquet(DATASET_PATH) if DATASET_PATH.endswith(".parquet") else pd.read_csv(DATASET_PATH)
     # Check if the required columns are present in the dataset
     if 'average_cycle_time' in features:
         required_columns= ['time', 'asset_id', 'kpi', 'avg']
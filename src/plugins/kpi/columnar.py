@@ -0,0 +1,83 @@
+"""
+Columnar encodings of computed KPI series, selected with the Accept header.
+
+Instead of one object per point, a series is sent as parallel arrays:
+timestamps and end_timestamps (bucket bounds in milliseconds since the epoch,
+UTC) and values.
+"""
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import msgpack
+from fastapi import Response
+
+from .schema import ComputedValue
+
+COLUMNAR_JSON = "application/vnd.kpi.columnar+json"
+MSGPACK = "application/x-msgpack"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+COLUMNAR_MEDIA_TYPES = [COLUMNAR_JSON, MSGPACK, ARROW_STREAM]
+
+
+def negotiateMediaType(accept: Optional[str]) -> Optional[str]:
+    '''
+    First columnar media type listed in the Accept header, None when the
+    client asks for (or accepts) plain JSON.
+    '''
+    if not accept:
+        return None
+    for media_range in accept.split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in COLUMNAR_MEDIA_TYPES:
+            return media_type
+        if media_type in ["application/json", "application/*", "*/*"]:
+            return None
+    return None
+
+
+def epochMillis(date: Optional[datetime]) -> Optional[int]:
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+def toColumns(values: List[ComputedValue]) -> Dict[str, List[Any]]:
+    return {
+        "timestamps": [epochMillis(value.start_date) for value in values],
+        "end_timestamps": [epochMillis(value.end_date) for value in values],
+        "values": [value.value for value in values]
+    }
+
+
+def toArrowStream(values: List[ComputedValue]) -> bytes:
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError("the pyarrow package is required to send Arrow responses") from e
+    table = pa.table({
+        "timestamp": pa.array([value.start_date for value in values], type=pa.timestamp("ms", tz="UTC")),
+        "end_timestamp": pa.array([value.end_date for value in values], type=pa.timestamp("ms", tz="UTC")),
+        "value": pa.array([value.value for value in values], type=pa.float64())
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def columnarResponse(media_type: str, values: List[ComputedValue], message: Optional[str] = None) -> Response:
+    '''
+    Successful compute response in the negotiated columnar media type. JSON
+    and MessagePack keep the success/data/message envelope of KPIResponse,
+    Arrow carries the series alone.
+    '''
+    if media_type == ARROW_STREAM:
+        return Response(content=toArrowStream(values), media_type=ARROW_STREAM)
+    body = {"success": True, "data": toColumns(values), "message": message}
+    if media_type == MSGPACK:
+        return Response(content=msgpack.packb(body), media_type=MSGPACK)
+    return Response(content=json.dumps(body, separators=(",", ":")), media_type=COLUMNAR_JSON)
@@ -5,10 +5,13 @@ from . import service
 from typing import List, Optional
 from datetime import datetime
 from .schema import (
-        KPIDetail, KPIOverview, CreateKPIBody, KPIResponse, RowReportResponse
+        KPIDetail, KPIOverview, CreateKPIBody, KPIResponse, RowReportResponse, Value, ComputeSpec
     )
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from .columnar import negotiateMediaType, columnarResponse
 from src.plugins.auth.firebase import verify_firebase_token
+from src.core.versions import data_version_etag, is_not_modified, not_modified_response, set_etag
 
 
 logger = logger = logging.getLogger('uvicorn.error')
@@ -20,6 +23,7 @@ router = APIRouter(prefix=f"/api/{API_VERSION}/kpi", tags=["Kpi"])
 @router.get("/{id}", status_code=200, response_model=KPIResponse, summary="Get kpi by id")
 async def getKPIById(
     request: Request,
+    response: Response,
     id: str,
     user=Depends(verify_firebase_token)
 ):
@@ -31,11 +35,16 @@ async def getKPIById(
         user: The authenticated user, obtained via dependency injection.
 
     Returns:
-        KPIResponse: The response containing the success status, data, and message.
+        KPIResponse: The response containing the success status, data, and message. Sent with an ETag,
+        304 Not Modified when it matches If-None-Match.
     """
     try:
+        etag = await data_version_etag(request, ["kpis"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
         kpi = await service.getKPIById(request, id)
         if kpi:
+            set_etag(response, etag)
             return KPIResponse(success=True, data=kpi)
         return KPIResponse(success=False, message=f"KPI with id {id} not found")
     except Exception as e:
@@ -46,12 +55,15 @@ async def getKPIById(
 @router.get("/machine/{machine_id}/compute",status_code=200, response_model=KPIResponse, summary="Compute the kpi value associated to machine")
 async def computeKPIByMachine(
     request: Request,
+    response: Response,
     machine_id: str,
     kpi_id: str,
     start_date: str,
     end_date: str,
     granularity_op: str,
     granularity_days: Optional[int] = None,
+    granularity_unit: Optional[str] = None,
+    backend: Optional[str] = None,
     user=Depends(verify_firebase_token)
 ):
     """
@@ -64,16 +76,29 @@ async def computeKPIByMachine(
         end_date (str): The end date for KPI computation in "%Y-%m-%d %H:%M:%S" format.
         granularity_op (str): The granularity operation.
         granularity_days (Optional[int], optional): The number of days for granularity. Defaults to None.
+        granularity_unit (Optional[str], optional): Bucket by time instead of sample index: 'day', 'week' or 'month' for calendar buckets of granularity_days units, 'window' for granularity_days-day windows starting at start_date. Defaults to None.
+        backend (Optional[str], optional): 'mongo' to compute from the database, 'snapshot' from the local Parquet snapshot (as of its last refresh). Defaults to the KPI_COMPUTE_BACKEND of the deployment.
         user: The authenticated user, obtained via dependency injection.
 
     Returns:
-        KPIResponse: The response containing the success status, data, and message.
+        KPIResponse: The response containing the success status, data, and message. With an Accept header of
+        application/vnd.kpi.columnar+json or application/x-msgpack the data is sent as parallel timestamps,
+        end_timestamps (epoch milliseconds) and values arrays; with application/vnd.apache.arrow.stream the
+        series is sent as an Arrow IPC stream. Errors are always sent as KPIResponse JSON. Results are sent
+        with an ETag, 304 Not Modified when it matches If-None-Match.
     """
     try:
         start_date_obj = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
         end_date_obj = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
 
-        res = await service.computeKPIByMachine(request, machine_id, kpi_id, start_date_obj, end_date_obj, granularity_days, granularity_op)
+        etag = await data_version_etag(request, ["kpis", f"kpi:{kpi_id}"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        res = await service.computeKPIByMachine(request, machine_id, kpi_id, start_date_obj, end_date_obj, granularity_days, granularity_op, granularity_unit, backend)
+        media_type = negotiateMediaType(request.headers.get("accept"))
+        if media_type is not None:
+            return set_etag(columnarResponse(media_type, res, message="KPI computed successfully"), etag)
+        set_etag(response, etag)
         return KPIResponse(success=True, data=res, message="KPI computed successfully")
     except Exception as e:
         logger.error(f"Error computing kpi: {e}")
@@ -82,6 +107,7 @@ async def computeKPIByMachine(
 @router.get("/site/{site_id}/compute",status_code=200, response_model=KPIResponse, summary="Compute the value of the kpi associated to site")
 async def computeKPIBySite(
     request: Request,
+    response: Response,
     site_id: int,
     kpi_id: str,
     start_date: str,
@@ -89,6 +115,8 @@ async def computeKPIBySite(
     granularity_op: str,
     granularity_days: Optional[int] = None,
     category: Optional[str] = None,
+    granularity_unit: Optional[str] = None,
+    backend: Optional[str] = None,
     user=Depends(verify_firebase_token)
 ):
     """
@@ -102,20 +130,56 @@ async def computeKPIBySite(
         granularity_op (str): The granularity operation.
         granularity_days (Optional[int], optional): The number of days for granularity. Defaults to None.
         category (Optional[str], optional): The category of the KPI. Defaults to None.
+        granularity_unit (Optional[str], optional): Bucket by time instead of sample index: 'day', 'week' or 'month' for calendar buckets of granularity_days units, 'window' for granularity_days-day windows starting at start_date. Defaults to None.
+        backend (Optional[str], optional): 'mongo' to compute from the database, 'snapshot' from the local Parquet snapshot (as of its last refresh). Defaults to the KPI_COMPUTE_BACKEND of the deployment.
         user: The authenticated user, obtained via dependency injection.
 
     Returns:
-        KPIResponse: The response containing the success status, data, and message.
+        KPIResponse: The response containing the success status, data, and message. With an Accept header of
+        application/vnd.kpi.columnar+json or application/x-msgpack the data is sent as parallel timestamps,
+        end_timestamps (epoch milliseconds) and values arrays; with application/vnd.apache.arrow.stream the
+        series is sent as an Arrow IPC stream. Errors are always sent as KPIResponse JSON. Results are sent
+        with an ETag, 304 Not Modified when it matches If-None-Match.
     """
     try:
         start_date_obj = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
         end_date_obj = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
-        res = await service.computeKPIBySite(request, site_id, kpi_id, category, start_date_obj, end_date_obj, granularity_days, granularity_op)
+        etag = await data_version_etag(request, ["kpis", f"kpi:{kpi_id}", "sites", f"site:{site_id}", "machines"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        res = await service.computeKPIBySite(request, site_id, kpi_id, category, start_date_obj, end_date_obj, granularity_days, granularity_op, granularity_unit, backend)
+        media_type = negotiateMediaType(request.headers.get("accept"))
+        if media_type is not None and res is not None:
+            return set_etag(columnarResponse(media_type, res, message="KPI computed successfully"), etag)
+        set_etag(response, etag)
         return KPIResponse(success=True, data=res, message="KPI computed successfully")
     except Exception as e:
         logger.error(f"Error computing kpi: {e}")
         return KPIResponse(success=False, data=None, message=f"Error computing kpi: {e}")
 
+@router.post("/compute/batch", status_code=200, summary="Compute several kpis, streaming the results as NDJSON")
+async def computeKPIBatch(
+    request: Request,
+    specs: List[ComputeSpec],
+    user=Depends(verify_firebase_token)
+):
+    """
+    Compute several KPIs in one request. Each spec targets either a machine (machine_id) or a site (site_id, optionally
+    restricted to a category) and takes the same parameters as the single compute endpoints.
+
+    Args:
+        specs (List[ComputeSpec]): The computations to run.
+        user: The authenticated user, obtained via dependency injection.
+
+    Returns:
+        StreamingResponse: One JSON object per line with the index of the spec, the success status, data, and message,
+        in completion order.
+    """
+    async def lines():
+        async for result in service.computeKPIBatch(request, specs):
+            yield result.model_dump_json() + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @router.get("/site/{site_id}/report",status_code=200, response_model=RowReportResponse, summary="Compute the value of the kpi associated to site")
 async def computeKPIForReport(
     request: Request,
@@ -149,7 +213,7 @@ async def computeKPIForReport(
         return RowReportResponse(success=False, data=None, message=f"Error computing kpi: {e}")
 
 @router.get("/",status_code=200, response_model=KPIResponse, summary="List kpis")
-async def listKPI(request: Request, site: int, user=Depends(verify_firebase_token)):
+async def listKPI(request: Request, response: Response, site: int, user=Depends(verify_firebase_token)):
     """
     List all KPIs.
 
@@ -158,10 +222,15 @@ async def listKPI(request: Request, site: int, user=Depends(verify_firebase_toke
         user: The authenticated user, obtained via dependency injection.
 
     Returns:
-        KPIResponse: The response containing the success status, data, and message.
+        KPIResponse: The response containing the success status, data, and message. Sent with an ETag,
+        304 Not Modified when it matches If-None-Match.
     """
     try:
+        etag = await data_version_etag(request, ["kpis", "sites", f"site:{site}"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
         all_kpi: List[KPIOverview] = await service.listKPIs(site, request)
+        set_etag(response, etag)
         return KPIResponse(success=True, data=all_kpi, message="KPIs listed successfully")
     except Exception as e:
         logger.error(f"Error listing kpis: {e}")
@@ -202,6 +271,32 @@ async def createKPI(
         return KPIResponse(success=False, data=None, message=f"Error creating kpi: {str(e)}")
 
 
+@router.post("/{id}/data", status_code=200, response_model=KPIResponse, summary="Add data to kpi")
+async def addKPIData(
+    request: Request,
+    id: str,
+    values: List[Value],
+    user=Depends(verify_firebase_token)
+):
+    """
+    Add data points to an atomic KPI. The cached results computed from this KPI on the same machines are invalidated.
+
+    Args:
+        id (str): The ID of the KPI.
+        values (List[Value]): The data points to add.
+        user: The authenticated user, obtained via dependency injection.
+
+    Returns:
+        KPIResponse: The response containing the success status, data, and message.
+    """
+    try:
+        inserted = await service.addKPIData(request, id, values)
+        return KPIResponse(success=True, data=None, message=f"{inserted} data points added successfully")
+    except Exception as e:
+        logger.error(f"Error adding kpi data: {e}")
+        return KPIResponse(success=False, data=None, message=f"Error adding kpi data: {str(e)}")
+
+
 @router.delete("/{id}", status_code=200, response_model=KPIResponse, summary="Delete kpi")
 async def deleteKPI(
     request: Request,
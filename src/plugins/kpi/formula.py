@@ -0,0 +1,193 @@
+"""
+Compiled evaluation of composite KPI formulas.
+
+A formula is parsed with sympy once and turned into a NumPy function that
+evaluates a whole series at a time. Compiled formulas are cached by KPI id
+and formula hash.
+
+A formula can also be translated into a MongoDB aggregation expression so
+that composite KPIs are evaluated in the database.
+"""
+import hashlib
+from typing import Dict, Optional
+
+import numpy as np
+from sympy import Abs, Add, Max, Min, Mul, Number, Pow, Rational, Symbol, exp, lambdify, log, sympify
+
+
+class CompiledFormula:
+    def __init__(self, formula: str):
+        expression = sympify(formula)
+        self.symbols = sorted(str(symbol) for symbol in expression.free_symbols)
+        self.function = lambdify(
+            [Symbol(name) for name in self.symbols],
+            expression,
+            modules="numpy"
+        )
+
+    def evaluate(self, values: Dict[str, np.ndarray], length: int) -> np.ndarray:
+        """
+        Evaluate the formula on arrays of the same length, keyed by symbol name.
+        Undefined results (NaN, division by zero) are set to 0.
+        """
+        with np.errstate(all="ignore"):
+            result = self.function(*[values[name] for name in self.symbols])
+        result = np.broadcast_to(np.asarray(result, dtype=float), (length,))
+        return np.nan_to_num(result, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+# (kpi id, formula hash) -> CompiledFormula
+compiled_formulas: Dict[tuple, CompiledFormula] = {}
+
+
+def formulaHash(formula: str) -> str:
+    return hashlib.sha1(formula.encode()).hexdigest()
+
+
+def getCompiledFormula(kpi_id, formula: str) -> CompiledFormula:
+    key = (str(kpi_id), formulaHash(formula))
+    compiled = compiled_formulas.get(key)
+    if compiled is None:
+        compiled = CompiledFormula(formula)
+        compiled_formulas[key] = compiled
+    return compiled
+
+
+def invalidateCompiledFormula(kpi_id):
+    for key in [key for key in compiled_formulas if key[0] == str(kpi_id)]:
+        compiled_formulas.pop(key, None)
+
+
+class UnsupportedFormula(Exception):
+    pass
+
+
+INFINITY = float("inf")
+NAN = float("nan")
+
+
+def guarded(variable, condition, expression, otherwise=None):
+    # null (NumPy's NaN) instead of an error, otherwise the infinite value
+    # NumPy gives; both are turned into 0 by formulaToExpression
+    return {
+        "$let": {
+            "vars": { "x": variable },
+            "in": { "$cond": [condition, expression, otherwise] }
+        }
+    }
+
+
+def isNull(variable):
+    # null and missing sort before every number
+    return { "$lte": [variable, None] }
+
+
+def guardedDivide(numerator, denominator):
+    # x/0 is ±inf and 0/0 is NaN in NumPy
+    return {
+        "$let": {
+            "vars": { "n": numerator, "d": denominator },
+            "in": {
+                "$switch": {
+                    "branches": [
+                        { "case": { "$or": [isNull("$$n"), isNull("$$d")] }, "then": None },
+                        { "case": { "$ne": ["$$d", 0] }, "then": { "$divide": ["$$n", "$$d"] } },
+                        { "case": { "$gt": ["$$n", 0] }, "then": INFINITY },
+                        { "case": { "$lt": ["$$n", 0] }, "then": -INFINITY }
+                    ],
+                    "default": None
+                }
+            }
+        }
+    }
+
+
+def product(factors):
+    if len(factors) == 0:
+        return 1.0
+    if len(factors) == 1:
+        return factors[0]
+    return { "$multiply": factors }
+
+
+def toExpression(node, fields: Dict[str, str]):
+    if isinstance(node, Symbol):
+        if str(node) not in fields:
+            raise UnsupportedFormula(f"Unknown symbol {node}")
+        return fields[str(node)]
+    if isinstance(node, Number):
+        if not node.is_finite:
+            raise UnsupportedFormula(f"Unsupported number {node}")
+        return float(node)
+    if isinstance(node, Add):
+        return { "$add": [toExpression(arg, fields) for arg in node.args] }
+    if isinstance(node, Mul):
+        numerator = [arg for arg in node.args if not (isinstance(arg, Pow) and arg.exp.is_negative)]
+        denominator = [1 / arg for arg in node.args if isinstance(arg, Pow) and arg.exp.is_negative]
+        expression = product([toExpression(arg, fields) for arg in numerator])
+        if denominator:
+            expression = guardedDivide(expression, product([toExpression(arg, fields) for arg in denominator]))
+        return expression
+    if isinstance(node, Pow):
+        base = toExpression(node.base, fields)
+        if node.exp.is_negative:
+            return guardedDivide(1.0, toExpression(1 / node, fields))
+        if node.exp == Rational(1, 2):
+            return guarded(base, { "$gte": ["$$x", 0] }, { "$sqrt": "$$x" })
+        if node.exp.is_integer:
+            return { "$pow": [base, toExpression(node.exp, fields)] }
+        return guarded(base, { "$gte": ["$$x", 0] }, { "$pow": ["$$x", toExpression(node.exp, fields)] })
+    if isinstance(node, Abs):
+        return { "$abs": toExpression(node.args[0], fields) }
+    if isinstance(node, (Min, Max)):
+        # $min/$max skip nulls where NumPy propagates NaN: null if any argument is
+        args = { f"arg{index}": toExpression(arg, fields) for index, arg in enumerate(node.args) }
+        return {
+            "$let": {
+                "vars": args,
+                "in": {
+                    "$cond": [
+                        { "$or": [isNull(f"$${name}") for name in args] },
+                        None,
+                        { "$min" if isinstance(node, Min) else "$max": [f"$${name}" for name in args] }
+                    ]
+                }
+            }
+        }
+    if isinstance(node, exp):
+        return { "$exp": toExpression(node.args[0], fields) }
+    if isinstance(node, log) and len(node.args) == 1:
+        # log(0) is -inf in NumPy
+        return guarded(
+            toExpression(node.args[0], fields),
+            { "$gt": ["$$x", 0] },
+            { "$ln": "$$x" },
+            { "$cond": [{ "$eq": ["$$x", 0] }, -INFINITY, None] }
+        )
+    raise UnsupportedFormula(f"Unsupported operation {type(node).__name__}")
+
+
+def formulaToExpression(formula: str, fields: Dict[str, str]) -> Optional[dict]:
+    '''
+    MongoDB expression equivalent to the formula, each symbol being read from
+    the field path given in fields ("$values.<id>"). A null or infinite result
+    (division by zero, square root of a negative number...) gives 0, as in
+    CompiledFormula. None when the formula uses an operation without an
+    equivalent.
+    '''
+    try:
+        expression = toExpression(sympify(formula), fields)
+    except UnsupportedFormula:
+        return None
+    return {
+        "$let": {
+            "vars": { "value": expression },
+            "in": {
+                "$cond": [
+                    { "$or": [isNull("$$value"), { "$in": ["$$value", [INFINITY, -INFINITY, NAN]] }] },
+                    0.0,
+                    "$$value"
+                ]
+            }
+        }
+    }
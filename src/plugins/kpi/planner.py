@@ -0,0 +1,85 @@
+"""
+Planning of composite KPI computations.
+
+The KPI dependency graph maps each KPI id to the ids of its children
+(config.children). Atomic KPIs have no children and are the leaves.
+"""
+from typing import Dict, List
+
+from src.custom_exceptions import KPICycleException
+
+
+def findCycle(graph: Dict[str, List[str]]) -> List[str] | None:
+    """
+    Return the ids forming a dependency cycle, or None if the graph is acyclic.
+    """
+    visiting, visited = set(), set()
+    path = []
+
+    def visit(node):
+        visiting.add(node)
+        path.append(node)
+        for child in graph.get(node, []):
+            if child in visiting:
+                return path[path.index(child):] + [child]
+            if child not in visited:
+                cycle = visit(child)
+                if cycle:
+                    return cycle
+        visiting.discard(node)
+        visited.add(node)
+        path.pop()
+        return None
+
+    for node in graph:
+        if node not in visited:
+            cycle = visit(node)
+            if cycle:
+                return cycle
+    return None
+
+
+# id of a kpi being created, not stored yet
+NEW_KPI = "new"
+
+
+def graphWithNewKPI(graph: Dict[str, List[str]], names: Dict[str, str], name: str, children: List[str]) -> Dict[str, List[str]]:
+    """
+    The graph of existing KPIs (names keyed by id) with a new KPI, keyed by
+    NEW_KPI, depending on children. Formulas reference KPIs by name, so an
+    existing KPI with the same name stands for the new one: the dependencies
+    reaching it close a cycle.
+    """
+    alias = {id: NEW_KPI for id, kpi_name in names.items() if kpi_name == name}
+    merged: Dict[str, List[str]] = {}
+    for node, node_children in [*graph.items(), (NEW_KPI, children)]:
+        merged.setdefault(alias.get(node, node), []).extend(alias.get(child, child) for child in node_children)
+    return merged
+
+
+def topologicalOrder(graph: Dict[str, List[str]]) -> List[str]:
+    """
+    Order the KPIs so that every KPI comes after all of its children.
+    Raises KPICycleException if the dependencies are cyclic.
+    """
+    pending = {node: len(set(graph.get(node, []))) for node in graph}
+    parents = {node: [] for node in graph}
+    for node, children in graph.items():
+        for child in set(children):
+            parents.setdefault(child, []).append(node)
+            pending.setdefault(child, 0)
+
+    ready = [node for node, count in pending.items() if count == 0]
+    order = []
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        for parent in parents.get(node, []):
+            pending[parent] -= 1
+            if pending[parent] == 0:
+                ready.append(parent)
+
+    if len(order) != len(pending):
+        cycle = findCycle(graph) or []
+        raise KPICycleException(f"Cyclic KPI dependencies: {' -> '.join(cycle)}")
+    return order
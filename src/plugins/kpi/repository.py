@@ -1,16 +1,83 @@
 
 
-from typing import List
-from sympy import sympify, zoo
-from .schema import KPI, Configuration, ComputedValue, KPIOverview, KPIDetail
+from typing import Dict, List
+from .schema import KPI, Configuration, ComputedValue, KPIOverview, KPIDetail, Value
+from .formula import getCompiledFormula, invalidateCompiledFormula
+from .planner import topologicalOrder
+from .rollup import (
+    ROLLUP_PERIODS, ROLLUP_OPS, rollupPeriodFor, coveredRange, periodStart, nextPeriod, toUTC,
+    emptyPartial, mergePartial, pointPartial, finalizePartial, partialState
+)
+from .sketch import SKETCH_QUANTILES, Moments, TDigest
+from .snapshot import SNAPSHOT_COLUMNS, abortSnapshot, beginSnapshot, commitSnapshot, computeSnapshotKPIs, writePartitions
 from src.utils import get_collection
-from src.custom_exceptions import KPINotFoundException
+from src.core.cache import LRUCache, register_cache
+from src.core.versions import DATA_VERSIONS_COLLECTION, bump_data_versions
+from src.core.invalidation import InvalidationEvent, invalidation_bus
+from src.core.indexes import register_indexes, register_query_shape
+from src.core.tracing import instrument_module
+from src.plugins.site import repository as siteRepository
+from src.custom_exceptions import KPINotFoundException, KPIOperationNotSupportedException
 
+from pymongo import ASCENDING, IndexModel, UpdateOne
 from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorCollection
 
 from fastapi import Request
 from bson import ObjectId
-import math
+import os
+import asyncio
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+# 'embedded': data points live in the data array of each kpis document
+# 'timeseries': data points live in the kpi_measurements time-series collection
+KPI_STORAGE_BACKEND = os.getenv("KPI_STORAGE_BACKEND", "embedded")
+MEASUREMENTS_COLLECTION = "kpi_measurements"
+
+# per (kpi, machine, day/week/month) aggregates, always maintained on writes;
+# set KPI_ROLLUPS=true once scripts/backfill_kpi_rollups.py has been run to
+# answer the calendar and aligned window buckets from them
+ROLLUPS_COLLECTION = "kpi_rollups"
+KPI_ROLLUPS_ENABLED = os.getenv("KPI_ROLLUPS", "false").lower() == "true"
+
+# atomic kpis per compute aggregation, and aggregations run concurrently by
+# a single computeKPIsByMachines call
+KPI_COMPUTE_BATCH_SIZE = max(int(os.getenv("KPI_COMPUTE_BATCH_SIZE", 10)), 1)
+KPI_COMPUTE_CONCURRENCY = max(int(os.getenv("KPI_COMPUTE_CONCURRENCY", 4)), 1)
+
+# evaluate the composite kpis made of atomic kpis in the database, with the
+# expression translated from their formula at creation
+KPI_COMPOSITE_PUSHDOWN = os.getenv("KPI_COMPOSITE_PUSHDOWN", "true").lower() == "true"
+
+# where the atomic kpis are computed by default, a request can pick another:
+# 'mongo': aggregation pipelines on the storage backend
+# 'snapshot': the local Parquet snapshot (see snapshot.py), as of its last refresh
+COMPUTE_BACKENDS = ['mongo', 'snapshot']
+KPI_COMPUTE_BACKEND = os.getenv("KPI_COMPUTE_BACKEND", "mongo")
+
+# $percentile, behind the p50/p90/p99 operations, needs MongoDB 7.0 or later
+PERCENTILE_MIN_VERSION = (7, 0)
+# (major, minor) of the server of each client, read once with buildInfo
+server_versions = {}
+
+ROLLUP_KEYS = [("kpi_id", ASCENDING), ("machine_id", ASCENDING), ("period", ASCENDING), ("start", ASCENDING)]
+
+# kpi_measurements is a time-series collection, created with its index by
+# ensureMeasurementsCollection (an index created first would make it a plain one)
+register_indexes("kpis", [
+    IndexModel([("name", ASCENDING)]),
+    IndexModel([("config.children", ASCENDING)])
+])
+register_indexes(ROLLUPS_COLLECTION, [IndexModel(ROLLUP_KEYS, unique=True)])
+
+# kpi definitions (KPIDetail) keyed by ("id", id) and ("name", name)
+kpi_cache = register_cache(LRUCache(
+    "kpi_definitions",
+    maxsize=int(os.getenv("KPI_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("KPI_CACHE_TTL", 300))
+))
 
 async def computeKPIByMachine(
     machine_id, 
@@ -20,7 +87,9 @@ async def computeKPIByMachine(
     granularity_days, 
     granularity_op,
     request: Request | None = None,
-    kpis_collection: Collection[KPI] | None = None
+    kpis_collection: Collection[KPI] | None = None,
+    granularity_unit: str | None = None,
+    backend: str | None = None
 ) -> List[ComputedValue]:
     '''
     machine_id: id of the machine
@@ -29,85 +98,215 @@ async def computeKPIByMachine(
     end_date
     granularity_days: number of days to subaggregate data
     granularity_operation: sum, avg, min, max
+    granularity_unit: None to bucket by sample index, 'day', 'week', 'month' for
+        calendar buckets of granularity_days units, 'window' for fixed windows of
+        granularity_days days anchored at start_date
+    backend: one of COMPUTE_BACKENDS, KPI_COMPUTE_BACKEND when None
+    '''
+    res = await computeKPIByMachines(
+        [machine_id],
+        kpi_id,
+        start_date,
+        end_date,
+        granularity_days,
+        granularity_op,
+        request,
+        kpis_collection=kpis_collection,
+        granularity_unit=granularity_unit,
+        backend=backend
+    )
+    return res[str(machine_id)]
+
+async def computeKPIByMachines(
+    machines_ids,
+    kpi_id,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    request: Request | None = None,
+    kpis_collection: Collection[KPI] | None = None,
+    granularity_unit: str | None = None,
+    backend: str | None = None,
+    with_state: bool = False
+) -> Dict[str, List[ComputedValue]]:
+    '''
+    Same as computeKPIByMachine for several machines at once: the bucket series
+    of every machine is computed by a single aggregation.
+    Returns the series keyed by machine id (as string), empty when a machine has
+    no data in the range.
+    with_state: also compute the mergeable state of the std and percentile
+    buckets, for a merge across machines (see service.applyAggregationOpToMachinesKpi)
+    '''
+    res = await computeKPIsByMachines(
+        [kpi_id],
+        machines_ids,
+        start_date,
+        end_date,
+        granularity_days,
+        granularity_op,
+        request,
+        kpis_collection=kpis_collection,
+        granularity_unit=granularity_unit,
+        backend=backend,
+        with_state=with_state
+    )
+    return res[str(kpi_id)]
+
+async def computeKPIsByMachines(
+    kpi_ids,
+    machines_ids,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    request: Request | None = None,
+    kpis_collection: Collection[KPI] | None = None,
+    granularity_unit: str | None = None,
+    backend: str | None = None,
+    with_state: bool = False
+) -> Dict[str, Dict[str, List[ComputedValue]]]:
+    '''
+    Compute several kpis for several machines. The whole dependency graph of
+    the requested kpis is resolved first, every atomic kpi it contains is
+    computed exactly once, then the composite kpis are evaluated children first.
+    Composites of atomic kpis with a translated formula are evaluated by the
+    database instead, their children are then only fetched if needed elsewhere.
+    Returns the series keyed by kpi id, then by machine id (as strings).
     '''
     kpis_collection = get_collection(request, kpis_collection, "kpis")
+    backend = backend or KPI_COMPUTE_BACKEND
+    if backend not in COMPUTE_BACKENDS:
+        raise Exception('Not valid compute backend')
 
-    kpi_obj = await getKPIById(kpi_id, request=request, kpis_collection=kpis_collection)
-    
+    kpis = await getKPIGraph(kpi_ids, request, kpis_collection=kpis_collection)
+    order = topologicalOrder({ id: [str(child) for child in kpi.config.children] for id, kpi in kpis.items() })
 
-    if kpi_obj.config.formula != None:
-        res = await computeCompositeKPIByMachine(
-            machine_id, 
-            kpi_id, 
-            start_date, 
-            end_date, 
-            granularity_days, 
-            granularity_op,
-            request,
-            kpis_collection
-        )
-    else:
-        res = await computeAtomicKPIByMachine(
-            machine_id, 
-            kpi_id, 
-            start_date, 
-            end_date, 
-            granularity_days, 
-            granularity_op,
-            request,
-            kpis_collection=kpis_collection
-        )
-    return res
+    # composites of atomic kpis run as a single pipeline, unless their
+    # children are answered from the rollups
+    pushed = set()
+    if backend == 'mongo' and KPI_COMPOSITE_PUSHDOWN and rollupPlan(start_date, end_date, granularity_days, granularity_op, granularity_unit) is None:
+        pushed = {
+            id for id in order
+            if kpis[id].config.formula is not None
+            and kpis[id].config.expression is not None
+            and len(kpis[id].config.children) > 0
+            and all(kpis[str(child)].config.formula is None for child in kpis[id].config.children)
+        }
+    # kpis to compute: the requested ones and the children of the composites
+    # evaluated here, parents first
+    requested = { str(kpi_id) for kpi_id in kpi_ids }
+    required = set(requested)
+    for id in reversed(order):
+        if id in required and id not in pushed:
+            required.update(str(child) for child in kpis[id].config.children)
+    leaves = [id for id in order if id in required and kpis[id].config.formula is None]
+    pushed = [id for id in order if id in required and id in pushed]
+    if backend == 'mongo' and (leaves or pushed):
+        await checkOperationSupported(granularity_op, kpis_collection.database)
 
-async def computeCompositeKPIByMachine(
-    machine_id, 
-    kpi_id, 
-    start_date, 
-    end_date, 
-    granularity_days, 
-    granularity_op,
-    request: Request,
-    kpis_collection: Collection[KPI]
-) -> List[ComputedValue]:
-    kpi_obj = await getKPIById(kpi_id, request, kpis_collection=kpis_collection)
-    
+    # atomic kpis are fetched KPI_COMPUTE_BATCH_SIZE per aggregation, with at
+    # most KPI_COMPUTE_CONCURRENCY aggregations running at once
+    semaphore = asyncio.Semaphore(KPI_COMPUTE_CONCURRENCY)
+    async def computeBatch(batch):
+        async with semaphore:
+            if backend == 'snapshot':
+                # pandas scans block, keep them off the event loop
+                return await asyncio.to_thread(
+                    computeSnapshotKPIs,
+                    machines_ids,
+                    batch,
+                    start_date,
+                    end_date,
+                    granularity_days,
+                    granularity_op,
+                    granularity_unit
+                )
+            return await computeAtomicKPIsByMachines(
+                machines_ids,
+                batch,
+                start_date,
+                end_date,
+                granularity_days,
+                granularity_op,
+                request,
+                kpis_collection=kpis_collection,
+                granularity_unit=granularity_unit,
+                # only the requested atomic kpis are merged across machines
+                with_state=with_state and not requested.isdisjoint(batch)
+            )
 
-    if kpi_obj is None:
-        raise Exception('KPI not found')
-    
-    
+    async def computePushed(id):
+        async with semaphore:
+            return { id: await computeCompositeKPIByMachines(
+                machines_ids,
+                kpis[id],
+                start_date,
+                end_date,
+                granularity_days,
+                granularity_op,
+                request,
+                kpis_collection=kpis_collection,
+                granularity_unit=granularity_unit
+            ) }
+
+    batches = [leaves[i:i + KPI_COMPUTE_BATCH_SIZE] for i in range(0, len(leaves), KPI_COMPUTE_BATCH_SIZE)]
+    computed = {}
+    for values in await asyncio.gather(*[computeBatch(batch) for batch in batches], *[computePushed(id) for id in pushed]):
+        computed.update(values)
+
+    for id in order:
+        if id in required and id not in computed:
+            computed[id] = evaluateCompositeKPI(kpis[id], kpis, computed, machines_ids, granularity_unit)
+    return { str(kpi_id): computed[str(kpi_id)] for kpi_id in kpi_ids }
+
+def evaluateCompositeKPI(
+    kpi_obj: KPIDetail,
+    kpis: Dict[str, KPIDetail],
+    computed: Dict[str, Dict[str, List[ComputedValue]]],
+    machines_ids,
+    granularity_unit: str | None = None
+) -> Dict[str, List[ComputedValue]]:
+    '''
+    Evaluate the formula of a composite kpi on the already computed series of
+    its children. As in compositePipeline, the buckets of the children are
+    paired by start date (by index for the buckets of granularity_days data
+    points) and only the buckets every child has a value for are evaluated.
+    '''
     children = kpi_obj.config.children
+    if len(children) == 0:
+        raise Exception('Composite KPI without children: ', kpi_obj.name)
     formula = kpi_obj.config.formula
-    values = []
-    for child in children:
-        kpi_dep = await getKPIById(child, request, kpis_collection=kpis_collection)
-        value = await computeKPIByMachine(
-            machine_id,
-            kpi_dep.id, 
-            start_date,
-            end_date,
-            granularity_days, 
-            granularity_op,
-            request,
-            kpis_collection=kpis_collection
-        )
-        values.append({ kpi_dep.name: value })
-
-    value = values[0]
-    key = next(iter(value.keys()))
-    results = []
-    for index in range(len(value[key])):
-        symbol_dict = {}
-        for v in values:
-            k = next(iter(v.keys()))
-            symbol_dict[k] = v[k][index].value
-        parsed_expression = sympify(formula)
-        result = parsed_expression.subs(symbol_dict)
-        if result == zoo or result == None or math.isnan(result):
-            result = 0 #raise Exception('invalid math operation')
-        results.append(ComputedValue(value=result))
+    names = [kpis[str(child)].name for child in children]
+
+    compiled = getCompiledFormula(kpi_obj.id, formula)
+    results = {}
+    for machine_id in machines_ids:
+        machine_id = str(machine_id)
+        series = [computed[str(child)].get(machine_id, []) for child in children]
+        if granularity_unit is None:
+            # index buckets have no gaps: bucket i is the i-th of every series
+            length = min(len(points) for points in series)
+            aligned = [points[:length] for points in series]
+        else:
+            by_start = [{ point.start_date: point for point in points } for points in series]
+            common = set(by_start[0]).intersection(*by_start[1:])
+            starts = sorted(common)
+            aligned = [[points[start] for start in starts] for points in by_start]
+        buckets = aligned[0]
+        length = len(buckets)
+        symbol_dict = {
+            name: np.fromiter((point.value for point in points), dtype=float, count=length)
+            for name, points in zip(names, aligned)
+        }
+        result = compiled.evaluate(symbol_dict, length)
+        results[machine_id] = [
+            ComputedValue(value=result[index], start_date=bucket.start_date, end_date=bucket.end_date)
+            for index, bucket in enumerate(buckets)
+        ]
     return results
 
+# the percentile operations need MongoDB 7.0 (see checkOperationSupported)
 mappingOp = {
     'avg': {
         'op': 'avg',
@@ -129,24 +328,207 @@ mappingOp = {
         'op': 'stdDevPop',
         'data': 'avg'
     },
+    'p50': {
+        'op': 'percentile',
+        'data': 'avg',
+        'p': 0.5
+    },
+    'p90': {
+        'op': 'percentile',
+        'data': 'avg',
+        'p': 0.9
+    },
+    'p99': {
+        'op': 'percentile',
+        'data': 'avg',
+        'p': 0.99
+    },
 }
 
-async def computeAtomicKPIByMachine(
-    machine_id, 
-    kpi_id, 
-    start_date, 
-    end_date, 
-    granularity_days, 
-    granularity_op,
-    request: Request,
-    kpis_collection: Collection[KPI]
+def groupAccumulator(granularity_op, prefix):
+    op = mappingOp[granularity_op]
+    if op['op'] == 'percentile':
+        return {
+            "$percentile": {
+                "input": f"${prefix}.{op['data']}",
+                "p": [op['p']],
+                "method": "approximate"
+            }
+        }
+    return { f"${op['op']}": f"${prefix}.{op['data']}" }
 
-) -> List[ComputedValue]:
-    kpis_collection = get_collection(request, kpis_collection, "kpis")
-    pipeline = [
+def stateAccumulators(granularity_op, prefix):
+    '''
+    Extra accumulators of the operations whose buckets carry a mergeable
+    state: count and mean for std, a quantile grid for the percentiles (with
+    $percentile, so MongoDB 7.0 like the percentile operations themselves).
+    '''
+    op = mappingOp[granularity_op]
+    field = f"${prefix}.{op['data']}"
+    count = { "$sum": { "$cond": [{ "$isNumber": field }, 1, 0] } }
+    if op['op'] == 'stdDevPop':
+        return { "count": count, "mean": { "$avg": field } }
+    if op['op'] == 'percentile':
+        return {
+            "count": count,
+            "quantiles": {
+                "$percentile": {
+                    "input": field,
+                    "p": SKETCH_QUANTILES,
+                    "method": "approximate"
+                }
+            }
+        }
+    return {}
+
+def bucketState(row, granularity_op):
+    '''
+    Pop the fields of stateAccumulators from a bucket and build its state.
+    '''
+    op = mappingOp[granularity_op]['op']
+    if op == 'stdDevPop':
+        return Moments.fromStd(row.pop("count"), row.pop("mean"), row["value"])
+    if op == 'percentile':
+        return TDigest.fromQuantiles(row.pop("quantiles"), row.pop("count"))
+    return None
+
+def valueExpression(granularity_op):
+    # $percentile returns one value per requested percentile
+    if mappingOp[granularity_op]['op'] == 'percentile':
+        return { "$arrayElemAt": ["$value", 0] }
+    return 1
+
+async def checkOperationSupported(granularity_op, db):
+    '''
+    Raise KPIOperationNotSupportedException for the percentile operations on
+    a server older than PERCENTILE_MIN_VERSION, instead of failing in the
+    middle of the aggregation.
+    '''
+    if mappingOp.get(granularity_op, {}).get('op') != 'percentile':
+        return
+    version = server_versions.get(id(db.client))
+    if version is None:
+        try:
+            info = await db.command("buildInfo")
+        except Exception:
+            # unknown version, the aggregation reports it if unsupported
+            return
+        version = tuple(info.get("versionArray", [0, 0])[:2])
+        server_versions[id(db.client)] = version
+    if version < PERCENTILE_MIN_VERSION:
+        raise KPIOperationNotSupportedException(
+            f"{granularity_op} needs MongoDB {'.'.join(map(str, PERCENTILE_MIN_VERSION))} or later, "
+            f"the server runs {'.'.join(map(str, version))}"
+        )
+
+calendarUnits = ['day', 'week', 'month']
+
+def bucketStartExpression(start_date, granularity_days, granularity_unit):
+    '''
+    Expression assigning each data point to the start of its bucket, computed
+    directly from data.datetime so that no intermediate array is needed.
+    '''
+    size = granularity_days or 1
+    if granularity_unit == 'window':
+        window_ms = size * 24 * 60 * 60 * 1000
+        return {
+            "$add": [
+                start_date,
+                {
+                    "$multiply": [
+                        {
+                            "$floor": {
+                                "$divide": [
+                                    { "$subtract": ["$data.datetime", start_date] },
+                                    window_ms
+                                ]
+                            }
+                        },
+                        window_ms
+                    ]
+                }
+            ]
+        }
+    if granularity_unit in calendarUnits:
+        return {
+            "$dateTrunc": {
+                "date": "$data.datetime",
+                "unit": granularity_unit,
+                "binSize": size
+            }
+        }
+    raise Exception('Not valid granularity unit')
+
+def bucketEndExpression(bucket_start, granularity_days, granularity_unit):
+    size = granularity_days or 1
+    if granularity_unit == 'window':
+        return { "$add": [bucket_start, size * 24 * 60 * 60 * 1000] }
+    return {
+        "$dateAdd": {
+            "startDate": bucket_start,
+            "unit": granularity_unit,
+            "amount": size
+        }
+    }
+
+def measurementFilter(datetime_field, machine_field, machines_ids, start_date, end_date, exclude=None):
+    '''
+    Filter on the data points of the given machines (all of them when None) in
+    [start_date, end_date], leaving out the [first, last) span of exclude.
+    '''
+    query = {}
+    if machines_ids is not None:
+        query[machine_field] = { "$in": [ObjectId(machine_id) for machine_id in machines_ids] }
+    if exclude is not None:
+        query["$or"] = [
+            { datetime_field: { "$gte": start_date, "$lt": exclude[0] } },
+            { datetime_field: { "$gte": exclude[1], "$lte": end_date } }
+        ]
+    elif start_date is not None:
+        query[datetime_field] = {
+            "$gte": start_date,
+            "$lte": end_date
+        }
+    return query
+
+def measurementStages(kpi_ids, machines_ids, start_date, end_date, exclude=None):
+    '''
+    First stages of every compute pipeline: select the data points of the kpis
+    for the given machines in [start_date, end_date] and shape them as
+    {"_id": kpi id, "data": {...}}, whatever the storage backend.
+    '''
+    kpi_ids = [ObjectId(kpi_id) for kpi_id in kpi_ids]
+    if KPI_STORAGE_BACKEND == 'timeseries':
+        return [
+            {
+                "$match": {
+                    "meta.kpi_id": { "$in": kpi_ids },
+                    **measurementFilter("datetime", "meta.machine_id", machines_ids, start_date, end_date, exclude)
+                }
+            },
+            {
+                "$sort": {
+                    "datetime": 1
+                }
+            },
+            {
+                "$project": {
+                    "_id": "$meta.kpi_id",
+                    "data": {
+                        "datetime": "$datetime",
+                        "machine_id": "$meta.machine_id",
+                        "sum": "$sum",
+                        "avg": "$avg",
+                        "min": "$min",
+                        "max": "$max"
+                    }
+                }
+            }
+        ]
+    return [
         {
             "$match": {
-                "_id": ObjectId(kpi_id)
+                "_id": { "$in": kpi_ids }
             }
         },
         {
@@ -155,115 +537,600 @@ async def computeAtomicKPIByMachine(
             }
         },
         {
-            "$match": {
-                "data.machine_id": ObjectId(machine_id),
-                "data.datetime": {
-                    "$gte": start_date,
-                    "$lte": end_date
+            "$match": measurementFilter("data.datetime", "data.machine_id", machines_ids, start_date, end_date, exclude)
+        }
+    ]
+
+def getMeasurementsCollection(request: Request | None, kpis_collection: Collection[KPI] | None):
+    '''
+    Collection the compute pipelines run on: kpis itself for the embedded
+    backend, the dedicated measurements collection otherwise.
+    '''
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
+    if KPI_STORAGE_BACKEND == 'timeseries':
+        return kpis_collection.database[MEASUREMENTS_COLLECTION]
+    return kpis_collection
+
+def bucketedPipeline(
+    machines_ids,
+    kpi_ids,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    granularity_unit,
+    with_state: bool = False
+):
+    '''
+    Single streaming $group over the matched data points: each point goes
+    straight to its (kpi, machine, time bucket), so server memory is bounded by
+    the number of buckets instead of the number of points.
+    '''
+    return [
+        *measurementStages(kpi_ids, machines_ids, start_date, end_date),
+        {
+            "$group": {
+                "_id": {
+                    "kpi_id": "$_id",
+                    "machine_id": "$data.machine_id",
+                    "start_date": bucketStartExpression(start_date, granularity_days, granularity_unit)
+                },
+                "value": groupAccumulator(granularity_op, "data"),
+                **(stateAccumulators(granularity_op, "data") if with_state else {})
+            }
+        },
+        {
+            "$sort": {
+                "_id.kpi_id": 1,
+                "_id.machine_id": 1,
+                "_id.start_date": 1
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "kpi_id": "$_id.kpi_id",
+                "machine_id": "$_id.machine_id",
+                "value": valueExpression(granularity_op),
+                **{ field: 1 for field in stateAccumulators(granularity_op, "data") if with_state },
+                "start_date": "$_id.start_date",
+                "end_date": bucketEndExpression("$_id.start_date", granularity_days, granularity_unit)
+            }
+        }
+    ]
+
+def indexedPipeline(
+    machines_ids,
+    kpi_ids,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    with_state: bool = False
+):
+    '''
+    Buckets made of granularity_days consecutive data points of each kpi and
+    machine, in datetime order. Each point is numbered within its kpi and
+    machine by $setWindowFields (MongoDB 5.0) and goes straight to its bucket,
+    like in bucketedPipeline, instead of pushing every point of a machine into
+    a single document.
+    '''
+    return [
+        *measurementStages(kpi_ids, machines_ids, start_date, end_date),
+        {
+            "$setWindowFields": {
+                "partitionBy": {
+                    "kpi_id": "$_id",
+                    "machine_id": "$data.machine_id"
+                },
+                "sortBy": { "data.datetime": 1 },
+                "output": {
+                    "position": { "$documentNumber": {} }
                 }
             }
         },
         {
             "$group": {
-                "_id": None,
-                "documents": {
-                    "$push": "$$ROOT"
-                }
+                "_id": {
+                    "kpi_id": "$_id",
+                    "machine_id": "$data.machine_id",
+                    # $documentNumber starts at 1
+                    "index": {
+                        "$floor": {
+                            "$divide": [{ "$subtract": ["$position", 1] }, granularity_days]
+                        }
+                    }
+                },
+                "value": groupAccumulator(granularity_op, "data"),
+                **(stateAccumulators(granularity_op, "data") if with_state else {})
             }
         },
         {
-            "$unwind": {
-                "path": "$documents",
-                "includeArrayIndex": "index"
+            "$sort": {
+                "_id.kpi_id": 1,
+                "_id.machine_id": 1,
+                "_id.index": 1
             }
         },
         {
-            "$addFields": {
-                "groupIndex": {
-                    "$floor": {
-                        "$divide": ["$index", granularity_days]
-                    }
+            "$project": {
+                "_id": 0,
+                "kpi_id": "$_id.kpi_id",
+                "machine_id": "$_id.machine_id",
+                "value": valueExpression(granularity_op),
+                "index": "$_id.index",
+                **{ field: 1 for field in stateAccumulators(granularity_op, "data") if with_state }
+            }
+        }
+    ]
+
+rawPartialAccumulators = {
+    "count": { "$sum": { "$cond": [{ "$isNumber": "$data.avg" }, 1, 0] } },
+    "sum": { "$sum": "$data.sum" },
+    "avg_sum": { "$sum": "$data.avg" },
+    "avg_sumsq": { "$sum": { "$multiply": ["$data.avg", "$data.avg"] } },
+    "min": { "$min": "$data.min" },
+    "max": { "$max": "$data.max" }
+}
+
+rollupPartialAccumulators = {
+    "count": { "$sum": "$data.count" },
+    "sum": { "$sum": "$data.sum" },
+    "avg_sum": { "$sum": "$data.avg_sum" },
+    "avg_sumsq": { "$sum": "$data.avg_sumsq" },
+    "min": { "$min": "$data.min" },
+    "max": { "$max": "$data.max" }
+}
+
+def partialStages(start_date, granularity_days, granularity_unit, accumulators):
+    return [
+        {
+            "$group": {
+                "_id": {
+                    "machine_id": "$data.machine_id",
+                    "start_date": bucketStartExpression(start_date, granularity_days, granularity_unit)
+                },
+                **accumulators
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "machine_id": "$_id.machine_id",
+                "start_date": "$_id.start_date",
+                "end_date": bucketEndExpression("$_id.start_date", granularity_days, granularity_unit),
+                **{ field: 1 for field in accumulators }
+            }
+        }
+    ]
+
+def rollupPipeline(
+    machines_ids,
+    kpi_id,
+    start_date,
+    granularity_days,
+    granularity_unit,
+    period,
+    covered
+):
+    '''
+    Partial aggregates of each (machine, time bucket) from the rollups of the
+    whole periods in covered.
+    '''
+    return [
+        {
+            "$match": {
+                "kpi_id": ObjectId(kpi_id),
+                "machine_id": { "$in": [ObjectId(machine_id) for machine_id in machines_ids] },
+                "period": period,
+                "start": {
+                    "$gte": covered[0],
+                    "$lt": covered[1]
                 }
             }
         },
+        {
+            "$project": {
+                "_id": 0,
+                "data": {
+                    "datetime": "$start",
+                    "machine_id": "$machine_id",
+                    "count": "$count",
+                    "sum": "$sum",
+                    "avg_sum": "$avg_sum",
+                    "avg_sumsq": "$avg_sumsq",
+                    "min": "$min",
+                    "max": "$max"
+                }
+            }
+        },
+        *partialStages(start_date, granularity_days, granularity_unit, rollupPartialAccumulators)
+    ]
+
+def edgesPipeline(
+    machines_ids,
+    kpi_id,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_unit,
+    covered
+):
+    '''
+    Partial aggregates of each (machine, time bucket) from the raw data points
+    outside of the span served by the rollups.
+    '''
+    return [
+        *measurementStages([kpi_id], machines_ids, start_date, end_date, exclude=covered),
+        *partialStages(start_date, granularity_days, granularity_unit, rawPartialAccumulators)
+    ]
+
+def rollupPlan(start_date, end_date, granularity_days, granularity_op, granularity_unit):
+    '''
+    (period, covered span) when the buckets can be served from the rollups,
+    None otherwise.
+    '''
+    if not KPI_ROLLUPS_ENABLED or granularity_unit is None or granularity_op not in ROLLUP_OPS:
+        return None
+    period = rollupPeriodFor(start_date, granularity_days, granularity_unit)
+    covered = coveredRange(start_date, end_date, period) if period else None
+    if covered is None:
+        return None
+    return period, covered
+
+def compositePipeline(
+    machines_ids,
+    kpi_obj: KPIDetail,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    granularity_unit
+):
+    '''
+    Series of a composite kpi made of atomic kpis, evaluated in the database:
+    the buckets of the children are grouped by (machine, bucket) and the
+    formula expression is applied to their values, keyed by child id.
+    '''
+    children = [str(child) for child in kpi_obj.config.children]
+    if granularity_unit is not None:
+        stages = bucketedPipeline(machines_ids, children, start_date, end_date, granularity_days, granularity_op, granularity_unit)
+        bucket = "$start_date"
+    else:
+        stages = indexedPipeline(machines_ids, children, start_date, end_date, granularity_days, granularity_op)
+        bucket = "$index"
+    return [
+        *stages,
         {
             "$group": {
-                "_id": "$groupIndex",
-                "value": {
-                    f"${mappingOp[granularity_op]['op']}": f"$documents.data.{mappingOp[granularity_op]['data']}"
+                "_id": {
+                    "machine_id": "$machine_id",
+                    "bucket": bucket
+                },
+                "start_date": { "$first": "$start_date" },
+                "end_date": { "$first": "$end_date" },
+                "values": {
+                    "$push": {
+                        "k": { "$toString": "$kpi_id" },
+                        "v": "$value"
+                    }
                 }
             }
         },
+        # a bucket is evaluated only when every child has a value for it
+        {
+            "$match": {
+                "values": { "$size": len(children) }
+            }
+        },
         {
             "$sort": {
-                "_id": 1
+                "_id.machine_id": 1,
+                "_id.bucket": 1
             }
         },
         {
             "$project": {
                 "_id": 0,
-                "value": 1
+                "machine_id": "$_id.machine_id",
+                "start_date": 1,
+                "end_date": 1,
+                "value": {
+                    "$let": {
+                        "vars": { "values": { "$arrayToObject": "$values" } },
+                        "in": kpi_obj.config.expression
+                    }
+                }
             }
         }
     ]
-    return [ComputedValue(**kpi) for kpi in await kpis_collection.aggregate(pipeline).to_list(None)]
+
+async def computeCompositeKPIByMachines(
+    machines_ids,
+    kpi_obj: KPIDetail,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    request: Request,
+    kpis_collection: Collection[KPI],
+    granularity_unit: str | None = None
+) -> Dict[str, List[ComputedValue]]:
+    measurements_collection = getMeasurementsCollection(request, kpis_collection)
+    pipeline = compositePipeline(
+        machines_ids,
+        kpi_obj,
+        start_date,
+        end_date,
+        granularity_days,
+        granularity_op,
+        granularity_unit
+    )
+    results = { str(machine_id): [] for machine_id in machines_ids }
+    # the sorts of $setWindowFields can spill to disk (the default from MongoDB 6.0)
+    async for value in measurements_collection.aggregate(pipeline, allowDiskUse=True):
+        results[str(value.pop("machine_id"))].append(ComputedValue(**value))
+    return results
+
+async def computeRolledUpKPIByMachines(
+    machines_ids,
+    kpi_id,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    granularity_unit,
+    period,
+    covered,
+    request: Request,
+    kpis_collection: Collection[KPI]
+) -> Dict[str, List[ComputedValue]]:
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
+    rollups_collection = kpis_collection.database[ROLLUPS_COLLECTION]
+    measurements_collection = getMeasurementsCollection(request, kpis_collection)
+    rolled_up, edges = await asyncio.gather(
+        rollups_collection.aggregate(
+            rollupPipeline(machines_ids, kpi_id, start_date, granularity_days, granularity_unit, period, covered)
+        ).to_list(None),
+        measurements_collection.aggregate(
+            edgesPipeline(machines_ids, kpi_id, start_date, end_date, granularity_days, granularity_unit, covered)
+        ).to_list(None)
+    )
+
+    # a bucket at a range edge gets partials from both sides
+    buckets = {}
+    for row in [*rolled_up, *edges]:
+        key = (str(row["machine_id"]), row["start_date"])
+        if key not in buckets:
+            buckets[key] = (row["end_date"], emptyPartial())
+        mergePartial(buckets[key][1], row)
+
+    results = { str(machine_id): [] for machine_id in machines_ids }
+    for (machine_id, bucket_start), (bucket_end, partial) in sorted(buckets.items(), key=lambda item: item[0][1]):
+        # no points of the operation in the bucket (e.g. only null avg values)
+        value = finalizePartial(partial, granularity_op)
+        if value is None:
+            continue
+        results[machine_id].append(ComputedValue(
+            value=value,
+            start_date=bucket_start,
+            end_date=bucket_end,
+            state=partialState(partial, granularity_op)
+        ))
+    return results
+
+async def computeAtomicKPIByMachine(
+    machine_id, 
+    kpi_id, 
+    start_date, 
+    end_date, 
+    granularity_days, 
+    granularity_op,
+    request: Request,
+    kpis_collection: Collection[KPI],
+    granularity_unit: str | None = None
+) -> List[ComputedValue]:
+    res = await computeAtomicKPIByMachines(
+        [machine_id],
+        kpi_id,
+        start_date,
+        end_date,
+        granularity_days,
+        granularity_op,
+        request,
+        kpis_collection,
+        granularity_unit=granularity_unit
+    )
+    return res[str(machine_id)]
+
+async def computeAtomicKPIByMachines(
+    machines_ids, 
+    kpi_id, 
+    start_date, 
+    end_date, 
+    granularity_days, 
+    granularity_op,
+    request: Request,
+    kpis_collection: Collection[KPI],
+    granularity_unit: str | None = None
+) -> Dict[str, List[ComputedValue]]:
+    res = await computeAtomicKPIsByMachines(
+        machines_ids,
+        [kpi_id],
+        start_date,
+        end_date,
+        granularity_days,
+        granularity_op,
+        request,
+        kpis_collection,
+        granularity_unit=granularity_unit
+    )
+    return res[str(kpi_id)]
+
+async def computeAtomicKPIsByMachines(
+    machines_ids,
+    kpi_ids,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    request: Request,
+    kpis_collection: Collection[KPI],
+    granularity_unit: str | None = None,
+    with_state: bool = False
+) -> Dict[str, Dict[str, List[ComputedValue]]]:
+    '''
+    Compute several atomic kpis for several machines in one aggregation pass.
+    Returns the series keyed by kpi id, then by machine id (as strings).
+    '''
+    plan = rollupPlan(start_date, end_date, granularity_days, granularity_op, granularity_unit)
+    if plan is not None:
+        # whole periods come from the coarsest fitting rollup, only the
+        # partial periods at the range edges are read from raw data
+        period, covered = plan
+        res = await asyncio.gather(*[
+            computeRolledUpKPIByMachines(
+                machines_ids,
+                kpi_id,
+                start_date,
+                end_date,
+                granularity_days,
+                granularity_op,
+                granularity_unit,
+                period,
+                covered,
+                request,
+                kpis_collection
+            )
+            for kpi_id in kpi_ids
+        ])
+        return { str(kpi_id): values for kpi_id, values in zip(kpi_ids, res) }
+
+    measurements_collection = getMeasurementsCollection(request, kpis_collection)
+    if granularity_unit is not None:
+        pipeline = bucketedPipeline(
+            machines_ids,
+            kpi_ids,
+            start_date,
+            end_date,
+            granularity_days,
+            granularity_op,
+            granularity_unit,
+            with_state
+        )
+    else:
+        pipeline = indexedPipeline(
+            machines_ids,
+            kpi_ids,
+            start_date,
+            end_date,
+            granularity_days,
+            granularity_op,
+            with_state
+        )
+    results = {
+        str(kpi_id): { str(machine_id): [] for machine_id in machines_ids }
+        for kpi_id in kpi_ids
+    }
+    async for kpi in measurements_collection.aggregate(pipeline, allowDiskUse=True):
+        state = bucketState(kpi, granularity_op) if with_state else None
+        results[str(kpi.pop("kpi_id"))][str(kpi.pop("machine_id"))].append(ComputedValue(**kpi, state=state))
+    return results
+
+def cacheKPI(kpi: KPIDetail) -> KPIDetail:
+    kpi_cache.set(("id", str(kpi.id)), kpi)
+    kpi_cache.set(("name", kpi.name), kpi)
+    return kpi
+
+def invalidateKPI(id: str | None = None, name: str | None = None):
+    '''
+    Drop a kpi definition from the cache, under both its id and its name.
+    '''
+    if id is not None:
+        cached = kpi_cache.invalidate(("id", str(id)))
+        if cached is not None:
+            kpi_cache.invalidate(("name", cached.name))
+    if name is not None:
+        cached = kpi_cache.invalidate(("name", name))
+        if cached is not None:
+            kpi_cache.invalidate(("id", str(cached.id)))
+
+def onKPIChange(event: InvalidationEvent):
+    # definitions written by another worker; new data points leave them as is
+    if event.only_changes("data"):
+        return
+    if event.operation == "invalidate" or event.document_id is None:
+        kpi_cache.clear()
+    else:
+        invalidateKPI(id=event.document_id)
+
+invalidation_bus.subscribe(["kpis"], onKPIChange)
 
 async def getKPIByName(name: str, request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> KPIDetail:
+    cached = kpi_cache.get(("name", name))
+    if cached is not None:
+        return cached
+
     kpis_collection = get_collection(request, kpis_collection, "kpis")
-    kpi = await kpis_collection.find_one({"name": name})
-    return KPIDetail(**kpi) if kpi else None
+    kpi = await kpis_collection.find_one({"name": name}, {"data": 0})
+    return cacheKPI(KPIDetail(**kpi)) if kpi else None
 
 async def getKPIById(id: str, request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> KPIDetail | KPIOverview:
+    cached = kpi_cache.get(("id", str(id)))
+    if cached is not None:
+        return cached
 
     kpis_collection = get_collection(request, kpis_collection, "kpis")
 
-    kpi = await kpis_collection.find_one({"_id": ObjectId(id)})
+    kpi = await kpis_collection.find_one({"_id": ObjectId(id)}, {"data": 0})
 
     if kpi is None:
         raise KPINotFoundException("KPI not found")
     
 
     kpi_detail = KPIDetail(**kpi)
-    return kpi_detail
+    return cacheKPI(kpi_detail)
     
 
-async def listKPIs(site: int, request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> List[KPIOverview]:
-    sites_collection = get_collection(request, None, "sites")
+async def getKPIGraph(kpi_ids: List[str], request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> Dict[str, KPIDetail]:
+    '''
+    Definitions of the given kpis and of all their descendants, keyed by id.
+    The definitions missing from the cache are fetched with one $in query per
+    dependency level, without the data arrays.
+    '''
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
 
-    kpis = sites_collection.aggregate([
-        {
-            "$match":
-            {
-                "site_id": site
-            }
-        },
-        {
-            "$lookup":
-            {
-                "from": "kpis",
-                "localField": "kpis_ids",
-                "foreignField": "_id",
-                "as": "kpis"
-            }
-        },
-        {
-            "$unwind":
-            {
-                "path": "$kpis"
-            }
-        },
-        {
-            "$project":
-            {
-                "_id": "$kpis._id",
-                "name": "$kpis.name",
-                "type": "$kpis.type",
-                "description": "$kpis.description",
-                "unite_of_measure": "$kpis.unite_of_measure"
-            }
+    kpis = {}
+    missing = { str(kpi_id) for kpi_id in kpi_ids }
+    while missing:
+        found = [kpi_cache.get(("id", kpi_id)) for kpi_id in missing]
+        found = [kpi for kpi in found if kpi is not None]
+        for kpi in found:
+            kpis[str(kpi.id)] = kpi
+        missing = [kpi_id for kpi_id in missing if kpi_id not in kpis]
+        if missing:
+            cursor = kpis_collection.find(
+                { "_id": { "$in": [ObjectId(kpi_id) for kpi_id in missing] } },
+                { "data": 0 }
+            )
+            fetched = [cacheKPI(KPIDetail(**kpi)) async for kpi in cursor]
+            if len(fetched) != len(missing):
+                raise KPINotFoundException("KPI not found")
+            for kpi in fetched:
+                kpis[str(kpi.id)] = kpi
+            found += fetched
+        missing = {
+            str(child)
+            for kpi in found
+            for child in kpi.config.children
+            if str(child) not in kpis
         }
-    ])
-    kpis = [KPIOverview(**kpi) async for kpi in kpis]
+    return kpis
+
+async def listKPIs(site: int, request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> List[KPIOverview]:
+    # materialized catalog of the site, see site.repository.getKPICatalog
+    catalog = await siteRepository.getKPICatalog(site, request=request)
+    kpis = [KPIOverview(**kpi) for kpi in catalog]
 
     if len(kpis) == 0:
         raise KPINotFoundException("No KPIs found")
@@ -299,7 +1166,8 @@ async def createKPI(
     children: List[str], 
     formula: str,
     request: Request | None = None,
-    kpis_collection: Collection[KPI] | None = None
+    kpis_collection: Collection[KPI] | None = None,
+    expression: dict | None = None
 ) -> KPIDetail:
     kpis_collection = get_collection(request, kpis_collection, "kpis")
     data = [] # what data should be stored here?
@@ -311,17 +1179,262 @@ async def createKPI(
         data=data,
         config=Configuration(
             children=children, 
-            formula=formula
+            formula=formula,
+            expression=expression
         )
     )
     kpi_obj = kpi.model_dump(by_alias=True)
     kpi_obj["config"]["children"] = [ObjectId(kpi_id) for kpi_id in kpi_obj["config"]["children"]]
     result = await kpis_collection.insert_one(kpi_obj)
-    created_kpi = await kpis_collection.find_one({"_id": result.inserted_id})
-    return KPIDetail(**created_kpi)
+    invalidateCompiledFormula(result.inserted_id)
+    invalidateKPI(id=result.inserted_id, name=name)
+    await bump_data_versions(["kpis"], versions_collection=kpis_collection.database[DATA_VERSIONS_COLLECTION])
+    created_kpi = await kpis_collection.find_one({"_id": result.inserted_id}, {"data": 0})
+    return cacheKPI(KPIDetail(**created_kpi))
 
 async def deleteKPIByID(id: str, request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> bool:
     kpis_collection = get_collection(request, kpis_collection, "kpis")
 
-    result = await kpis_collection.delete_one({"_id": ObjectId(id)})
-    return result.deleted_count > 0
+    deleted = await kpis_collection.find_one_and_delete({"_id": ObjectId(id)}, {"name": 1})
+    await kpis_collection.database[ROLLUPS_COLLECTION].delete_many({ "kpi_id": ObjectId(id) })
+    invalidateCompiledFormula(id)
+    invalidateKPI(id=id, name=deleted["name"] if deleted else None)
+    await bump_data_versions(["kpis", f"kpi:{id}"], versions_collection=kpis_collection.database[DATA_VERSIONS_COLLECTION])
+    return deleted is not None
+
+async def getKPIAncestors(kpi_id: str, request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> List[str]:
+    '''
+    Ids of the composite kpis depending, directly or not, on the given kpi.
+    '''
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
+
+    ancestors = set()
+    level = [ObjectId(kpi_id)]
+    while level:
+        cursor = kpis_collection.find({ "config.children": { "$in": level } }, { "_id": 1 })
+        level = [kpi["_id"] async for kpi in cursor if str(kpi["_id"]) not in ancestors]
+        ancestors.update(str(id) for id in level)
+    return list(ancestors)
+
+async def insertKPIData(kpi_id: str, values: List[Value], request: Request | None = None, kpis_collection: Collection[KPI] | None = None) -> int:
+    '''
+    Store new data points of an atomic kpi in the active storage backend.
+    '''
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
+    points = [
+        {
+            "datetime": value.datetime,
+            "machine_id": ObjectId(value.machine_id),
+            "sum": value.sum,
+            "avg": value.avg,
+            "min": value.min,
+            "max": value.max
+        }
+        for value in values
+    ]
+    if len(points) == 0:
+        return 0
+
+    if KPI_STORAGE_BACKEND == 'timeseries':
+        measurements_collection = getMeasurementsCollection(request, kpis_collection)
+        result = await measurements_collection.insert_many(
+            [
+                {
+                    **{ field: value for field, value in point.items() if field != "machine_id" },
+                    "meta": {
+                        "kpi_id": ObjectId(kpi_id),
+                        "machine_id": point["machine_id"]
+                    }
+                }
+                for point in points
+            ],
+            ordered=False
+        )
+        inserted = len(result.inserted_ids)
+    else:
+        result = await kpis_collection.update_one(
+            { "_id": ObjectId(kpi_id) },
+            { "$push": { "data": { "$each": points } } }
+        )
+        if result.matched_count == 0:
+            raise KPINotFoundException("KPI not found")
+        inserted = len(points)
+
+    await updateRollups(kpi_id, points, kpis_collection.database[ROLLUPS_COLLECTION])
+    return inserted
+
+async def updateRollups(kpi_id: str, points: List[dict], rollups_collection: AsyncIOMotorCollection):
+    '''
+    Fold new data points into the day, week and month rollups of their
+    machines, with one upsert per touched rollup.
+    '''
+    partials = {}
+    for point in points:
+        if point["datetime"] is None:
+            continue
+        for period in ROLLUP_PERIODS:
+            key = (point["machine_id"], period, periodStart(point["datetime"], period))
+            mergePartial(partials.setdefault(key, emptyPartial()), pointPartial(point))
+
+    operations = []
+    for (machine_id, period, start), partial in partials.items():
+        update = { "$inc": { field: partial[field] for field in ["count", "sum", "avg_sum", "avg_sumsq"] } }
+        if partial["min"] is not None:
+            update["$min"] = { "min": partial["min"] }
+        if partial["max"] is not None:
+            update["$max"] = { "max": partial["max"] }
+        operations.append(UpdateOne(
+            { "kpi_id": ObjectId(kpi_id), "machine_id": machine_id, "period": period, "start": start },
+            update,
+            upsert=True
+        ))
+    if operations:
+        await rollups_collection.bulk_write(operations, ordered=False)
+
+async def rebuildRollups(kpi_id: str, request: Request | None = None, kpis_collection: Collection[KPI] | None = None):
+    '''
+    Recompute every rollup of a kpi from its raw data points, server side.
+    '''
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
+    measurements_collection = getMeasurementsCollection(request, kpis_collection)
+    await kpis_collection.database[ROLLUPS_COLLECTION].delete_many({ "kpi_id": ObjectId(kpi_id) })
+    for period in ROLLUP_PERIODS:
+        pipeline = [
+            *measurementStages([kpi_id], None, None, None),
+            {
+                "$group": {
+                    "_id": {
+                        "machine_id": "$data.machine_id",
+                        "start": bucketStartExpression(None, 1, period)
+                    },
+                    **rawPartialAccumulators
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "kpi_id": { "$literal": ObjectId(kpi_id) },
+                    "machine_id": "$_id.machine_id",
+                    "period": { "$literal": period },
+                    "start": "$_id.start",
+                    **{ field: 1 for field in rawPartialAccumulators }
+                }
+            },
+            {
+                "$merge": {
+                    "into": ROLLUPS_COLLECTION,
+                    "on": ["kpi_id", "machine_id", "period", "start"],
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert"
+                }
+            }
+        ]
+        async for _ in measurements_collection.aggregate(pipeline):
+            pass
+
+async def measurementsRange(kpi_id: str, measurements_collection):
+    '''
+    (first, last) datetime of the data points of a kpi, None when it has none.
+    '''
+    if KPI_STORAGE_BACKEND == 'timeseries':
+        pipeline = [
+            { "$match": { "meta.kpi_id": ObjectId(kpi_id) } },
+            { "$group": { "_id": None, "first": { "$min": "$datetime" }, "last": { "$max": "$datetime" } } }
+        ]
+    else:
+        pipeline = [
+            { "$match": { "_id": ObjectId(kpi_id) } },
+            { "$project": { "_id": 0, "first": { "$min": "$data.datetime" }, "last": { "$max": "$data.datetime" } } }
+        ]
+    rows = await measurements_collection.aggregate(pipeline).to_list(None)
+    if not rows or rows[0].get("first") is None:
+        return None
+    return toUTC(rows[0]["first"]), toUTC(rows[0]["last"])
+
+async def refreshSnapshot(kpi_id: str, request: Request | None = None, kpis_collection: Collection[KPI] | None = None, directory: str | None = None) -> int:
+    '''
+    Rewrite the Parquet snapshot of an atomic kpi from all its data points,
+    read and written one month partition at a time so that memory is bounded
+    by the points of a month. Returns the number of points written.
+    '''
+    kpis_collection = get_collection(request, kpis_collection, "kpis")
+    measurements_collection = getMeasurementsCollection(request, kpis_collection)
+    bounds = await measurementsRange(kpi_id, measurements_collection)
+    staging = await asyncio.to_thread(beginSnapshot, str(kpi_id), directory)
+    written = 0
+    try:
+        month = periodStart(bounds[0], 'month') if bounds else None
+        while month is not None and month <= bounds[1]:
+            following = nextPeriod(month, 'month')
+            # dates are stored with millisecond precision
+            stages = measurementStages([kpi_id], None, month, following - timedelta(milliseconds=1))
+            points = [row["data"] async for row in measurements_collection.aggregate(stages)]
+            if points:
+                written += await asyncio.to_thread(writePartitions, staging, pd.DataFrame(points, columns=SNAPSHOT_COLUMNS))
+            month = following
+        await asyncio.to_thread(commitSnapshot, str(kpi_id), staging, written, directory)
+    except BaseException:
+        # also on cancellation, the staging directory is left behind otherwise
+        await asyncio.to_thread(abortSnapshot, staging)
+        raise
+    # results served from the snapshot change with it
+    ancestors = await getKPIAncestors(kpi_id, kpis_collection=kpis_collection)
+    await bump_data_versions(
+        [f"kpi:{id}" for id in [str(kpi_id), *ancestors]],
+        versions_collection=kpis_collection.database[DATA_VERSIONS_COLLECTION]
+    )
+    return written
+
+async def ensureMeasurementsCollection(db) -> AsyncIOMotorCollection:
+    '''
+    Create the kpi_measurements time-series collection and its
+    (kpi, machine, datetime) index if they do not exist yet. Raises if it
+    exists as a plain collection, e.g. created by an insert made first.
+    '''
+    cursor = await db.list_collections(filter={ "name": MEASUREMENTS_COLLECTION })
+    existing = await cursor.to_list(None)
+    if existing and existing[0].get("type") != "timeseries":
+        raise Exception(f"{MEASUREMENTS_COLLECTION} is not a time-series collection, rename it and run scripts/migrate_kpi_measurements.py")
+    if not existing:
+        await db.create_collection(
+            MEASUREMENTS_COLLECTION,
+            timeseries={
+                "timeField": "datetime",
+                "metaField": "meta",
+                "granularity": "hours"
+            }
+        )
+    collection = db[MEASUREMENTS_COLLECTION]
+    await collection.create_index([
+        ("meta.kpi_id", ASCENDING),
+        ("meta.machine_id", ASCENDING),
+        ("datetime", ASCENDING)
+    ])
+    return collection
+
+async def ensureRollupsCollection(db) -> AsyncIOMotorCollection:
+    '''
+    Create the unique (kpi, machine, period, start) index of kpi_rollups,
+    needed by the upserts and by the $merge of the backfill.
+    '''
+    collection = db[ROLLUPS_COLLECTION]
+    await collection.create_index(ROLLUP_KEYS, unique=True)
+    return collection
+
+register_query_shape("kpi.getKPIByName", "kpis", filter={ "name": "" })
+register_query_shape("kpi.listKPIsByName", "kpis", filter={ "name": { "$in": [""] } })
+register_query_shape("kpi.getKPIAncestors", "kpis", filter={ "config.children": { "$in": [ObjectId()] } })
+register_query_shape(
+    "kpi.compute",
+    MEASUREMENTS_COLLECTION if KPI_STORAGE_BACKEND == 'timeseries' else "kpis",
+    pipeline=measurementStages([ObjectId()], [ObjectId()], datetime(2024, 1, 1), datetime(2024, 2, 1))
+)
+register_query_shape(
+    "kpi.rollups",
+    ROLLUPS_COLLECTION,
+    pipeline=rollupPipeline([ObjectId()], ObjectId(), datetime(2024, 1, 1), 1, 'day', 'day', (datetime(2024, 1, 1), datetime(2024, 2, 1)))[:1]
+)
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
@@ -0,0 +1,139 @@
+"""
+Mergeable aggregates of KPI data points over calendar periods.
+
+A rollup holds, for one (kpi, machine, period), the count of points with an
+average, the sums of sum, avg and avg², and the min and max. Rollups of
+consecutive periods merge by adding the sums and taking the min and max, so
+any bucket made of whole periods can be computed from them exactly.
+
+Periods follow $dateTrunc in UTC: days start at midnight, weeks on Sunday,
+months on the 1st.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from .sketch import Moments
+
+ROLLUP_PERIODS = ['day', 'week', 'month']
+# operations that can be computed from the rollup aggregates
+ROLLUP_OPS = ['sum', 'avg', 'min', 'max', 'std']
+
+
+def toUTC(date: datetime) -> datetime:
+    # pymongo returns naive UTC datetimes, compare everything that way
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def periodStart(date: datetime, period: str) -> datetime:
+    date = toUTC(date).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return date
+    if period == 'week':
+        return date - timedelta(days=(date.weekday() + 1) % 7)
+    if period == 'month':
+        return date.replace(day=1)
+    raise ValueError(f"Unknown rollup period: {period}")
+
+
+def nextPeriod(start: datetime, period: str) -> datetime:
+    if period == 'day':
+        return start + timedelta(days=1)
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period == 'month':
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    raise ValueError(f"Unknown rollup period: {period}")
+
+
+def rollupPeriodFor(start_date: datetime, granularity_days, granularity_unit) -> Optional[str]:
+    '''
+    Coarsest rollup period whose periods never straddle two requested buckets,
+    None if the buckets do not align on any.
+    '''
+    size = granularity_days or 1
+    if granularity_unit in ROLLUP_PERIODS:
+        # $dateTrunc bins of n units are unions of whole units
+        return granularity_unit
+    if granularity_unit == 'window':
+        start_date = toUTC(start_date)
+        if start_date != periodStart(start_date, 'day'):
+            return None
+        if size % 7 == 0 and start_date == periodStart(start_date, 'week'):
+            return 'week'
+        return 'day'
+    return None
+
+
+def coveredRange(start_date: datetime, end_date: datetime, period: str):
+    '''
+    [first, last) span of the whole periods inside [start_date, end_date],
+    None if there is none. Points outside of it are read from the raw data.
+    '''
+    start_date, end_date = toUTC(start_date), toUTC(end_date)
+    first = periodStart(start_date, period)
+    if first < start_date:
+        first = nextPeriod(first, period)
+    last = periodStart(end_date, period)
+    if last <= first:
+        return None
+    return first, last
+
+
+def emptyPartial() -> Dict:
+    return {"count": 0, "sum": 0.0, "avg_sum": 0.0, "avg_sumsq": 0.0, "min": None, "max": None}
+
+
+def mergePartial(partial: Dict, other: Dict) -> Dict:
+    for field in ["count", "sum", "avg_sum", "avg_sumsq"]:
+        partial[field] += other.get(field) or 0
+    if other.get("min") is not None:
+        partial["min"] = other["min"] if partial["min"] is None else min(partial["min"], other["min"])
+    if other.get("max") is not None:
+        partial["max"] = other["max"] if partial["max"] is None else max(partial["max"], other["max"])
+    return partial
+
+
+def pointPartial(point: Dict) -> Dict:
+    avg = point.get("avg")
+    return {
+        "count": 1 if avg is not None else 0,
+        "sum": point.get("sum") or 0.0,
+        "avg_sum": avg or 0.0,
+        "avg_sumsq": avg * avg if avg is not None else 0.0,
+        "min": point.get("min"),
+        "max": point.get("max")
+    }
+
+
+def finalizePartial(partial: Dict, granularity_op: str) -> Optional[float]:
+    '''
+    Value of the bucket for the given operation, matching the $group
+    accumulators used on raw data (std is the population std of avg).
+    '''
+    count = partial["count"]
+    if granularity_op == 'sum':
+        return partial["sum"]
+    if granularity_op == 'min':
+        return partial["min"]
+    if granularity_op == 'max':
+        return partial["max"]
+    if count == 0:
+        return None
+    mean = partial["avg_sum"] / count
+    if granularity_op == 'avg':
+        return mean
+    if granularity_op == 'std':
+        return math.sqrt(max(partial["avg_sumsq"] / count - mean * mean, 0.0))
+    raise ValueError(f"Unknown operation: {granularity_op}")
+
+
+def partialState(partial: Dict, granularity_op: str) -> Optional[Moments]:
+    # moments of the averages, to pool the std of several machines
+    if granularity_op == 'std':
+        return Moments.fromSums(partial["count"], partial["avg_sum"], partial["avg_sumsq"])
+    return None
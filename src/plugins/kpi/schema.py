@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, List
 from pydantic import BaseModel, Field
 from pydantic_mongo import PydanticObjectId
 from typing import Optional
@@ -15,6 +15,8 @@ class Value(BaseModel):
 class Configuration(BaseModel):
     children: List[PydanticObjectId] = []
     formula: Optional[str]
+    # formula as a MongoDB expression over "$$values.<child id>"
+    expression: Optional[dict] = None
     # alarms: list[Alarm]
 
 class KPI(BaseModel):
@@ -27,6 +29,11 @@ class KPI(BaseModel):
     
 class ComputedValue(BaseModel):
     value: float = Field(...)
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    # mergeable summary of the bucket (Moments for std, TDigest for
+    # percentiles), only used to combine buckets, never serialized
+    state: Optional[Any] = Field(default=None, exclude=True)
     
     
 
@@ -59,6 +66,24 @@ class KPIResponse(BaseModel):
     data: Optional[KPIDetail | List[KPIOverview | ComputedValue]] = None
     message: Optional[str] = None
     
+class ComputeSpec(BaseModel):
+    kpi_id: str
+    machine_id: Optional[str] = None
+    site_id: Optional[int] = None
+    category: Optional[str] = None
+    start_date: str
+    end_date: str
+    granularity_op: str
+    granularity_days: Optional[int] = None
+    granularity_unit: Optional[str] = None
+    backend: Optional[str] = None
+
+class ComputeBatchResult(BaseModel):
+    index: int
+    success: bool
+    data: Optional[List[ComputedValue]] = None
+    message: Optional[str] = None
+    
 class KPIReport(BaseModel):
     name: str
     value: float
@@ -3,13 +3,101 @@ from fastapi import Request
 
 from src.plugins.kpi.schema import KPIOverview
 from . import repository
-from .schema import ComputedValue, RowReport, KPIReport
+from .schema import ComputedValue, RowReport, KPIReport, Value, ComputeSpec, ComputeBatchResult
 from src.plugins.site import repository as siteRepository
 from src.plugins.user import repository as userRepository
 from src.plugins.machine import repository as machineRepository
+from src.custom_exceptions import KPICycleException
+from .planner import graphWithNewKPI, topologicalOrder
+from .formula import formulaToExpression
+from .sketch import Moments, TDigest, pooledStd
+from src.core.cache import MemoryCacheBackend, create_cache_backend, register_cache
+from src.core.versions import bump_data_versions
+from src.core.invalidation import KPI_DATA, InvalidationEvent, invalidation_bus
+from src.core.tracing import instrument_module
+from datetime import datetime, timedelta
+from bson import ObjectId
+import asyncio
 from sympy import sympify
+import logging
 import math
+import os
 import numpy as np
+import pandas as pd
+from operator import attrgetter
+
+logger = logging.getLogger('uvicorn.error')
+
+# results of the compute endpoints, in process by default or in a shared
+# redis-compatible store when KPI_RESULT_CACHE_URL is set
+KPI_RESULT_CACHE_TTL = float(os.getenv("KPI_RESULT_CACHE_TTL", 60))
+KPI_RESULT_CACHE_HISTORICAL_TTL = float(os.getenv("KPI_RESULT_CACHE_HISTORICAL_TTL", 3600))
+result_cache = register_cache(create_cache_backend(
+    "kpi_results",
+    os.getenv("KPI_RESULT_CACHE_URL"),
+    maxsize=int(os.getenv("KPI_RESULT_CACHE_SIZE", 512)),
+    ttl=KPI_RESULT_CACHE_TTL
+))
+
+def resultKey(kpi_id, scope, start_date, end_date, granularity_days, granularity_op, granularity_unit, backend=None):
+    return ":".join(str(part) for part in [
+        kpi_id, scope, start_date.isoformat(), end_date.isoformat(), granularity_days, granularity_op, granularity_unit,
+        backend or repository.KPI_COMPUTE_BACKEND
+    ])
+
+def resultTTL(end_date):
+    # ranges closed for more than a day are not expected to receive new data
+    if end_date < datetime.now() - timedelta(days=1):
+        return KPI_RESULT_CACHE_HISTORICAL_TTL
+    return KPI_RESULT_CACHE_TTL
+
+async def getCachedResult(key):
+    try:
+        cached = await result_cache.get(key)
+    except Exception as e:
+        logger.error(f"Error reading kpi result cache: {e}")
+        return None
+    if cached is None:
+        return None
+    return [ComputedValue(**value) for value in cached]
+
+async def cacheResult(key, values, kpi_id, machines_ids, end_date):
+    '''
+    Store a computed series, tagged with the kpi and with each (kpi, machine)
+    pair it was computed from.
+    '''
+    tags = [str(kpi_id)] + [f"{kpi_id}:{machine_id}" for machine_id in machines_ids]
+    try:
+        await result_cache.set(
+            key,
+            [value.model_dump(mode="json") for value in values],
+            ttl=resultTTL(end_date),
+            tags=tags
+        )
+    except Exception as e:
+        logger.error(f"Error writing kpi result cache: {e}")
+
+async def invalidateResults(kpi_ids, machines_ids=None):
+    if machines_ids is None:
+        tags = [str(kpi_id) for kpi_id in kpi_ids]
+    else:
+        tags = [f"{kpi_id}:{machine_id}" for kpi_id in kpi_ids for machine_id in machines_ids]
+    try:
+        await result_cache.invalidate_tags(tags)
+    except Exception as e:
+        logger.error(f"Error invalidating kpi result cache: {e}")
+
+async def onResultsChange(event: InvalidationEvent):
+    # the data of a kpi (its ancestors get their own event) or its definition
+    # changed on another worker; a shared cache is already up to date
+    if not isinstance(result_cache, MemoryCacheBackend) or event.only_changes("data"):
+        return
+    if event.operation == "invalidate" or event.document_id is None:
+        await result_cache.clear()
+    elif event.collection == KPI_DATA or event.operation == "delete":
+        await invalidateResults([event.document_id])
+
+invalidation_bus.subscribe([KPI_DATA, "kpis"], onResultsChange)
 
 def checkValidOps(op):
     if op == 'sum':
@@ -22,45 +110,152 @@ def checkValidOps(op):
         return True
     if op == 'std':
         return True
+    if op in percentileOps:
+        return True
     return False
 
+def checkValidUnit(unit):
+    if unit is None:
+        return True
+    if unit == 'day':
+        return True
+    if unit == 'week':
+        return True
+    if unit == 'month':
+        return True
+    if unit == 'window':
+        return True
+    return False
+
+def checkValidBackend(backend):
+    if backend is None:
+        return True
+    return backend in repository.COMPUTE_BACKENDS
+
+percentileOps = {
+    'p50': 50,
+    'p90': 90,
+    'p99': 99,
+}
+
+def alignMachinesKpi(kpi_for_machines):
+    '''
+    Build the machines x buckets matrix of the series, aligned on the bucket
+    start (on the bucket index for sample index buckets), NaN where a machine
+    has no value. Returns the matrix, the start and end of each bucket, and
+    the row and column of each point of the series.
+    '''
+    lengths = np.fromiter((len(series) for series in kpi_for_machines), dtype=np.intp, count=len(kpi_for_machines))
+    rows = np.repeat(np.arange(len(kpi_for_machines)), lengths)
+    if lengths.sum() == 0:
+        return np.empty((len(kpi_for_machines), 0)), [], rows, rows
+    values = np.concatenate([
+        np.fromiter(map(attrgetter("value"), series), dtype=float, count=len(series))
+        for series in kpi_for_machines
+    ])
+    # all the series come from the same pipeline, either time or index buckets
+    first_point = next(series[0] for series in kpi_for_machines if len(series) > 0)
+    if first_point.start_date is not None:
+        # the machines usually share their buckets: a row equal to the previous
+        # one reuses its conversion
+        parts, previous, previous_starts = [], None, None
+        for series in kpi_for_machines:
+            row = list(map(attrgetter("start_date"), series))
+            if row != previous:
+                previous, previous_starts = row, pd.DatetimeIndex(row).asi8
+            parts.append(previous_starts)
+        starts = np.concatenate(parts)
+        # columns ordered by start, each bounded by its first point
+        _, first, columns = np.unique(starts, return_index=True, return_inverse=True)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        first_rows = np.searchsorted(offsets, first, side="right") - 1
+        first_points = [kpi_for_machines[row][index - offsets[row]] for row, index in zip(first_rows, first)]
+        bounds = [(point.start_date, point.end_date) for point in first_points]
+    else:
+        columns = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        bounds = [(None, None)] * int(lengths.max())
+    matrix = np.full((len(kpi_for_machines), len(bounds)), np.nan)
+    matrix[rows, columns] = values
+    return matrix, bounds, rows, columns
+
+def pooledMachinesStd(states, rows, columns, shape):
+    '''
+    Std of each bucket over the samples of all the machines, from the moments
+    of each (machine, bucket).
+    '''
+    counts, means, m2s = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+    counts[rows, columns] = [state.count for state in states]
+    means[rows, columns] = [state.mean for state in states]
+    m2s[rows, columns] = [state.m2 for state in states]
+    return pooledStd(counts, means, m2s)
+
+def pooledMachinesPercentile(states, columns, buckets, q):
+    '''
+    Percentile of each bucket over the samples of all the machines, from the
+    digests of each (machine, bucket).
+    '''
+    means, weights = [[] for _ in range(buckets)], [[] for _ in range(buckets)]
+    for column, state in zip(columns, states):
+        means[column].append(state.means)
+        weights[column].append(state.weights)
+    results = np.full(buckets, np.nan)
+    for column in range(buckets):
+        if means[column]:
+            digest = TDigest(np.concatenate(means[column]), np.concatenate(weights[column])).compress()
+            quantile = digest.quantile(q / 100)
+            results[column] = np.nan if quantile is None else quantile
+    return results
+
+def nanPercentile(matrix, q):
+    '''
+    Linear interpolation percentile of each column ignoring NaN, sorting the
+    whole matrix at once instead of column by column like np.nanpercentile.
+    '''
+    ordered = np.sort(matrix, axis=0)
+    counts = np.count_nonzero(~np.isnan(matrix), axis=0)
+    position = (counts - 1) * q / 100
+    lower = np.floor(position).astype(np.intp)
+    upper = np.ceil(position).astype(np.intp)
+    low = np.take_along_axis(ordered, lower[np.newaxis, :], axis=0)[0]
+    high = np.take_along_axis(ordered, upper[np.newaxis, :], axis=0)[0]
+    return low + (high - low) * (position - lower)
+
 def applyAggregationOpToMachinesKpi(op, kpi_for_machines):
-    if op == 'sum':
-        return [
-            {
-                "value": sum(d.value for d in elements)
-            }
-            for elements in zip(*kpi_for_machines)
-        ]
-    if op == 'avg':
-        return [
-            {
-                "value": sum(d.value for d in elements) / len(elements)
-            }
-            for elements in zip(*kpi_for_machines)
-        ]
-    if op == 'min':
-        return [
-            {
-                "value": min(d.value for d in elements)
-            }
-            for elements in zip(*kpi_for_machines)
-        ]
-    if op == 'max':
-        return [
-            {
-                "value": max(d.value for d in elements)
-            }
-            for elements in zip(*kpi_for_machines)
-        ]
-    if op == 'std':
-        return [
-            {
-                "value": float(np.std([d.value for d in elements]))
-            }
-            for elements in zip(*kpi_for_machines)
-        ]
-    raise Exception('Not valid op')
+    matrix, bounds, rows, columns = alignMachinesKpi(kpi_for_machines)
+    # buckets computed from raw data carry a mergeable state: the std and
+    # percentiles are then pooled over the samples instead of over machines
+    states = []
+    if op == 'std' or op in percentileOps:
+        states = [state for series in kpi_for_machines for state in map(attrgetter("state"), series)]
+    with np.errstate(all="ignore"):
+        if op == 'sum':
+            results = np.nansum(matrix, axis=0)
+        elif op == 'avg':
+            results = np.nanmean(matrix, axis=0)
+        elif op == 'min':
+            results = np.nanmin(matrix, axis=0)
+        elif op == 'max':
+            results = np.nanmax(matrix, axis=0)
+        elif op == 'std':
+            if len(states) > 0 and all(isinstance(state, Moments) for state in states):
+                results = pooledMachinesStd(states, rows, columns, matrix.shape)
+            else:
+                results = np.nanstd(matrix, axis=0)
+        elif op in percentileOps:
+            if len(states) > 0 and all(isinstance(state, TDigest) for state in states):
+                results = pooledMachinesPercentile(states, columns, len(bounds), percentileOps[op])
+            else:
+                results = nanPercentile(matrix, percentileOps[op])
+        else:
+            raise Exception('Not valid op')
+    return [
+        {
+            "value": float(value),
+            "start_date": start_date,
+            "end_date": end_date
+        }
+        for value, (start_date, end_date) in zip(results, bounds)
+    ]
 
 async def computeKPIForReport(
     request: Request,
@@ -71,6 +266,8 @@ async def computeKPIForReport(
     granularity_op,
     kpi_names: list[str] = [],
 ):
+    if not checkValidOps(granularity_op):
+        raise Exception('Not valid op')
     site = await siteRepository.getSiteByIdPopulatedKPI(site_id, request=request)
     result = RowReport(
         start_date=start_date,
@@ -78,17 +275,54 @@ async def computeKPIForReport(
         op=granularity_op,
         kpis=[]
     )
-    for kpi in site.kpis:
-        if kpi.name not in kpi_names:
-            continue
-        kpi_result = await computeKPIBySite(request, site_id, kpi.id, None, start_date, end_date, granularity_days, granularity_op)
-        if len(kpi_result) != 1: raise Exception("No kpi result found")
+    kpis = [kpi for kpi in site.kpis if kpi.name in kpi_names]
+
+    # reuse the cached site results, compute all the others together
+    keys = {
+        str(kpi.id): resultKey(kpi.id, f"site:{site_id}:None", start_date, end_date, granularity_days, granularity_op, None)
+        for kpi in kpis
+    }
+    values = {}
+    for kpi_id, key in keys.items():
+        cached = await getCachedResult(key)
+        if cached is not None:
+            values[kpi_id] = cached
+    missing = [kpi_id for kpi_id in keys if kpi_id not in values]
+    if missing:
+        res = await repository.computeKPIsByMachines(
+            missing,
+            site.machines_ids,
+            start_date,
+            end_date,
+            granularity_days,
+            granularity_op,
+            request=request,
+            with_state=True
+        )
+        for kpi_id in missing:
+            values[kpi_id] = aggregateSiteKPI(kpi_id, site.machines_ids, res[kpi_id], granularity_op)
+            if values[kpi_id] is not None:
+                await cacheResult(keys[kpi_id], values[kpi_id], kpi_id, site.machines_ids, end_date)
+
+    for kpi in kpis:
+        kpi_result = values[str(kpi.id)]
+        if kpi_result is None or len(kpi_result) != 1: raise Exception("No kpi result found")
         result.kpis.append(KPIReport(
             name = kpi.name,
             value = kpi_result[0].value,
         ))
     return result
 
+def aggregateSiteKPI(kpi_id, machines_ids, res, granularity_op):
+    '''
+    Combine the series of each machine of a site into the site series.
+    '''
+    if len(machines_ids) == 0: return None
+    kpi_for_machines = [res[str(machine_id)] for machine_id in machines_ids]
+    if all(len(series) == 0 for series in kpi_for_machines):
+        raise Exception('There are not data for this kpi: ', kpi_id)
+    return [ComputedValue(**result) for result in applyAggregationOpToMachinesKpi(granularity_op, kpi_for_machines)]
+
 async def computeKPIBySite(
     request: Request,
     site_id,
@@ -98,9 +332,19 @@ async def computeKPIBySite(
     end_date,
     granularity_days,
     granularity_op,
+    granularity_unit=None,
+    backend=None
 ):
     if not checkValidOps(granularity_op):
         raise Exception('Not valid op')
+    if not checkValidUnit(granularity_unit):
+        raise Exception('Not valid granularity unit')
+    if not checkValidBackend(backend):
+        raise Exception('Not valid compute backend')
+    key = resultKey(kpi_id, f"site:{site_id}:{category}", start_date, end_date, granularity_days, granularity_op, granularity_unit, backend)
+    cached = await getCachedResult(key)
+    if cached is not None:
+        return cached
     machines_ids = []
     if category:
         machines = await machineRepository.list_by_category(category, site_id, request)
@@ -108,22 +352,22 @@ async def computeKPIBySite(
     else:
         site = await siteRepository.getSiteByKpi(site_id, kpi_id, request)
         machines_ids = site.machines_ids
-    kpi_for_machines = []
-    for machine_id in machines_ids:
-        kpi_for_machines.append(
-            await computeKPIByMachine(
-                request,
-                machine_id,
-                kpi_id,
-                start_date,
-                end_date,
-                granularity_days,
-                granularity_op,
-            )
-        )
-    if len(kpi_for_machines) == 0: return None
-    results = applyAggregationOpToMachinesKpi(granularity_op, kpi_for_machines)
-    return [ComputedValue(**result) for result in results]
+    res = await repository.computeKPIByMachines(
+        machines_ids,
+        kpi_id,
+        start_date,
+        end_date,
+        granularity_days,
+        granularity_op,
+        request=request,
+        granularity_unit=granularity_unit,
+        backend=backend,
+        with_state=True
+    )
+    values = aggregateSiteKPI(kpi_id, machines_ids, res, granularity_op)
+    if values is None: return None
+    await cacheResult(key, values, kpi_id, machines_ids, end_date)
+    return values
 
 async def computeKPIByMachine(
     request: Request,
@@ -132,15 +376,127 @@ async def computeKPIByMachine(
     start_date,
     end_date,
     granularity_days,
-    granularity_op
+    granularity_op,
+    granularity_unit=None,
+    backend=None
 ):
     if not checkValidOps(granularity_op):
         raise Exception('Not valid op')
-    res = await repository.computeKPIByMachine(machine_id, kpi_id, start_date, end_date, granularity_days, granularity_op, request=request)
+    if not checkValidUnit(granularity_unit):
+        raise Exception('Not valid granularity unit')
+    if not checkValidBackend(backend):
+        raise Exception('Not valid compute backend')
+    key = resultKey(kpi_id, f"machine:{machine_id}", start_date, end_date, granularity_days, granularity_op, granularity_unit, backend)
+    cached = await getCachedResult(key)
+    if cached is not None:
+        return cached
+    res = await repository.computeKPIByMachine(machine_id, kpi_id, start_date, end_date, granularity_days, granularity_op, request=request, granularity_unit=granularity_unit, backend=backend)
     if len(res) == 0:
         raise Exception('There are not data for this kpi: ', kpi_id)
+    await cacheResult(key, res, kpi_id, [machine_id], end_date)
     return res
 
+async def computeKPIBatch(request: Request, specs: list[ComputeSpec]):
+    '''
+    Compute several kpis, yielding a ComputeBatchResult per spec as soon as it
+    is ready. Cached results come first; the other specs are grouped by range,
+    granularity and machines so that each group resolves its kpi graph once
+    and scans the data once.
+    '''
+    sites = {}
+    categories = {}
+    groups = {}
+    for index, spec in enumerate(specs):
+        try:
+            start_date = datetime.strptime(spec.start_date, "%Y-%m-%d %H:%M:%S")
+            end_date = datetime.strptime(spec.end_date, "%Y-%m-%d %H:%M:%S")
+            if not checkValidOps(spec.granularity_op):
+                raise Exception('Not valid op')
+            if not checkValidUnit(spec.granularity_unit):
+                raise Exception('Not valid granularity unit')
+            if not checkValidBackend(spec.backend):
+                raise Exception('Not valid compute backend')
+            if (spec.machine_id is None) == (spec.site_id is None):
+                raise Exception('Exactly one of machine_id and site_id is required')
+
+            if spec.machine_id is not None:
+                scope = f"machine:{spec.machine_id}"
+            else:
+                scope = f"site:{spec.site_id}:{spec.category}"
+            key = resultKey(spec.kpi_id, scope, start_date, end_date, spec.granularity_days, spec.granularity_op, spec.granularity_unit, spec.backend)
+            cached = await getCachedResult(key)
+            if cached is not None:
+                yield ComputeBatchResult(index=index, success=True, data=cached)
+                continue
+
+            shape = (start_date, end_date, spec.granularity_days, spec.granularity_op, spec.granularity_unit, spec.backend)
+            if spec.machine_id is not None:
+                # every machine spec of a shape is computed in the same pass
+                machines_ids = [spec.machine_id]
+                group = (shape, None)
+            else:
+                if spec.category:
+                    if (spec.site_id, spec.category) not in categories:
+                        machines = await machineRepository.list_by_category(spec.category, spec.site_id, request)
+                        categories[(spec.site_id, spec.category)] = [machine.id for machine in machines]
+                    machines_ids = categories[(spec.site_id, spec.category)]
+                else:
+                    if spec.site_id not in sites:
+                        sites[spec.site_id] = await siteRepository.getSite(spec.site_id, request=request)
+                    site = sites[spec.site_id]
+                    if ObjectId(spec.kpi_id) not in site.kpis_ids:
+                        raise Exception('KPI not associated to site: ', spec.kpi_id)
+                    machines_ids = site.machines_ids
+                group = (shape, tuple(sorted(str(machine_id) for machine_id in machines_ids)))
+            groups.setdefault(group, []).append((index, spec, machines_ids, key))
+        except Exception as e:
+            yield ComputeBatchResult(index=index, success=False, message=f"Error computing kpi: {e}")
+
+    for task in asyncio.as_completed([computeBatchGroup(request, shape, members) for (shape, _), members in groups.items()]):
+        for result in await task:
+            yield result
+
+async def computeBatchGroup(request: Request, shape, members):
+    start_date, end_date, granularity_days, granularity_op, granularity_unit, backend = shape
+    kpi_ids = list(dict.fromkeys(spec.kpi_id for _, spec, _, _ in members))
+    machines_ids = list(dict.fromkeys(str(machine_id) for _, _, ids, _ in members for machine_id in ids))
+    try:
+        res = await repository.computeKPIsByMachines(
+            kpi_ids,
+            machines_ids,
+            start_date,
+            end_date,
+            granularity_days,
+            granularity_op,
+            request=request,
+            granularity_unit=granularity_unit,
+            backend=backend,
+            # the states are only merged for the site specs
+            with_state=any(spec.site_id is not None for _, spec, _, _ in members)
+        )
+    except Exception as e:
+        if len(members) == 1:
+            return [ComputeBatchResult(index=members[0][0], success=False, message=f"Error computing kpi: {e}")]
+        # one failing kpi or machine must not fail the others
+        results = await asyncio.gather(*[computeBatchGroup(request, shape, [member]) for member in members])
+        return [result for group in results for result in group]
+
+    results = []
+    for index, spec, ids, key in members:
+        try:
+            if spec.machine_id is not None:
+                values = res[spec.kpi_id][str(spec.machine_id)]
+                if len(values) == 0:
+                    raise Exception('There are not data for this kpi: ', spec.kpi_id)
+            else:
+                values = aggregateSiteKPI(spec.kpi_id, ids, res[spec.kpi_id], granularity_op)
+            if values is not None:
+                await cacheResult(key, values, spec.kpi_id, ids, end_date)
+            results.append(ComputeBatchResult(index=index, success=True, data=values))
+        except Exception as e:
+            results.append(ComputeBatchResult(index=index, success=False, message=f"Error computing kpi: {e}"))
+    return results
+
 async def getKPIByName(request: Request, name: str):
     return await repository.getKPIByName(name, request=request)
 
@@ -161,6 +517,8 @@ async def createKPI(
 ):
     expr = sympify(formula)
     kpis_in_formula = {str(symbol) for symbol in expr.free_symbols}
+    if name in kpis_in_formula:
+        raise KPICycleException(f"KPI {name} cannot depend on itself")
     existing_kpis = await repository.listKPIsByName(list(kpis_in_formula), request=request)
 
     existing_kpi_names = set()
@@ -173,7 +531,20 @@ async def createKPI(
     if missing_kpis:
         print(f"The following KPIs are missing from the database: {missing_kpis}")
         raise ValueError("Missing KPIs")
-    kpi = await repository.createKPI(name, type, description, unite_of_measure, children, formula, request=request)
+
+    # reject the kpi if a dependency is referenced by its name, i.e. if its
+    # dependencies with the new node are cyclic
+    dependencies = await repository.getKPIGraph(children, request=request)
+    graph = { id: [str(child) for child in kpi.config.children] for id, kpi in dependencies.items() }
+    names = { id: kpi.name for id, kpi in dependencies.items() }
+    topologicalOrder(graphWithNewKPI(graph, names, name, [str(child) for child in children]))
+
+    # the formula as a database expression, when it can be translated
+    expression = None
+    if children:
+        expression = formulaToExpression(formula, { doc.name: f"$$values.{doc.id}" for doc in existing_kpis })
+
+    kpi = await repository.createKPI(name, type, description, unite_of_measure, children, formula, request=request, expression=expression)
     user = await userRepository.get_user_by_uid(uid, request=request)
     
     await siteRepository.associateKPItoSite(user.site, kpi.id, request=request)
@@ -183,7 +554,27 @@ async def deleteKPIByID(request: Request, id: str):
     await siteRepository.removeKPIfromSites(id, request=request)
     await machineRepository.removeKPIfromMachines(id, request=request)
     
-    return await repository.deleteKPIByID(id, request=request)
+    deleted = await repository.deleteKPIByID(id, request=request)
+    await invalidateResults([id])
+    return deleted
+
+async def addKPIData(request: Request, kpi_id: str, values: list[Value]):
+    kpi = await repository.getKPIById(kpi_id, request=request)
+    if kpi.config.formula is not None:
+        raise Exception('Data can only be added to atomic kpis')
+    inserted = await repository.insertKPIData(kpi_id, values, request=request)
+
+    # drop the cached results computed from this kpi on these machines,
+    # including the ones of the composite kpis depending on it
+    ancestors = await repository.getKPIAncestors(kpi_id, request=request)
+    machines_ids = {value.machine_id for value in values}
+    await invalidateResults([kpi_id, *ancestors], machines_ids)
+    await bump_data_versions([f"kpi:{id}" for id in [kpi_id, *ancestors]], request=request)
+    return inserted
 
 async def getKPIByName(request: Request, name: str):
-    return await repository.getKPIByName(name, request=request)
\ No newline at end of file
+    return await repository.getKPIByName(name, request=request)
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
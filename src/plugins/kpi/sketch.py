@@ -0,0 +1,151 @@
+"""
+Mergeable summaries of the values of a KPI bucket.
+
+Moments keeps count, mean and M2 (sum of squared deviations) so that the
+population std of several buckets, or of several machines, is obtained
+exactly by merging them (Chan et al. update of Welford's algorithm).
+
+TDigest keeps a bounded number of weighted centroids approximating the
+distribution of the values, so percentiles of merged buckets are obtained
+without the raw samples. Centroids are merged with the k1 scale function:
+small clusters near the tails, large ones around the median.
+"""
+import math
+from typing import List, Optional
+
+import numpy as np
+
+# quantiles requested to Mongo to seed the digest of a bucket, finer at the
+# upper tail where the percentiles of interest are: every one is computed by
+# $percentile for every bucket, a larger grid costs more than it gains
+SKETCH_QUANTILES = [0.0, 0.01, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 0.995, 0.999, 1.0]
+DIGEST_COMPRESSION = 100
+
+
+class Moments:
+    def __init__(self, count: float = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def fromValues(cls, values) -> "Moments":
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return cls()
+        mean = float(values.mean())
+        return cls(len(values), mean, float(((values - mean) ** 2).sum()))
+
+    @classmethod
+    def fromStd(cls, count: float, mean: Optional[float], std: Optional[float]) -> "Moments":
+        # what a $group gives: count, $avg and $stdDevPop
+        if not count:
+            return cls()
+        return cls(count, mean, (std or 0.0) ** 2 * count)
+
+    @classmethod
+    def fromSums(cls, count: float, total: float, squares: float) -> "Moments":
+        # what a rollup gives: count, sum and sum of squares
+        if not count:
+            return cls()
+        mean = total / count
+        return cls(count, mean, max(squares - count * mean * mean, 0.0))
+
+    def merge(self, other: "Moments") -> "Moments":
+        count = self.count + other.count
+        if count == 0:
+            return Moments()
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / count
+        return Moments(count, mean, m2)
+
+    def std(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return math.sqrt(self.m2 / self.count)
+
+
+def pooledStd(counts: np.ndarray, means: np.ndarray, m2s: np.ndarray, axis: int = 0) -> np.ndarray:
+    '''
+    Population std of the union of the groups described by the moments along
+    axis, NaN entries being missing groups.
+    '''
+    with np.errstate(all="ignore"):
+        total = np.nansum(counts, axis=axis)
+        mean = np.nansum(counts * means, axis=axis) / total
+        deviation = means - np.expand_dims(mean, axis)
+        m2 = np.nansum(m2s + counts * deviation * deviation, axis=axis)
+        return np.sqrt(m2 / total)
+
+
+class TDigest:
+    def __init__(self, means=(), weights=(), compression: int = DIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.asarray(means, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+
+    @classmethod
+    def fromValues(cls, values, compression: int = DIGEST_COMPRESSION) -> "TDigest":
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        return cls(values, np.ones(len(values)), compression).compress()
+
+    @classmethod
+    def fromQuantiles(cls, quantiles: List[float], count: float, probabilities: List[float] = SKETCH_QUANTILES, compression: int = DIGEST_COMPRESSION) -> "TDigest":
+        '''
+        Digest of count values known through their quantiles at the given
+        probabilities (0 and 1 included): the values between two consecutive
+        quantiles are represented by a centroid at their midpoint.
+        '''
+        if not count or not quantiles or any(quantile is None for quantile in quantiles):
+            return cls(compression=compression)
+        quantiles = np.asarray(quantiles, dtype=float)
+        probabilities = np.asarray(probabilities, dtype=float)
+        means = (quantiles[:-1] + quantiles[1:]) / 2
+        weights = np.diff(probabilities) * count
+        return cls(means, weights, compression).compress()
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        return TDigest(
+            np.concatenate([self.means, other.means]),
+            np.concatenate([self.weights, other.weights]),
+            self.compression
+        ).compress()
+
+    def compress(self) -> "TDigest":
+        if len(self.means) <= 1:
+            return self
+        order = np.argsort(self.means, kind="stable")
+        means, weights = self.means[order], self.weights[order]
+        total = weights.sum()
+
+        def scale(q):
+            return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+        merged_means, merged_weights = [means[0]], [weights[0]]
+        done = 0.0
+        limit = scale(0.0) + 1
+        for mean, weight in zip(means[1:], weights[1:]):
+            if scale((done + merged_weights[-1] + weight) / total) <= limit:
+                merged_weights[-1] += weight
+                merged_means[-1] += (mean - merged_means[-1]) * weight / merged_weights[-1]
+            else:
+                done += merged_weights[-1]
+                limit = scale(done / total) + 1
+                merged_means.append(mean)
+                merged_weights.append(weight)
+        return TDigest(merged_means, merged_weights, self.compression)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.means) == 0:
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.weights.sum(), centers, self.means))
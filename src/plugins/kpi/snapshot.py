@@ -0,0 +1,259 @@
+"""
+Local Parquet snapshot of the KPI data points, and the compute backend that
+answers atomic KPI queries from it without touching Mongo.
+
+The snapshot lives under KPI_SNAPSHOT_DIR, partitioned by kpi and month:
+
+    <KPI_SNAPSHOT_DIR>/kpi_id=<id>/month=<YYYY-MM>/part.parquet
+
+with one row per data point (datetime in UTC, machine_id as a hex string,
+sum, avg, min, max). A query only opens the months of its range and the
+buckets are computed with vectorized pandas group-bys, following the same
+rules as the aggregation pipelines of the repository.
+
+The snapshot is as fresh as its last refresh (scripts/refresh_kpi_snapshot.py):
+data points added afterwards are only seen by the Mongo backend.
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .rollup import toUTC
+from .schema import ComputedValue
+from .sketch import Moments, TDigest
+
+KPI_SNAPSHOT_DIR = os.getenv("KPI_SNAPSHOT_DIR", "data/kpi_snapshot")
+MANIFEST = "_snapshot.json"
+SNAPSHOT_COLUMNS = ["datetime", "machine_id", "sum", "avg", "min", "max"]
+
+# same operations as mappingOp in the repository: field read and reduction
+SNAPSHOT_OPS = {
+    'avg': ('avg', 'mean'),
+    'sum': ('sum', 'sum'),
+    'min': ('min', 'min'),
+    'max': ('max', 'max'),
+    'std': ('avg', 'std'),
+    'p50': ('avg', 0.5),
+    'p90': ('avg', 0.9),
+    'p99': ('avg', 0.99),
+}
+
+# $dateTrunc counts bins of several units from 2000-01-01
+REFERENCE_DATE = np.datetime64("2000-01-01", "D")
+# first Sunday on or before the reference, weeks start on Sunday
+REFERENCE_WEEK = np.datetime64("1999-12-26", "D")
+
+
+def kpiDirectory(kpi_id: str, directory: str | None = None) -> str:
+    return os.path.join(directory or KPI_SNAPSHOT_DIR, f"kpi_id={kpi_id}")
+
+
+def monthPartition(date: datetime) -> str:
+    return f"month={date.year:04d}-{date.month:02d}"
+
+
+def beginSnapshot(kpi_id: str, directory: str | None = None) -> str:
+    '''
+    Empty staging directory where the partitions of a new snapshot of the kpi
+    are written before commitSnapshot swaps it in.
+    '''
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("the pyarrow package is required to write kpi snapshots") from e
+    staging = f"{kpiDirectory(kpi_id, directory)}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    return staging
+
+
+def writePartitions(staging: str, frame: pd.DataFrame) -> int:
+    '''
+    Write the data points of frame (columns SNAPSHOT_COLUMNS) to the month
+    partitions of the staging directory. Returns the number of points written.
+    '''
+    frame = frame.reindex(columns=SNAPSHOT_COLUMNS)
+    frame["datetime"] = pd.to_datetime(frame["datetime"]).astype("datetime64[ms]")
+    frame["machine_id"] = frame["machine_id"].astype(str)
+    for column in ["sum", "avg", "min", "max"]:
+        frame[column] = frame[column].astype(float)
+    frame = frame.dropna(subset=["datetime"]).sort_values(["datetime"], kind="stable")
+
+    months = frame["datetime"].dt.strftime("month=%Y-%m")
+    for month, part in frame.groupby(months, sort=True):
+        os.makedirs(os.path.join(staging, month))
+        part.to_parquet(os.path.join(staging, month, "part.parquet"), index=False)
+    return len(frame)
+
+
+def commitSnapshot(kpi_id: str, staging: str, rows: int, directory: str | None = None):
+    '''
+    Replace the snapshot of a kpi with the staging directory, so readers never
+    see a half written kpi.
+    '''
+    with open(os.path.join(staging, MANIFEST), "w") as manifest:
+        json.dump({
+            "kpi_id": str(kpi_id),
+            "rows": rows,
+            "refreshed_at": datetime.now(timezone.utc).isoformat()
+        }, manifest)
+
+    target = kpiDirectory(kpi_id, directory)
+    previous = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.rename(target, previous)
+    os.rename(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def abortSnapshot(staging: str):
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def writeSnapshot(kpi_id: str, frame: pd.DataFrame, directory: str | None = None) -> int:
+    '''
+    Replace the snapshot of a kpi with the data points of frame (columns
+    SNAPSHOT_COLUMNS).
+    '''
+    staging = beginSnapshot(kpi_id, directory)
+    try:
+        rows = writePartitions(staging, frame)
+        commitSnapshot(kpi_id, staging, rows, directory)
+    except Exception:
+        abortSnapshot(staging)
+        raise
+    return rows
+
+
+def readSnapshot(kpi_id: str, machines_ids, start_date, end_date, directory: str | None = None) -> pd.DataFrame:
+    '''
+    Data points of a kpi for the given machines in [start_date, end_date],
+    reading only the month partitions of the range.
+    '''
+    target = kpiDirectory(kpi_id, directory)
+    if not os.path.exists(os.path.join(target, MANIFEST)):
+        raise Exception(f"No snapshot for kpi {kpi_id}, run scripts/refresh_kpi_snapshot.py")
+    start_date, end_date = toUTC(start_date), toUTC(end_date)
+    first, last = monthPartition(start_date), monthPartition(end_date)
+    files = [
+        os.path.join(target, month, "part.parquet")
+        for month in sorted(os.listdir(target))
+        if month.startswith("month=") and first <= month <= last
+    ]
+    if len(files) == 0:
+        return pd.DataFrame({column: pd.Series(dtype=float) for column in SNAPSHOT_COLUMNS})
+    filters = [("datetime", ">=", pd.Timestamp(start_date)), ("datetime", "<=", pd.Timestamp(end_date))]
+    if machines_ids is not None:
+        filters.append(("machine_id", "in", [str(machine_id) for machine_id in machines_ids]))
+    return pd.concat([pd.read_parquet(file, filters=filters) for file in files], ignore_index=True)
+
+
+def bucketBounds(dates: np.ndarray, start_date, granularity_days, granularity_unit):
+    '''
+    Start and end of the bucket of each date, as bucketStartExpression and
+    bucketEndExpression compute them in the pipelines.
+    '''
+    size = granularity_days or 1
+    dates = dates.astype("datetime64[ms]")
+    if granularity_unit == 'window':
+        origin = np.datetime64(toUTC(start_date), "ms")
+        window = np.timedelta64(size, "D").astype("timedelta64[ms]")
+        starts = origin + (dates - origin) // window * window
+        return starts, starts + window
+    days = dates.astype("datetime64[D]")
+    if granularity_unit == 'day':
+        starts = REFERENCE_DATE + (days - REFERENCE_DATE).astype(int) // size * size
+        return starts.astype("datetime64[ms]"), (starts + size).astype("datetime64[ms]")
+    if granularity_unit == 'week':
+        starts = REFERENCE_WEEK + (days - REFERENCE_WEEK).astype(int) // (7 * size) * (7 * size)
+        return starts.astype("datetime64[ms]"), (starts + 7 * size).astype("datetime64[ms]")
+    if granularity_unit == 'month':
+        months = dates.astype("datetime64[M]")
+        reference = REFERENCE_DATE.astype("datetime64[M]")
+        starts = reference + (months - reference).astype(int) // size * size
+        return starts.astype("datetime64[ms]"), (starts + size).astype("datetime64[ms]")
+    raise Exception('Not valid granularity unit')
+
+
+def percentileRank(values: pd.Series, keys: List[str], frame: pd.DataFrame, p: float) -> pd.Series:
+    # value of rank ceil(p * n) of each bucket, like $percentile
+    ordered = frame.assign(value=values).dropna(subset=["value"]).sort_values(keys + ["value"], kind="stable")
+    grouped = ordered.groupby(keys, sort=False)
+    position = grouped.cumcount()
+    count = grouped["value"].transform("size")
+    rank = np.maximum(np.ceil(p * count), 1) - 1
+    return ordered[position == rank].set_index(keys)["value"]
+
+
+def computeSnapshotKPIs(
+    machines_ids,
+    kpi_ids,
+    start_date,
+    end_date,
+    granularity_days,
+    granularity_op,
+    granularity_unit: str | None = None,
+    directory: str | None = None
+) -> Dict[str, Dict[str, List[ComputedValue]]]:
+    '''
+    Same as computeAtomicKPIsByMachines, from the snapshot. Buckets without
+    any value for the operation are left out.
+    '''
+    field, reduction = SNAPSHOT_OPS[granularity_op]
+    results = {
+        str(kpi_id): { str(machine_id): [] for machine_id in machines_ids }
+        for kpi_id in kpi_ids
+    }
+    for kpi_id in kpi_ids:
+        frame = readSnapshot(str(kpi_id), machines_ids, start_date, end_date, directory)
+        if len(frame) == 0:
+            continue
+        frame = frame.sort_values(["machine_id", "datetime"], kind="stable").reset_index(drop=True)
+        if granularity_unit is None:
+            frame["bucket"] = frame.groupby("machine_id").cumcount() // (granularity_days or 1)
+        else:
+            starts, ends = bucketBounds(frame["datetime"].to_numpy(), start_date, granularity_days, granularity_unit)
+            frame["bucket"], frame["end"] = starts, ends
+        keys = ["machine_id", "bucket"]
+        grouped = frame.groupby(keys, sort=True)[field]
+
+        if isinstance(reduction, float):
+            values = percentileRank(frame[field], keys, frame, reduction)
+        elif reduction == 'std':
+            values = grouped.std(ddof=0)
+        elif reduction == 'sum':
+            # $sum of missing values is 0, the other accumulators give null
+            values = grouped.sum(min_count=0)
+        else:
+            values = grouped.agg(reduction)
+        values = values.dropna().sort_index()
+
+        states = {}
+        if reduction == 'std':
+            counts, means = grouped.count(), grouped.mean()
+            for key, std in values.items():
+                states[key] = Moments.fromStd(int(counts[key]), float(means[key]), float(std))
+        elif isinstance(reduction, float):
+            for key, points in grouped:
+                states[key] = TDigest.fromValues(points.to_numpy())
+
+        ends = frame.groupby(keys, sort=True)["end"].first() if granularity_unit is not None else None
+        series = results[str(kpi_id)]
+        for (machine_id, bucket), value in values.items():
+            if granularity_unit is None:
+                start, end = None, None
+            else:
+                start = pd.Timestamp(bucket).to_pydatetime()
+                end = pd.Timestamp(ends[(machine_id, bucket)]).to_pydatetime()
+            series[machine_id].append(ComputedValue(
+                value=float(value),
+                start_date=start,
+                end_date=end,
+                state=states.get((machine_id, bucket))
+            ))
+    return results
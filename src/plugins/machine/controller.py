@@ -1,10 +1,11 @@
 """Machine controller. This module defines the API routes for the Machine plugin."""
-from fastapi import APIRouter, HTTPException, Depends, Query, Path, Security
+from fastapi import APIRouter, HTTPException, Depends, Query, Path, Security, Response
 from fastapi.requests import Request
 
 
 from src.plugins.auth.firebase import verify_firebase_token_and_role, verify_firebase_token
 from src.plugins.machine import repository
+from src.core.versions import data_version_etag, is_not_modified, not_modified_response, set_etag
 from .schema import MachineOverview, MachineDetail, MachineResponse
 
 import os
@@ -17,15 +18,19 @@ router = APIRouter(prefix=f"/api/{API_VERSION}/machine", tags=["Machine"])
 
 # list all machines
 @router.get("/",status_code=200, response_model=MachineResponse, summary="Get all machines in the dataset")
-async def get_all_machines(request:Request, user=Depends(verify_firebase_token)):
+async def get_all_machines(request:Request, response: Response, user=Depends(verify_firebase_token)):
     """
     Get all machines in the dataset
 
     Returns:
-    - MachineResponse: A response object containing the list of machines
+    - MachineResponse: A response object containing the list of machines, with an ETag (304 Not Modified when it matches If-None-Match)
     """
     try:
+        etag = await data_version_etag(request, ["machines"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
         machines = await repository.get_all(request)
+        set_etag(response, etag)
 
         return MachineResponse(success=True, data=machines, message="Machines listed successfully")
     except Exception as e:
@@ -60,7 +65,7 @@ async def filter_machines(request: Request, machine_name: str = None, machine_ty
 
 # get machine by ID
 @router.get("/{machine_id}", response_model=MachineResponse, status_code=200, summary="Get machine by ID")
-async def get_machine_by_id(request: Request, machine_id: str, user=Depends(verify_firebase_token)):
+async def get_machine_by_id(request: Request, response: Response, machine_id: str, user=Depends(verify_firebase_token)):
     """
     Get machine by ID
 
@@ -68,11 +73,14 @@ async def get_machine_by_id(request: Request, machine_id: str, user=Depends(veri
     - machine_id: The ID of the machine to retrieve
 
     Returns:
-    - MachineResponse: A response object containing the machine
+    - MachineResponse: A response object containing the machine, with an ETag (304 Not Modified when it matches If-None-Match)
     """
     try:
-
+        etag = await data_version_etag(request, ["machines", "kpis"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
         machine = await repository.get_by_id(machine_id, request=request)
+        set_etag(response, etag)
 
         return MachineResponse(success=True, data=machine, message="Machine retrieved successfully")
     except Exception as e:
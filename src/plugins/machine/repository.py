@@ -8,9 +8,21 @@ sys.path.append(os.path.abspath("."))
 from .schema import MachineOverview, MachineDetail
 from src.utils import get_collection
 from src.custom_exceptions import MachineNotFoundException
+from src.core.versions import DATA_VERSIONS_COLLECTION, bump_data_versions
 
 from fastapi import Request
+from pymongo import ASCENDING, IndexModel
 from pymongo.collection import Collection
+from src.core.indexes import register_indexes, register_query_shape
+from src.core.tracing import instrument_module
+
+register_indexes("machines", [
+    IndexModel([("category", ASCENDING)]),
+    IndexModel([("name", ASCENDING), ("category", ASCENDING)])
+])
+register_query_shape("machine.get_by_type", "machines", filter={ "category": "" })
+register_query_shape("machine.get_by_name", "machines", filter={ "name": "", "category": "" })
+register_query_shape("machine.list_by_category", "sites", pipeline=[{ "$match": { "site_id": 0 } }])
 
 # list all machines
 async def get_all(request: Request | None = None, machines_collection: Collection[MachineDetail] = None):
@@ -117,5 +129,11 @@ async def get_by_name(machine_name: str, machine_type: Optional[str] = None, req
 async def removeKPIfromMachines(_id: ObjectId, request: Request | None = None, machines_collection: Collection[MachineDetail] = None):
     machines_collection = get_collection(request, machines_collection, "machines")
     result = await machines_collection.update_many({}, { "$pull": { "kpis_ids": _id } })
+    if result.modified_count > 0:
+        await bump_data_versions(["machines"], versions_collection=machines_collection.database[DATA_VERSIONS_COLLECTION])
 
     return result.modified_count
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
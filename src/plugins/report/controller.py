@@ -2,12 +2,15 @@ from datetime import datetime
 import io
 from typing import Annotated, Optional, List
 from click import style
-from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from fpdf import FPDF
 from sympy import Union, content
 
 from src.plugins.auth.firebase import verify_firebase_token_and_role, verify_firebase_token
 from src.plugins.user.schema import User
+from src.core.versions import data_version_etag, is_not_modified, not_modified_response, set_etag
+from src.core.metrics import time_llm_call
+from src.core.tracing import span
 
 from .schema import CreateReportBody, Report, ReportResponse
 from . import repository as repo
@@ -26,9 +29,31 @@ dotenv.load_dotenv()
 
 API_VERSION = os.getenv("VERSION")
 debug_mode = os.getenv("DEBUG")
+# 'local' writes the report PDFs to REPORT_STORAGE_DIR instead of Firebase storage
+REPORT_STORAGE = os.getenv("REPORT_STORAGE", "firebase")
+REPORT_STORAGE_DIR = os.getenv("REPORT_STORAGE_DIR", "data/report_storage")
 
 router = APIRouter(prefix=f"/api/{API_VERSION}/report", tags=["Report"])
 
+
+def upload_report_pdf(name: str, pdf_output: io.BytesIO) -> str:
+    """
+    Store the report PDF and return its URL: a public Firebase storage URL, or
+    a file:// URL in REPORT_STORAGE_DIR when REPORT_STORAGE is 'local'
+    """
+    if REPORT_STORAGE == "local":
+        path = os.path.abspath(os.path.join(REPORT_STORAGE_DIR, "report", f"{name}.pdf"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(pdf_output.read())
+        return f"file://{path}"
+    with span("firebase.storage.upload", "client", blob=f"report/{name}.pdf"):
+        bucket = storage.bucket()
+        blob = bucket.blob(f"report/{name}.pdf")
+        blob.upload_from_file(pdf_output, content_type="application/pdf")
+        blob.make_public()
+        return blob.public_url
+
 prompt = """
 You are a Generative AI Assistant for Industry Analysis, acting as a Retrieval-Augmented Generation (RAG) model. Your task is to:
 Analyze structured JSON input files containing industrial data and extract key insights.
@@ -104,14 +129,16 @@ async def create_report(request: Request, item:CreateReportBody, user: User = De
     try:
         kb = await kpi_service.computeKPIForReport(request, item.site, start_date_obj, end_date_obj, None, item.operation, kpi_names=item.kpi_names)
         client = OpenAI()
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "system", "content": f"Consider that you have the following Knowledge Base: {kb}"},
-                {"role": "user", "content": f"The report must be in {item.language} language"},
-            ]
-        )
+        with time_llm_call("report", "gpt-3.5-turbo") as call, span("openai.chat.completions", "client", model="gpt-3.5-turbo"):
+            completion = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": prompt},
+                    {"role": "system", "content": f"Consider that you have the following Knowledge Base: {kb}"},
+                    {"role": "user", "content": f"The report must be in {item.language} language"},
+                ]
+            )
+            call.record(completion)
         report_content = completion.choices[0].message.content
     except Exception as e:
         return ReportResponse(success=False, data=None, message=f"Error generating report: {e}")
@@ -150,7 +177,8 @@ async def create_report(request: Request, item:CreateReportBody, user: User = De
 
         # Convert HTML to PDF using WeasyPrint
         pdf_output = io.BytesIO()
-        HTML(string=html_content).write_pdf(pdf_output, stylesheets=[CSS(string=css)])
+        with span("weasyprint.write_pdf"):
+            HTML(string=html_content).write_pdf(pdf_output, stylesheets=[CSS(string=css)])
         pdf_output.seek(0)  # Reset buffer position
 
     except Exception as e:
@@ -167,11 +195,7 @@ async def create_report(request: Request, item:CreateReportBody, user: User = De
             return ReportResponse(success=False, data=None, message="Error saving PDF locally")
     # 5. save pdf on firebase storage
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(f"report/{item.name}.pdf")
-        blob.upload_from_file(pdf_output, content_type="application/pdf")
-        blob.make_public()
-        pdf_url = blob.public_url
+        pdf_url = upload_report_pdf(item.name, pdf_output)
     except Exception as e:
         return ReportResponse(success=False, data=None, message="Error saving PDF to Firebase Storage")
 
@@ -185,7 +209,7 @@ async def create_report(request: Request, item:CreateReportBody, user: User = De
 
 # get all reports from all sites
 @router.get("/", status_code=200, response_model=ReportResponse, summary="Get all reports created by the user")
-async def get_all_reports(request: Request, user: User = Depends(verify_firebase_token)):
+async def get_all_reports(request: Request, response: Response, user: User = Depends(verify_firebase_token)):
     """
     Get all reports created by the user
 
@@ -193,10 +217,14 @@ async def get_all_reports(request: Request, user: User = Depends(verify_firebase
     - user: the user creating the report
 
     Returns:
-    - List of reports created by the user
+    - List of reports created by the user, with an ETag (304 Not Modified when it matches If-None-Match)
     """
     try:
+        etag = await data_version_etag(request, ["reports", "sites"], vary=[user.uid])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
         reports = await repo.reports_by_user_uid(request, user.uid)
+        set_etag(response, etag)
         return ReportResponse(success=True, data=reports, message="Reports retrieved successfully")
     except Exception as e:
         return ReportResponse(success=False, data=None, message=str(e))
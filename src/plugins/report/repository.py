@@ -8,6 +8,19 @@ from fastapi import Request
 from src.plugins.report.schema import Report, ReportOverview, ReportDetail
 from src.custom_exceptions import ReportNotFoundException
 from src.utils import get_collection
+from src.core.versions import bump_data_versions
+from src.core.indexes import register_indexes, register_query_shape
+from src.core.tracing import instrument_module
+from pymongo import ASCENDING, IndexModel
+
+register_indexes("reports", [
+    IndexModel([("user_uid", ASCENDING), ("name", ASCENDING)]),
+    IndexModel([("name", ASCENDING)]),
+    IndexModel([("sites_id", ASCENDING), ("user_uid", ASCENDING)])
+])
+register_query_shape("report.reports_by_user_uid", "reports", pipeline=[{"$match": {"user_uid": ""}}])
+register_query_shape("report.report_by_name", "reports", filter={"name": "", "user_uid": ""})
+register_query_shape("report.reports_by_site_id", "reports", filter={"sites_id": 0, "user_uid": ""})
 
 
 
@@ -114,6 +127,7 @@ async def create_report(request: Request, name: str, site: int, kpi_names: list[
         report_obj = Report(name=name, sites_id=[site], kpi_names=kpi_names, start_date=start_date_obj, end_date=end_date_obj, user_uid=user_uid, url=pdf_url)
 
         result = await report_collection.insert_one(report_obj.model_dump())
+        await bump_data_versions(["reports"], request=request)
 
         # Get the inserted document
         created_report = await report_collection.find_one({"_id": result.inserted_id})
@@ -140,7 +154,12 @@ async def delete_report(request: Request, report_id: str, user_uid: str):
 
         if result.deleted_count == 0:
             raise ReportNotFoundException(f"Report with id {report_id} not found")
+        await bump_data_versions(["reports"], request=request)
 
         return f"Report with id {report_id} deleted successfully"
     except Exception as e:
-        raise e
\ No newline at end of file
+        raise e
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
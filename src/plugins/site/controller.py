@@ -7,8 +7,9 @@ from datetime import datetime
 from .schema import (
         SiteResponse
     )
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, Response
 from src.plugins.auth.firebase import verify_firebase_token
+from src.core.versions import data_version_etag, is_not_modified, not_modified_response, set_etag
 
 
 logger = logger = logging.getLogger('uvicorn.error')
@@ -20,6 +21,7 @@ router = APIRouter(prefix=f"/api/{API_VERSION}/site", tags=["Site"])
 @router.get("/{id}", status_code=200, response_model=SiteResponse, summary="Get site by id")
 async def getSiteById(
     request: Request,
+    response: Response,
     id: int,
     user=Depends(verify_firebase_token)
 ):
@@ -30,11 +32,15 @@ async def getSiteById(
     - id: int: site id
 
     Returns:
-    - SiteResponse: site response object with the site content
+    - SiteResponse: site response object with the site content, with an ETag (304 Not Modified when it matches If-None-Match)
     """
     try:
+        etag = await data_version_etag(request, ["sites", f"site:{id}", "kpis"])
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
         site = await service.getSiteById(request, id)
         if site:
+            set_etag(response, etag)
             return SiteResponse(success=True, data=site)
         return SiteResponse(success=False, message=f"Site with id {id} not found")
     except Exception as e:
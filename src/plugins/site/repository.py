@@ -1,8 +1,35 @@
 from .schema import Site, SiteOverviewWithKPIs, SiteOverviewCreate
 from bson import ObjectId
 from fastapi import Request
+from pymongo import ASCENDING, IndexModel, UpdateOne
 from pymongo.collection import Collection
 from src.utils import get_collection
+from src.core.cache import LRUCache, register_cache
+from src.core.versions import DATA_VERSIONS_COLLECTION, bump_data_versions
+from src.core.invalidation import InvalidationEvent, invalidation_bus
+from src.core.indexes import register_indexes, register_query_shape
+from src.core.tracing import instrument_module
+import os
+
+register_indexes("sites", [
+    IndexModel([("site_id", ASCENDING)]),
+    IndexModel([("kpis_ids", ASCENDING)])
+])
+register_query_shape("site.getSite", "sites", filter={ "site_id": 0 })
+register_query_shape("site.getSiteByKpi", "sites", filter={ "site_id": 0, "kpis_ids": { "$in": [ObjectId()] } })
+register_query_shape("site.removeKPIfromSites", "sites", filter={ "kpis_ids": ObjectId() })
+
+# overview of the kpis of each site, materialized in the kpis_catalog field of
+# the site document and kept in process, keyed by site id
+CATALOG_FIELDS = ["name", "type", "description", "unite_of_measure"]
+catalog_cache = register_cache(LRUCache(
+    "site_kpi_catalogs",
+    maxsize=int(os.getenv("KPI_CATALOG_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("KPI_CATALOG_CACHE_TTL", 30))
+))
+# site id of the cached catalogs keyed by the _id of their site document, the
+# only key of the site in the change stream events
+catalog_sites = {}
 
 async def getSiteByKpi(
     site_id: int,
@@ -19,6 +46,16 @@ async def getSiteByKpi(
     })
     return Site(**site)
 
+async def getSite(
+    site_id: int,
+    request: Request | None = None,
+    sites_collection: Collection[Site] | None = None
+) -> Site:
+    sites_collection = get_collection(request, sites_collection, "sites")
+    site = await sites_collection.find_one({ "site_id": site_id })
+    if site is None: raise Exception("Site not found")
+    return Site(**site)
+
 async def getSiteById(
     site_id: int,
     request: Request | None = None,
@@ -102,6 +139,8 @@ async def associateKPItoSite(
             { "$push": { "kpis_ids": ObjectId(kpi_id) } }
         )
         if result.matched_count > 0 and result.modified_count > 0:
+            await refreshKPICatalogs([site_id], sites_collection=sites_collection)
+            await bump_data_versions([f"site:{site_id}"], versions_collection=sites_collection.database[DATA_VERSIONS_COLLECTION])
             site = await getSiteById(site_id, request)
     return site
 
@@ -111,9 +150,99 @@ async def removeKPIfromSites(
     sites_collection: Collection[Site] | None = None
 ):
     sites_collection = get_collection(request, sites_collection, "sites")
-    result = await sites_collection.update_one({},{ "$pull": {"kpis_ids": ObjectId(kpi_id)}})
+    sites_ids = await sites_collection.distinct("site_id", { "kpis_ids": ObjectId(kpi_id) })
+    result = await sites_collection.update_many({ "kpis_ids": ObjectId(kpi_id) }, { "$pull": {"kpis_ids": ObjectId(kpi_id)}})
     if result.matched_count > 0 and result.modified_count > 0:
+        await refreshKPICatalogs(sites_ids, sites_collection=sites_collection)
+        await bump_data_versions(["sites"], versions_collection=sites_collection.database[DATA_VERSIONS_COLLECTION])
         print("Element removed successfully.")
     else:
         print("No matching document found.")
-    
\ No newline at end of file
+
+async def refreshKPICatalogs(
+    sites_ids=None,
+    request: Request | None = None,
+    sites_collection: Collection[Site] | None = None
+):
+    '''
+    Rebuild the kpis_catalog of the given sites (all of them when None) from
+    their kpis_ids, and drop them from the in-process cache.
+    Returns the catalogs keyed by site id.
+    '''
+    sites_collection = get_collection(request, sites_collection, "sites")
+    match = {} if sites_ids is None else { "site_id": { "$in": list(sites_ids) } }
+    cursor = sites_collection.aggregate([
+        {
+            "$match": match
+        },
+        {
+            "$lookup": {
+                "from": "kpis",
+                "localField": "kpis_ids",
+                "foreignField": "_id",
+                "as": "kpis"
+            }
+        },
+        {
+            "$project": {
+                "site_id": 1,
+                **{ f"kpis.{field}": 1 for field in ["_id", *CATALOG_FIELDS] }
+            }
+        }
+    ])
+    catalogs = {}
+    async for site in cursor:
+        catalogs[site["site_id"]] = [
+            { "_id": kpi["_id"], **{ field: kpi.get(field) for field in CATALOG_FIELDS } }
+            for kpi in site["kpis"]
+        ]
+    if catalogs:
+        await sites_collection.bulk_write(
+            [UpdateOne({ "site_id": site_id }, { "$set": { "kpis_catalog": catalog } }) for site_id, catalog in catalogs.items()],
+            ordered=False
+        )
+    for site_id in (catalogs if sites_ids is None else sites_ids):
+        catalog_cache.invalidate(site_id)
+    return catalogs
+
+async def getKPICatalog(
+    site_id: int,
+    request: Request | None = None,
+    sites_collection: Collection[Site] | None = None
+) -> list:
+    '''
+    Overview of the kpis of a site: from memory, else from the kpis_catalog of
+    the site document, built on the first read of a site that has none.
+    '''
+    catalog = catalog_cache.get(site_id)
+    if catalog is not None:
+        return catalog
+    sites_collection = get_collection(request, sites_collection, "sites")
+    site = await sites_collection.find_one({ "site_id": site_id }, { "kpis_catalog": 1 })
+    if site is None:
+        return []
+    catalog = site.get("kpis_catalog")
+    if catalog is None:
+        catalog = (await refreshKPICatalogs([site_id], sites_collection=sites_collection)).get(site_id, [])
+    catalog_cache.set(site_id, catalog)
+    catalog_sites[site["_id"]] = site_id
+    return catalog
+
+def onCatalogChange(event: InvalidationEvent):
+    # a site changed by another worker, or a kpi whose overview may be listed
+    if event.only_changes("data"):
+        return
+    if event.collection == "sites" and event.document_id is not None:
+        # site id when polling the "site:<id>" scopes, _id with change streams;
+        # an unknown _id is a site whose catalog is not cached here
+        site_id = event.document_id if isinstance(event.document_id, int) else catalog_sites.get(event.document_id)
+        if site_id is not None:
+            catalog_cache.invalidate(site_id)
+        return
+    catalog_cache.clear()
+
+invalidation_bus.subscribe(["sites", "kpis"], onCatalogChange)
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
@@ -1,8 +1,13 @@
 from fastapi import Request
 from . import repository
+from src.core.tracing import instrument_module
 
 async def associateKPItoSite(request: Request, site_id, kpi_id):
     return await repository.associateKPItoSite(site_id, kpi_id, request)
 
 async def getSiteById(request: Request, site_id):
-    return await repository.getSiteById(site_id, request)
\ No newline at end of file
+    return await repository.getSiteById(site_id, request)
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
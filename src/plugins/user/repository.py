@@ -5,6 +5,19 @@ from datetime import datetime, timezone
 from src.plugins.user.schema import User
 from src.utils import create_user_collection, get_collection
 from src.custom_exceptions import  UserNotFoundException
+from src.core.indexes import register_indexes, register_query_shape
+from src.core.tracing import instrument_module
+from pymongo import ASCENDING, IndexModel
+
+# same indexes as create_user_collection
+register_indexes("users", [
+    IndexModel([("uid", ASCENDING)], unique=True),
+    IndexModel([("email", ASCENDING)], unique=True),
+    IndexModel([("last_name", ASCENDING), ("first_name", ASCENDING)])
+])
+register_query_shape("user.get_user_by_uid", "users", filter={"uid": ""})
+register_query_shape("user.get_user_by_email", "users", filter={"email": ""})
+register_query_shape("user.get_user_by_name", "users", filter={"first_name": "", "last_name": ""})
 
 #To create these users:
 # user_collection = await create_user_collection(request)
@@ -92,4 +105,7 @@ async def get_all_users(request: Request | None = None, user_collection: Collect
     if users is None:
         raise UserNotFoundException("No users found")
     return [User(**user) async for user in users]
-    
\ No newline at end of file
+
+
+# spans for the coroutines of the module (see src.core.tracing)
+instrument_module(__name__)
@@ -39,3 +39,28 @@ def test_mongodb_list_all_data():
     assert response.headers['content-type'].startswith('text/html')
     
 
+
+
+def test_cache_health_check():
+    response = requests.get(
+        f"{BASE_URL}health/cache",
+    )
+    json_response = response.json()
+
+    assert response.status_code == 200
+    assert "kpi_definitions" in json_response
+    assert {"hits", "misses", "size"} <= json_response["kpi_definitions"].keys()
+
+
+def test_metrics():
+    requests.get(f"{BASE_URL}health/cache")
+
+    response = requests.get(
+        f"{BASE_URL}metrics",
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'route="/health/cache"' in response.text
+    assert "cache_hits_total" in response.text
+    assert "event_loop_lag_seconds" in response.text
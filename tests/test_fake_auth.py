@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials
+
+sys.path.append(os.path.abspath("."))
+pytest.importorskip("firebase_admin")
+from src.plugins.auth import firebase
+
+FAKE_TOKEN = HTTPAuthorizationCredentials(scheme="Bearer", credentials="fake:admin:FFM")
+
+
+def verify(host="127.0.0.1", role=None):
+    request = Request({"type": "http", "headers": [], "client": (host, 50000)})
+    if role is None:
+        return firebase.verify_firebase_token(request, FAKE_TOKEN).uid
+    return firebase.verify_firebase_token_and_role(role)(request, FAKE_TOKEN)["uid"]
+
+
+@pytest.fixture
+def auth_mode(monkeypatch):
+    def set(mode, allow):
+        monkeypatch.setattr(firebase, "AUTH_MODE", mode)
+        monkeypatch.setattr(firebase, "ALLOW_FAKE_AUTH", allow)
+    return set
+
+
+@pytest.mark.parametrize("role", [None, "FFM"])
+def test_fake_tokens_are_rejected_without_auth_mode(role):
+    assert os.getenv("AUTH_MODE") is None
+    assert firebase.AUTH_MODE == "firebase"
+    with pytest.raises(HTTPException) as error:
+        verify(role=role)
+    assert error.value.status_code == 401
+
+
+def test_fake_mode_needs_the_opt_in(auth_mode):
+    auth_mode("fake", False)
+    with pytest.raises(RuntimeError):
+        firebase.check_auth_mode()
+    with pytest.raises(HTTPException):
+        verify()
+
+
+@pytest.mark.parametrize("role", [None, "FFM"])
+def test_fake_tokens_only_from_loopback_clients(auth_mode, role):
+    auth_mode("fake", True)
+    firebase.check_auth_mode()
+    assert verify(role=role) == "admin"
+    assert verify("::1", role) == "admin"
+    with pytest.raises(HTTPException):
+        verify("10.0.0.7", role)
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.append(os.path.abspath("."))
+from src.core.invalidation import InvalidationBus, KPI_DATA
+from src.core.versions import bump_data_versions
+
+# a single-node replica set, e.g.
+#   mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0 && mongosh --port 27018 --eval "rs.initiate()"
+#   MONGODB_REPLICA_URL=mongodb://127.0.0.1:27018/?replicaSet=rs0
+MONGODB_REPLICA_URL = os.getenv("MONGODB_REPLICA_URL")
+
+pytestmark = pytest.mark.skipif(MONGODB_REPLICA_URL is None, reason="MONGODB_REPLICA_URL not set")
+
+
+async def collect_events(mode, write):
+    client = AsyncIOMotorClient(MONGODB_REPLICA_URL)
+    db = client[f"test_invalidation_{ObjectId()}"]
+    bus = InvalidationBus(mode=mode, poll_interval=0.1)
+    events = []
+    bus.subscribe(["kpis", "sites", KPI_DATA], events.append)
+    try:
+        await bus.start(db)
+        await asyncio.sleep(1)
+        await write(db)
+        for _ in range(50):
+            if events:
+                break
+            await asyncio.sleep(0.1)
+        return bus.source, events
+    finally:
+        await bus.stop()
+        await client.drop_database(db.name)
+        client.close()
+
+
+def test_change_stream_events():
+    kpi_id = ObjectId()
+
+    async def write(db):
+        await db["kpis"].insert_one({"_id": kpi_id, "name": "test_invalidation", "config": {"children": [], "formula": None}})
+        await db["kpis"].update_one({"_id": kpi_id}, {"$push": {"data": {"sum": 1.0}}})
+
+    source, events = asyncio.run(collect_events("stream", write))
+    assert source == "stream"
+    assert events[0].collection == "kpis"
+    assert events[0].operation == "insert"
+    assert events[0].document_id == kpi_id
+
+
+def test_polling_events():
+    kpi_id = str(ObjectId())
+
+    async def write(db):
+        await bump_data_versions([f"kpi:{kpi_id}"], versions_collection=db["data_versions"])
+
+    source, events = asyncio.run(collect_events("poll", write))
+    assert source == "poll"
+    assert events[0].collection == KPI_DATA
+    assert events[0].document_id == kpi_id
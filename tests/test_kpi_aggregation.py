@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+sys.path.append(os.path.abspath("."))
+from src.plugins.kpi import repository
+from src.plugins.kpi.schema import ComputedValue, Value
+from src.plugins.kpi.service import applyAggregationOpToMachinesKpi
+
+# a MongoDB server (5.0 or later) for the index buckets, see test_kpi_composite.py
+MONGODB_TEST_URL = os.getenv("MONGODB_TEST_URL")
+START = datetime(2024, 1, 1)
+
+
+def hourly_series(machines, buckets):
+    """Series of each machine missing about 1% of the buckets, at random."""
+    rng = np.random.default_rng(0)
+    series = []
+    for _ in range(machines):
+        kept = np.flatnonzero(rng.random(buckets) > 0.01)
+        series.append([
+            ComputedValue(value=value, start_date=START + timedelta(hours=int(hour)), end_date=START + timedelta(hours=int(hour) + 1))
+            for hour, value in zip(kept, rng.uniform(0, 100, len(kept)))
+        ])
+    return series
+
+
+@pytest.fixture(scope="module")
+def site_series():
+    """100 machines x 10k buckets, the size of a site aggregation to keep fast, and their pivot."""
+    series = hourly_series(100, 10000)
+    frame = pd.DataFrame(
+        [(machine, point.start_date, point.value) for machine, points in enumerate(series) for point in points],
+        columns=["machine", "start_date", "value"]
+    )
+    return series, frame.pivot(index="start_date", columns="machine", values="value")
+
+
+@pytest.mark.parametrize("op,reference", [
+    ("sum", lambda pivot: pivot.sum(axis=1)),
+    ("avg", lambda pivot: pivot.mean(axis=1)),
+    ("min", lambda pivot: pivot.min(axis=1)),
+    ("max", lambda pivot: pivot.max(axis=1)),
+    ("p90", lambda pivot: pivot.quantile(0.9, axis=1)),
+])
+def test_site_aggregation_aligns_on_bucket_start(site_series, op, reference):
+    series, pivot = site_series
+    expected = reference(pivot)
+
+    result = applyAggregationOpToMachinesKpi(op, series)
+    assert [bucket["start_date"] for bucket in result] == list(expected.index)
+    assert [bucket["end_date"] for bucket in result] == [start + timedelta(hours=1) for start in expected.index]
+    assert np.allclose([bucket["value"] for bucket in result], expected.to_numpy())
+
+
+def test_site_aggregation_of_index_buckets():
+    series = [
+        [ComputedValue(value=value, start_date=None, end_date=None) for value in values]
+        for values in [[1.0, 2.0, 3.0], [10.0], []]
+    ]
+    assert [bucket["value"] for bucket in applyAggregationOpToMachinesKpi("sum", series)] == [11.0, 2.0, 3.0]
+    assert applyAggregationOpToMachinesKpi("sum", [[], []]) == []
+
+
+def test_index_bucket_pipeline_does_not_push_the_points():
+    pipeline = repository.indexedPipeline([str(ObjectId())], [str(ObjectId())], START, START, 3, "sum")
+    assert "$push" not in str(pipeline)
+    # the bucket of a point is its position within its kpi and machine
+    group = [stage["$group"] for stage in pipeline if "$group" in stage]
+    assert len(group) == 1
+    assert set(group[0]["_id"]) == {"kpi_id", "machine_id", "index"}
+
+
+@pytest.mark.skipif(MONGODB_TEST_URL is None, reason="MONGODB_TEST_URL not set")
+def test_index_buckets_follow_the_datetime_order():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    machines = [str(ObjectId()), str(ObjectId())]
+
+    async def run():
+        client = AsyncIOMotorClient(MONGODB_TEST_URL)
+        db = client[f"test_kpi_aggregation_{ObjectId()}"]
+        try:
+            kpi = await repository.createKPI("index_buckets_test", "atomic", "", "", [], None, kpis_collection=db["kpis"])
+            # inserted newest first, the second machine has one point less
+            await repository.insertKPIData(str(kpi.id), [
+                Value(datetime=START + timedelta(days=day), machine_id=machine, avg=day, min=day, max=day, sum=day)
+                for day in reversed(range(10))
+                for index, machine in enumerate(machines)
+                if day < 10 - index
+            ], kpis_collection=db["kpis"])
+            return await repository.computeKPIByMachines(
+                machines, str(kpi.id), START, START + timedelta(days=10), 3, "sum",
+                kpis_collection=db["kpis"], backend="mongo"
+            )
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    computed = asyncio.run(run())
+    assert [point.value for point in computed[machines[0]]] == [3, 12, 21, 9]
+    assert [point.value for point in computed[machines[1]]] == [3, 12, 21]
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+sys.path.append(os.path.abspath("."))
+from src.plugins.kpi import repository
+from src.plugins.kpi.formula import formulaToExpression
+from src.plugins.kpi.schema import ComputedValue, Configuration, KPIDetail, Value
+
+# a MongoDB server (5.0 or later) for the buckets, which mongomock cannot compute, e.g.
+#   MONGODB_TEST_URL=mongodb://127.0.0.1:27017
+MONGODB_TEST_URL = os.getenv("MONGODB_TEST_URL")
+START = datetime(2024, 1, 1)
+
+
+def daily(values):
+    return [
+        ComputedValue(value=value, start_date=START + timedelta(days=day), end_date=START + timedelta(days=day + 1))
+        for day, value in values.items()
+    ]
+
+
+def test_fallback_pairs_buckets_by_start_date():
+    a, b, c = ObjectId(), ObjectId(), ObjectId()
+    kpis = {
+        str(a): KPIDetail(_id=a, name="a", type="atomic", description="", unite_of_measure="", config=Configuration(children=[], formula=None)),
+        str(b): KPIDetail(_id=b, name="b", type="atomic", description="", unite_of_measure="", config=Configuration(children=[], formula=None)),
+        str(c): KPIDetail(_id=c, name="c", type="composite", description="", unite_of_measure="", config=Configuration(children=[str(a), str(b)], formula="a/b")),
+    }
+    computed = {
+        # a misses day 1, b misses day 3
+        str(a): {"m": daily({0: 2.0, 2: 6.0, 3: 8.0, 4: 10.0})},
+        str(b): {"m": daily({0: 1.0, 1: 2.0, 2: 3.0, 4: 5.0})},
+    }
+    result = repository.evaluateCompositeKPI(kpis[str(c)], kpis, computed, ["m"], "day")
+    assert [(point.start_date, point.value) for point in result["m"]] == [
+        (START, 2.0),
+        (START + timedelta(days=2), 2.0),
+        (START + timedelta(days=4), 2.0),
+    ]
+
+
+async def seedComposite(db):
+    """A composite a/b of two atomic kpis with gaps on different days, on two machines."""
+    kpis_collection = db["kpis"]
+    machines = [str(ObjectId()), str(ObjectId())]
+    a = await repository.createKPI("composite_test_a", "atomic", "", "", [], None, kpis_collection=kpis_collection)
+    b = await repository.createKPI("composite_test_b", "atomic", "", "", [], None, kpis_collection=kpis_collection)
+    for kpi, missing in [(a, {3, 11}), (b, {6})]:
+        await repository.insertKPIData(str(kpi.id), [
+            Value(datetime=START + timedelta(days=day), machine_id=machine, avg=day + index + 1, min=day, max=day + 2, sum=(day + 1) * (index + 1))
+            for index, machine in enumerate(machines)
+            for day in range(20)
+            if day not in missing
+        ], kpis_collection=kpis_collection)
+    expression = formulaToExpression("composite_test_a/composite_test_b", {
+        "composite_test_a": f"$$values.{a.id}",
+        "composite_test_b": f"$$values.{b.id}",
+    })
+    c = await repository.createKPI("composite_test_c", "composite", "", "", [str(a.id), str(b.id)], "composite_test_a/composite_test_b", kpis_collection=kpis_collection, expression=expression)
+    return machines, str(c.id)
+
+
+async def computeBothPaths(db, machines, kpi_id, granularity_days, granularity_op, granularity_unit):
+    results = []
+    for pushdown in [True, False]:
+        repository.KPI_COMPOSITE_PUSHDOWN = pushdown
+        try:
+            computed = await repository.computeKPIsByMachines(
+                [kpi_id], machines, START, START + timedelta(days=20), granularity_days, granularity_op,
+                kpis_collection=db["kpis"], granularity_unit=granularity_unit
+            )
+        finally:
+            repository.KPI_COMPOSITE_PUSHDOWN = True
+        results.append({
+            machine: [(point.start_date, pytest.approx(point.value)) for point in series]
+            for machine, series in computed[kpi_id].items()
+        })
+    return results
+
+
+@pytest.mark.skipif(MONGODB_TEST_URL is None, reason="MONGODB_TEST_URL not set")
+@pytest.mark.parametrize("granularity_days,granularity_op,granularity_unit", [(1, "sum", "day"), (1, "avg", "week"), (4, "max", "window"), (3, "sum", None)])
+def test_pushdown_and_fallback_agree(granularity_days, granularity_op, granularity_unit):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        client = AsyncIOMotorClient(MONGODB_TEST_URL)
+        db = client[f"test_kpi_composite_{ObjectId()}"]
+        try:
+            machines, kpi_id = await seedComposite(db)
+            return await computeBothPaths(db, machines, kpi_id, granularity_days, granularity_op, granularity_unit)
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    pushed, fallback = asyncio.run(run())
+    assert pushed == fallback
+    # the days missing from a child are dropped, not shifted
+    if granularity_unit == "day":
+        assert all(len(series) == 17 for series in pushed.values())
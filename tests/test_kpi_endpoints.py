@@ -2,6 +2,7 @@ import pytest
 import os
 import logging
 import requests
+import json
 
 from datetime import datetime
 from fastapi.testclient import TestClient
@@ -70,6 +71,25 @@ def test_create_kpi(auth_headers):
         headers=auth_headers
     )
 
+def test_create_kpi_self_dependency(auth_headers):
+    sample_kpi = {
+        "name": "test_cyclic_kpi",
+        "type": "composite",
+        "description": "Test KPI depending on itself",
+        "unite_of_measure": "units",
+        "formula": "test_cyclic_kpi + consumption",
+    }
+
+    response = requests.post(
+        f"{BASE_URL}{API_VERSION}kpi/",
+        headers=auth_headers,
+        json=sample_kpi
+    )
+    assert response.status_code == 200
+    json_response = response.json()
+    assert json_response["success"] == False
+    assert "cannot depend on itself" in json_response["message"]
+
 def test_get_kpi_by_id(auth_headers):
     # First create a KPI
     sample_kpi = {
@@ -147,6 +167,49 @@ def test_compute_kpi_composite(auth_headers):
     assert data[0]["value"] == 3.640436235059484e-06
     assert data[1]["value"] == 1.9069123253897118e-06
 
+def test_compute_kpi_atomic_window(auth_headers):
+    machine_id = "6740f1cfa8e3f95f42703128"
+    params = {
+        "kpi_id": "673a6ad2d9e0b151b88cbed0",
+        "start_date": "2024-09-30 00:00:00",
+        "end_date": "2024-10-07 00:00:00",
+        "granularity_days": 7,
+        "granularity_op": "sum",
+        "granularity_unit": "window"
+    }
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/machine/{machine_id}/compute",
+        headers=auth_headers,
+        params=params
+    )
+    data = response.json()['data']
+    assert response.status_code == 200
+    assert isinstance(data, list)
+    assert len(data) == 2
+    assert data[0]["start_date"] == "2024-09-30T00:00:00"
+    assert data[0]["end_date"] == "2024-10-07T00:00:00"
+    assert data[1]["start_date"] == "2024-10-07T00:00:00"
+
+def test_compute_kpi_invalid_granularity_unit(auth_headers):
+    machine_id = "6740f1cfa8e3f95f42703128"
+    params = {
+        "kpi_id": "673a6ad2d9e0b151b88cbed0",
+        "start_date": "2024-09-30 00:00:00",
+        "end_date": "2024-10-07 00:00:00",
+        "granularity_days": 7,
+        "granularity_op": "sum",
+        "granularity_unit": "fortnight"
+    }
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/machine/{machine_id}/compute",
+        headers=auth_headers,
+        params=params
+    )
+    assert response.status_code == 200
+    assert response.json()["success"] == False
+
 def test_invalid_kpi_id(auth_headers):
     machine_id = "test_machine"
     params = {
@@ -269,4 +332,126 @@ def test_compute_kpi_invalid_machine_id(auth_headers):
     assert response.status_code == 200
     json_response = response.json()
     assert json_response["success"] == False
-    assert "Error computing kpi" in json_response["message"]
\ No newline at end of file
+    assert "Error computing kpi" in json_response["message"]
+
+
+def test_add_kpi_data_invalid_kpi(auth_headers):
+    kpi_id = str(ObjectId())
+    values = [{
+        "sum": 1.0,
+        "avg": 1.0,
+        "min": 1.0,
+        "max": 1.0,
+        "datetime": "2024-01-01T00:00:00",
+        "machine_id": "673a6ad2d9e0b151b88cbed0"
+    }]
+
+    response = requests.post(
+        f"{BASE_URL}{API_VERSION}kpi/{kpi_id}/data",
+        headers=auth_headers,
+        json=values
+    )
+
+    assert response.status_code == 200
+    json_response = response.json()
+    assert json_response["success"] == False
+    assert "Error adding kpi data" in json_response["message"]
+
+def test_compute_kpi_batch(auth_headers):
+    spec = {
+        "kpi_id": "673a6ad2d9e0b151b88cbed0",
+        "start_date": "2024-01-01 00:00:00",
+        "end_date": "2024-01-07 00:00:00",
+        "granularity_days": 7,
+        "granularity_op": "sum"
+    }
+    specs = [
+        {**spec, "site_id": 1},
+        {**spec, "granularity_op": "invalid_op", "site_id": 1},
+        spec
+    ]
+
+    response = requests.post(
+        f"{BASE_URL}{API_VERSION}kpi/compute/batch",
+        headers=auth_headers,
+        json=specs
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {line["index"]: line for line in map(json.loads, response.text.splitlines())}
+    assert sorted(results) == [0, 1, 2]
+    assert results[1]["success"] == False
+    assert results[2]["success"] == False
+
+def test_compute_kpi_by_machine_columnar(auth_headers):
+    machine_id = "6740f1cfa8e3f95f42703128"
+    params = {
+        "kpi_id": "673a6ad2d9e0b151b88cbed0",
+        "start_date": "2024-01-01 00:00:00",
+        "end_date": "2024-01-07 00:00:00",
+        "granularity_days": 7,
+        "granularity_op": "sum"
+    }
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/machine/{machine_id}/compute",
+        headers={**auth_headers, "Accept": "application/vnd.kpi.columnar+json"},
+        params=params
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/vnd.kpi.columnar+json")
+    json_response = response.json()
+    assert json_response["success"] == True
+    data = json_response["data"]
+    assert len(data["timestamps"]) == len(data["end_timestamps"]) == len(data["values"])
+
+def test_compute_kpi_invalid_backend(auth_headers):
+    machine_id = "6740f1cfa8e3f95f42703128"
+    params = {
+        "kpi_id": "673a6ad2d9e0b151b88cbed0",
+        "start_date": "2024-09-30 00:00:00",
+        "end_date": "2024-10-07 00:00:00",
+        "granularity_days": 7,
+        "granularity_op": "sum",
+        "backend": "duckdb"
+    }
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/machine/{machine_id}/compute",
+        headers=auth_headers,
+        params=params
+    )
+    assert response.status_code == 200
+    assert response.json()["success"] == False
+
+def test_get_kpi_by_id_not_modified(auth_headers):
+    kpi_id = "673a6ad2d9e0b151b88cbed0"
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/{kpi_id}",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/{kpi_id}",
+        headers={**auth_headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+def test_get_kpi_by_id_server_timing(auth_headers):
+    kpi_id = "673a6ad2d9e0b151b88cbed0"
+
+    response = requests.get(
+        f"{BASE_URL}{API_VERSION}kpi/{kpi_id}",
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    server_timing = response.headers["server-timing"]
+    assert server_timing.startswith("db;dur=")
+    assert "db-find;" in server_timing
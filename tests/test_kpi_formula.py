@@ -0,0 +1,67 @@
+import asyncio
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+from sympy import Symbol, sympify
+
+sys.path.append(os.path.abspath("."))
+from src.plugins.kpi.formula import CompiledFormula, formulaToExpression
+
+A = np.array([0.0, 1.0, -2.0, 3.5, 0.0, 4.0])
+B = np.array([0.0, 2.0, 0.5, 0.0, -1.0, 4.0])
+
+
+def sympyValue(formula, a, b):
+    # sympy gives zoo for x/0 and nan for 0/0, the compiled formula gives 0
+    value = complex(sympify(formula).subs({Symbol("a"): a, Symbol("b"): b}, simultaneous=True).evalf())
+    if value.imag != 0 or not math.isfinite(value.real):
+        return 0.0
+    return value.real
+
+
+@pytest.mark.parametrize("formula", ["a + b", "a * b - 2", "a / b", "(a + b) / (a - b)", "Abs(a) / b + 1", "Max(a, b) / Min(a, b)"])
+def test_compiled_formula_matches_sympy(formula):
+    compiled = CompiledFormula(formula)
+    result = compiled.evaluate({"a": A, "b": B}, len(A))
+    assert result.tolist() == pytest.approx([sympyValue(formula, a, b) for a, b in zip(A, B)])
+
+
+def test_division_by_zero_and_nan_give_zero():
+    compiled = CompiledFormula("a / b")
+    result = compiled.evaluate({"a": np.array([1.0, 0.0, np.nan]), "b": np.array([0.0, 0.0, 1.0])}, 3)
+    assert result.tolist() == [0.0, 0.0, 0.0]
+
+
+def test_constant_formula_is_broadcast():
+    assert CompiledFormula("2 * 3").evaluate({}, 4).tolist() == [6.0] * 4
+
+
+def test_division_expression_is_guarded():
+    expression = formulaToExpression("a / b", {"a": "$a", "b": "$b"})
+    division = expression["$let"]["vars"]["value"]["$let"]["in"]["$switch"]
+    assert {"case": {"$ne": ["$$d", 0]}, "then": {"$divide": ["$$n", "$$d"]}} in division["branches"]
+    assert division["default"] is None
+
+
+def test_unsupported_formula_has_no_expression():
+    assert formulaToExpression("sin(a)", {"a": "$a"}) is None
+    assert formulaToExpression("a / c", {"a": "$a"}) is None
+
+
+@pytest.mark.parametrize("formula", [
+    "a / b", "1 / (a + b)", "-a / b", "Max(a / b, 3)", "Min(a / b, -3) + 1", "Max(sqrt(a), b)", "Max(a, b) / Min(a, b)", "log(a) + b"
+])
+def test_expression_matches_compiled_formula(formula):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    compiled = CompiledFormula(formula).evaluate({"a": A, "b": B}, len(A))
+    expression = formulaToExpression(formula, {"a": "$a", "b": "$b"})
+
+    async def run():
+        collection = mongomock_motor.AsyncMongoMockClient()["test_kpi_formula"]["values"]
+        await collection.insert_many([{"i": i, "a": a, "b": b} for i, (a, b) in enumerate(zip(A.tolist(), B.tolist()))])
+        return await collection.aggregate([{"$sort": {"i": 1}}, {"$project": {"value": expression}}]).to_list(None)
+
+    assert [row["value"] for row in asyncio.run(run())] == pytest.approx(compiled.tolist())
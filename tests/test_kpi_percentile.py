@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+sys.path.append(os.path.abspath("."))
+from src.custom_exceptions import KPIOperationNotSupportedException
+from src.plugins.kpi import repository
+
+START = datetime(2024, 1, 1)
+
+
+class Database:
+    """The part of a Motor database read by checkOperationSupported."""
+    def __init__(self, version):
+        self.client = object()
+        self.version = version
+        self.commands = 0
+
+    async def command(self, name):
+        self.commands += 1
+        return {"version": ".".join(map(str, self.version)), "versionArray": [*self.version, 0, 0]}
+
+
+@pytest.mark.parametrize("op", ["p50", "p90", "p99"])
+def test_percentiles_are_refused_before_mongodb_7(op):
+    with pytest.raises(KPIOperationNotSupportedException, match="MongoDB 7.0"):
+        asyncio.run(repository.checkOperationSupported(op, Database((6, 0))))
+
+
+def test_percentiles_run_on_mongodb_7_and_version_is_read_once():
+    db = Database((7, 0))
+    for op in ["p50", "p90", "avg"]:
+        asyncio.run(repository.checkOperationSupported(op, db))
+    assert db.commands == 1
+
+
+def test_other_operations_do_not_read_the_version():
+    db = Database((5, 0))
+    for op in ["avg", "sum", "min", "max", "std"]:
+        asyncio.run(repository.checkOperationSupported(op, db))
+    assert db.commands == 0
+
+
+@pytest.mark.parametrize("with_state", [False, True])
+def test_bucket_states_only_when_requested(with_state):
+    for pipeline in [
+        repository.bucketedPipeline([str(ObjectId())], [], START, START, 1, "p90", "day", with_state),
+        repository.indexedPipeline([str(ObjectId())], [], START, START, 1, "p90", with_state),
+    ]:
+        group = [stage["$group"] for stage in pipeline if "$group" in stage][-1]
+        project = pipeline[-1]["$project"]
+        assert ("quantiles" in group) == with_state
+        assert ("quantiles" in project) == with_state
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath("."))
+from src.custom_exceptions import KPICycleException
+from src.plugins.kpi.planner import NEW_KPI, graphWithNewKPI, topologicalOrder
+
+# x = a + b, y = x * 2
+GRAPH = {"x": ["a", "b"], "y": ["x"], "a": [], "b": []}
+NAMES = {"x": "x", "y": "y", "a": "a", "b": "b"}
+
+
+def test_new_kpi_comes_after_its_dependencies():
+    order = topologicalOrder(graphWithNewKPI(GRAPH, NAMES, "z", ["y", "a"]))
+    assert order[-1] == NEW_KPI
+    assert order.index("x") < order.index("y")
+
+
+def test_new_kpi_named_after_a_dependency_is_a_cycle():
+    # a = y, where y depends on a through x
+    with pytest.raises(KPICycleException):
+        topologicalOrder(graphWithNewKPI(GRAPH, NAMES, "a", ["y"]))
+
+
+def test_topological_order_raises_on_a_cycle():
+    with pytest.raises(KPICycleException):
+        topologicalOrder({"a": ["b"], "b": ["c"], "c": ["a"]})
+
+
+def test_topological_order_lists_children_first():
+    order = topologicalOrder(GRAPH)
+    assert order.index("a") < order.index("x") < order.index("y")
+    assert order.index("b") < order.index("x")
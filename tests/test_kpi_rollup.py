@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath("."))
+from src.plugins.kpi.rollup import emptyPartial, finalizePartial, mergePartial, partialState, pointPartial
+
+RNG = np.random.default_rng(7)
+POINTS = [
+    {"avg": float(avg), "sum": float(avg) * 10, "min": float(avg) - 1, "max": float(avg) + 1}
+    for avg in RNG.normal(50, 12, 200)
+]
+# points without an avg count for sum/min/max only
+POINTS[3]["avg"] = None
+POINTS[150]["avg"] = None
+
+
+def rolledUp(points, parts):
+    # partials of the parts of a bucket (e.g. its days), merged as the rollup does
+    partials = []
+    for chunk in np.array_split(np.arange(len(points)), parts):
+        partial = emptyPartial()
+        for index in chunk:
+            mergePartial(partial, pointPartial(points[index]))
+        partials.append(partial)
+    total = emptyPartial()
+    for partial in partials:
+        mergePartial(total, partial)
+    return total
+
+
+@pytest.mark.parametrize("parts", [1, 7])
+def test_partials_match_the_raw_accumulators(parts):
+    partial = rolledUp(POINTS, parts)
+    avgs = np.array([point["avg"] for point in POINTS if point["avg"] is not None])
+    assert finalizePartial(partial, "sum") == pytest.approx(sum(point["sum"] for point in POINTS))
+    assert finalizePartial(partial, "min") == min(point["min"] for point in POINTS)
+    assert finalizePartial(partial, "max") == max(point["max"] for point in POINTS)
+    assert finalizePartial(partial, "avg") == pytest.approx(avgs.mean())
+    assert finalizePartial(partial, "std") == pytest.approx(np.std(avgs))
+    assert partialState(partial, "std").std() == pytest.approx(np.std(avgs))
+
+
+def test_bucket_without_values_has_no_value():
+    partial = rolledUp([{"avg": None, "sum": None, "min": None, "max": None}], 1)
+    assert finalizePartial(partial, "avg") is None
+    assert finalizePartial(partial, "std") is None
+    assert finalizePartial(partial, "min") is None
+    assert finalizePartial(partial, "max") is None
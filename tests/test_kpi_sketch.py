@@ -0,0 +1,59 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath("."))
+from src.plugins.kpi.sketch import SKETCH_QUANTILES, Moments, TDigest, pooledStd
+
+RNG = np.random.default_rng(11)
+GROUPS = [RNG.normal(mean, std, size) for mean, std, size in [(10, 2, 50), (40, 5, 3), (-3, 0.5, 200), (12, 8, 1)]]
+
+
+def test_merged_moments_match_np_std():
+    merged = Moments()
+    for group in GROUPS:
+        merged = merged.merge(Moments.fromValues(group))
+    samples = np.concatenate(GROUPS)
+    assert merged.count == len(samples)
+    assert merged.mean == pytest.approx(samples.mean())
+    assert merged.std() == pytest.approx(np.std(samples))
+
+
+def test_moments_from_group_accumulators_match_np_std():
+    # $avg/$stdDevPop of the buckets, and count/sum/sum of squares of the rollups
+    merged = Moments()
+    for index, group in enumerate(GROUPS):
+        if index % 2:
+            moments = Moments.fromStd(len(group), group.mean(), np.std(group))
+        else:
+            moments = Moments.fromSums(len(group), group.sum(), (group ** 2).sum())
+        merged = merged.merge(moments)
+    assert merged.std() == pytest.approx(np.std(np.concatenate(GROUPS)))
+
+
+def test_pooled_std_matches_np_std():
+    moments = [Moments.fromValues(group) for group in GROUPS]
+    counts = np.array([[m.count for m in moments], [m.count for m in moments[:2]] + [np.nan, np.nan]])
+    means = np.array([[m.mean for m in moments], [m.mean for m in moments[:2]] + [np.nan, np.nan]])
+    m2s = np.array([[m.m2 for m in moments], [m.m2 for m in moments[:2]] + [np.nan, np.nan]])
+    result = pooledStd(counts, means, m2s, axis=1)
+    assert result[0] == pytest.approx(np.std(np.concatenate(GROUPS)))
+    # missing groups are left out
+    assert result[1] == pytest.approx(np.std(np.concatenate(GROUPS[:2])))
+
+
+def test_empty_moments_have_no_std():
+    assert Moments.fromValues([np.nan]).std() is None
+    assert Moments().merge(Moments()).std() is None
+
+
+@pytest.mark.parametrize("q", [0.5, 0.9, 0.99])
+def test_digests_of_the_quantile_grid_pool_the_percentiles(q):
+    # what the percentile buckets carry: their quantiles at SKETCH_QUANTILES
+    groups = [RNG.lognormal(RNG.uniform(0, 2), RNG.uniform(0.2, 1), RNG.integers(200, 3000)) for _ in range(30)]
+    merged = TDigest()
+    for group in groups:
+        merged = merged.merge(TDigest.fromQuantiles(list(np.quantile(group, SKETCH_QUANTILES)), len(group)))
+    assert merged.quantile(q) == pytest.approx(np.quantile(np.concatenate(groups), q), rel=0.05)
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+sys.path.append(os.path.abspath("."))
+from src.plugins.kpi import repository
+from src.plugins.kpi.schema import Value
+from src.plugins.kpi.snapshot import readSnapshot
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pytest.importorskip("pyarrow")
+
+START = datetime(2024, 1, 30, 12)
+
+
+def test_refresh_writes_one_partition_per_month(tmp_path):
+    machine = str(ObjectId())
+
+    async def run():
+        kpis_collection = mongomock_motor.AsyncMongoMockClient()["test_kpi_snapshot"]["kpis"]
+        kpi = await repository.createKPI("snapshot_test", "atomic", "", "", [], None, kpis_collection=kpis_collection)
+        await repository.insertKPIData(str(kpi.id), [
+            Value(datetime=START + timedelta(days=day), machine_id=machine, avg=day, min=day, max=day, sum=day)
+            for day in range(70)
+        ], kpis_collection=kpis_collection)
+        written = await repository.refreshSnapshot(str(kpi.id), kpis_collection=kpis_collection, directory=str(tmp_path))
+        return str(kpi.id), written
+
+    kpi_id, written = asyncio.run(run())
+    assert written == 70
+    assert sorted(path.name for path in (tmp_path / f"kpi_id={kpi_id}").iterdir()) == [
+        "_snapshot.json", "month=2024-01", "month=2024-02", "month=2024-03", "month=2024-04"
+    ]
+    frame = readSnapshot(kpi_id, [machine], START, START + timedelta(days=69), directory=str(tmp_path))
+    assert sorted(frame["sum"].tolist()) == list(range(70))
+    assert not any(path.name.startswith(f"kpi_id={kpi_id}.") for path in tmp_path.iterdir())
+
+
+def test_refresh_of_a_kpi_without_points(tmp_path):
+    async def run():
+        kpis_collection = mongomock_motor.AsyncMongoMockClient()["test_kpi_snapshot"]["kpis"]
+        kpi = await repository.createKPI("snapshot_empty", "atomic", "", "", [], None, kpis_collection=kpis_collection)
+        written = await repository.refreshSnapshot(str(kpi.id), kpis_collection=kpis_collection, directory=str(tmp_path))
+        return str(kpi.id), written
+
+    kpi_id, written = asyncio.run(run())
+    assert written == 0
+    assert [path.name for path in (tmp_path / f"kpi_id={kpi_id}").iterdir()] == ["_snapshot.json"]
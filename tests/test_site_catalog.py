@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from bson import ObjectId
+
+sys.path.append(os.path.abspath("."))
+from src.core.invalidation import InvalidationEvent
+from src.plugins.site import repository as siteRepository
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def cached_catalogs():
+    sites = mongomock_motor.AsyncMongoMockClient()["test_site_catalog"]["sites"]
+    ids = {1: ObjectId(), 2: ObjectId()}
+
+    async def load():
+        for site_id, _id in ids.items():
+            await sites.insert_one({"_id": _id, "site_id": site_id, "kpis_ids": [], "kpis_catalog": [{"name": f"kpi_{site_id}"}]})
+            await siteRepository.getKPICatalog(site_id, sites_collection=sites)
+
+    siteRepository.catalog_cache.clear()
+    asyncio.run(load())
+    return ids
+
+
+def test_change_stream_event_invalidates_one_site():
+    ids = cached_catalogs()
+    siteRepository.onCatalogChange(InvalidationEvent("sites", "update", ids[1], ("kpis_catalog",)))
+    assert siteRepository.catalog_cache.get(1) is None
+    assert siteRepository.catalog_cache.get(2) == [{"name": "kpi_2"}]
+
+
+def test_polling_event_invalidates_one_site():
+    cached_catalogs()
+    siteRepository.onCatalogChange(InvalidationEvent("sites", "update", 2))
+    assert siteRepository.catalog_cache.get(1) == [{"name": "kpi_1"}]
+    assert siteRepository.catalog_cache.get(2) is None
+
+
+def test_site_not_cached_keeps_the_catalogs():
+    cached_catalogs()
+    siteRepository.onCatalogChange(InvalidationEvent("sites", "insert", ObjectId()))
+    assert siteRepository.catalog_cache.get(1) is not None
+    assert siteRepository.catalog_cache.get(2) is not None
+
+
+def test_kpi_events_clear_the_catalogs():
+    cached_catalogs()
+    siteRepository.onCatalogChange(InvalidationEvent("kpis", "update", ObjectId(), ("name",)))
+    assert siteRepository.catalog_cache.get(1) is None
+    assert siteRepository.catalog_cache.get(2) is None